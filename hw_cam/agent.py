@@ -0,0 +1,250 @@
+"""Edge agent reporting the occupancy of the table to the kicker server.
+
+Occupancy changes are appended to a small journal on disk, then sent in
+order and in batches to /kicker/telemetry by a background thread, over one
+keep-alive connection:
+
+    agent = Agent('http://odoo:8069', token, 'journal.jsonl')
+    agent.start()
+    agent.record(occupied=False)
+    agent.record(occupied=True, motion=0.12)
+    ...
+    agent.stop()
+
+While the server cannot be reached, the events stay in the journal, so that
+they also survive a restart, and sending is retried with an exponential
+backoff. Requests are at least ``min_interval`` seconds apart and carry at
+most ``batch_size`` events; the journal keeps the last ``max_events``. The
+heartbeat repeats the last recorded state: record the initial one at startup.
+"""
+import http.client
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+_logger = logging.getLogger(__name__)
+
+TELEMETRY_PATH = '/kicker/telemetry'
+
+
+class Journal(object):
+    """Events waiting to be sent, oldest first, kept in a file of one JSON
+    object per line.
+
+    In memory, every event gets a sequence number: the events sent are popped
+    by number, so that the ones ``append`` dropped meanwhile to make room do
+    not shift the head of the journal.
+    """
+
+    def __init__(self, path, max_events=10000):
+        self.path = path
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._events = [self._number(event) for event in self._load()]
+
+    def _number(self, event):
+        self._seq += 1
+        return self._seq, event
+
+    def _load(self):
+        events = []
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # last line cut by a power loss
+                        continue
+        except FileNotFoundError:
+            pass
+        return events[-self.max_events:]
+
+    def _rewrite(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as journal:
+            journal.writelines(json.dumps(event) + '\n' for seq, event in self._events)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
+
+    def append(self, event):
+        with self._lock:
+            self._events.append(self._number(event))
+            if len(self._events) > self.max_events:
+                # the server is away for long: the oldest changes matter the least
+                del self._events[:len(self._events) - self.max_events]
+                self._rewrite()
+                return
+            with open(self.path, 'a') as journal:
+                journal.write(json.dumps(event) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def peek(self, count):
+        """Return the (sequence number, event) of the ``count`` oldest events."""
+        with self._lock:
+            return self._events[:count]
+
+    def pop(self, seq):
+        """Drop the events up to sequence number ``seq``, once sent."""
+        with self._lock:
+            count = 0
+            while count < len(self._events) and self._events[count][0] <= seq:
+                count += 1
+            if count:
+                del self._events[:count]
+                self._rewrite()
+
+
+class Agent(object):
+
+    def __init__(self, url, token, journal_path, batch_size=50, min_interval=1.0, heartbeat=300.0,
+                 backoff=1.0, max_backoff=300.0, timeout=10.0, max_events=10000):
+        """
+        :param url: base URL of the kicker server, e.g. http://odoo:8069
+        :param token: token of the kicker
+        :param journal_path: file where the events wait to be sent
+        :param batch_size: maximum number of events per request
+        :param min_interval: minimum delay between two requests, in seconds
+        :param heartbeat: delay after which the current status is sent again
+                          when nothing changed, in seconds (0 to disable)
+        :param backoff: delay before retrying after a first failure, doubled
+                        at every failure up to ``max_backoff``, in seconds
+        :param timeout: timeout of the requests, in seconds
+        :param max_events: maximum number of events kept in the journal
+        """
+        parsed = urllib.parse.urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection if parsed.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path.rstrip('/') + TELEMETRY_PATH
+        self.token = token
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.journal = Journal(journal_path, max_events=max_events)
+        self.requests = 0
+        self.failures = 0
+        self._connection = None
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._occupied = None
+        self._next_request = 0.0
+        self._last_sent = time.monotonic()
+
+    def record(self, occupied, date=None, **values):
+        """Queue a change of occupancy, with extra numeric ``values`` (e.g. the motion ratio)."""
+        event = dict(values, date=date or time.time(), available=not occupied)
+        self.journal.append(event)
+        with self._condition:
+            self._occupied = occupied
+            self._condition.notify_all()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='kicker-agent')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop sending, after trying to flush the journal for ``timeout`` seconds."""
+        if timeout:
+            self.flush(timeout)
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+        self._close()
+
+    def flush(self, timeout=None):
+        """Wait until the journal is empty; return whether it is."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while len(self.journal) and self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return not len(self.journal)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                if len(self.journal):
+                    wake_at = self._next_request
+                elif self.heartbeat and self._occupied is not None:
+                    wake_at = max(self._next_request, self._last_sent + self.heartbeat)
+                else:
+                    wake_at = None
+                if wake_at is None or wake_at > now:
+                    self._condition.wait(None if wake_at is None else wake_at - now)
+                    continue
+            self._send()
+
+    def _send(self):
+        batch = self.journal.peek(self.batch_size)
+        samples = [event for seq, event in batch] or [{'date': time.time(), 'available': not self._occupied}]
+        now = time.monotonic()
+        self._next_request = now + self.min_interval
+        try:
+            accepted = self._post(samples)
+        except (OSError, http.client.HTTPException, ValueError) as err:
+            self.failures += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+            # jitter, so that kickers do not all come back at the same time
+            self._next_request = now + max(self.min_interval, delay * random.uniform(0.5, 1.0))
+            _logger.warning("Sending %d events failed (%s), retrying in %.1fs",
+                            len(samples), err, self._next_request - now)
+            self._close()
+            return
+        self.failures = 0
+        self._last_sent = now
+        if not accepted:
+            # retrying will not help
+            _logger.error("The server rejected %d events, check the token", len(samples))
+        if batch:
+            self.journal.pop(batch[-1][0])
+        with self._condition:
+            self._condition.notify_all()
+
+    def _post(self, samples):
+        """Send ``samples`` to the server; return whether they were accepted."""
+        if self._connection is None:
+            self._connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'id': None,
+                           'params': {'token': self.token, 'samples': samples}})
+        self.requests += 1
+        self._connection.request('POST', self.path, body=body, headers={'Content-Type': 'application/json'})
+        response = self._connection.getresponse()
+        # read the whole response, for the connection to be reused
+        data = response.read()
+        if response.status != 200:
+            raise http.client.HTTPException("HTTP %d" % response.status)
+        result = json.loads(data.decode('utf-8'))
+        if result.get('error'):
+            raise ValueError(result['error'].get('message', 'server error'))
+        return bool(result.get('result'))
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,143 @@
+"""Speed and accuracy benchmark of the occupancy detector on synthetic clips.
+
+    python -m hw_cam.benchmark --resolutions 640x480,1280x720 --widths 320,0
+
+The clips are generated in memory from a seeded random generator, so that runs
+are comparable: an empty table with sensor noise ('static'), players coming to
+the table for the middle third of the clip ('players') and an empty table with
+the light slowly changing ('lighting'). Every frame comes with the expected
+occupancy, which the debounced detector output is compared against.
+"""
+import argparse
+import itertools
+import resource
+import time
+import tracemalloc
+
+import numpy
+
+try:
+    from .detector import Detector, OccupancyState
+except ImportError:
+    from detector import Detector, OccupancyState
+
+SCENARIOS = ('static', 'players', 'lighting')
+# frames of the memory pass: the memory of the detector is steady after the
+# first one, and they are all drawn before tracing
+MEMORY_FRAMES = 30
+STAGES = ('resize', 'grayscale', 'blur', 'absdiff', 'threshold', 'accumulateWeighted')
+
+
+def synthetic_clip(scenario, width=640, height=480, frames=300, seed=42):
+    """Yield (frame_index, BGR frame, occupied) for a synthetic clip."""
+    rng = numpy.random.RandomState(seed)
+    # a few noise planes, cycled through: drawing new ones for every frame is
+    # slower than the detector itself
+    noise = [rng.normal(0, 2, size=(height, width, 3)).astype(numpy.float32) for i in range(7)]
+    background = numpy.empty((height, width, 3), dtype=numpy.float32)
+    background[:] = (60, 60, 60)
+    # the table, seen from above
+    background[height // 4:3 * height // 4, width // 6:5 * width // 6] = (40, 120, 40)
+    player_width, player_height = max(4, width // 8), max(4, height // 5)
+    arrival, departure = frames // 3, 2 * frames // 3
+    for frame_index in range(1, frames + 1):
+        frame = background.copy()
+        occupied = scenario == 'players' and arrival <= frame_index < departure
+        if occupied:
+            # four players on both long sides of the table, moving along it
+            for i in range(4):
+                phase = frame_index * 0.3 + i * 1.7
+                x = int(width // 4 + (i % 2) * width // 3 + numpy.sin(phase) * width // 12)
+                y = height // 20 if i < 2 else height - height // 20 - player_height
+                frame[y:y + player_height, x:x + player_width] = (30, 30, 150 + 20 * i)
+        if scenario == 'lighting':
+            frame *= 1.0 + 0.3 * numpy.sin(numpy.pi * frame_index / frames)
+        frame += noise[frame_index % len(noise)]
+        yield frame_index, numpy.clip(frame, 0, 255).astype(numpy.uint8), occupied
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def peak_memory(scenario, width, height, detector_kwargs=None):
+    """Peak memory allocated by a detector processing the first frames of
+    a clip, the frames themselves excluded."""
+    clip = [frame for frame_index, frame, expected in
+            itertools.islice(synthetic_clip(scenario, width, height), MEMORY_FRAMES)]
+    detector = Detector(**(detector_kwargs or {}))
+    tracemalloc.start()
+    try:
+        for frame in clip:
+            detector.process(frame)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(scenario, width, height, frames, detector_kwargs=None, state_kwargs=None):
+    detector = Detector(profile=True, **(detector_kwargs or {}))
+    state = OccupancyState(**(state_kwargs or {}))
+    latencies = []
+    correct = transitions = 0
+    # timed without tracing, which slows allocations down; the memory is
+    # measured in a pass of its own
+    for frame_index, frame, expected in synthetic_clip(scenario, width, height, frames):
+        start = time.perf_counter()
+        ratio = detector.process(frame)
+        if ratio is not None:
+            transitions += state.update(ratio)
+        latencies.append(time.perf_counter() - start)
+        correct += state.occupied == expected
+    peak = peak_memory(scenario, width, height, detector_kwargs)
+    total = sum(latencies)
+    return {
+        'scenario': scenario,
+        'resolution': '%dx%d' % (width, height),
+        'width': detector.width or width,
+        'fps': len(latencies) / total if total else 0.0,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'stages': {stage: sum(detector.timings[stage]) / max(1, len(detector.timings[stage]))
+                   for stage in STAGES},
+        'peak_memory': peak,
+        'accuracy': correct / float(frames),
+        # the players scenario has two real transitions, the others none
+        'false_transitions': max(0, transitions - (2 if scenario == 'players' else 0)),
+    }
+
+
+def print_result(res):
+    print("{scenario:<9} {resolution:>9} @{width:<5} {fps:8.1f} fps  p50 {p50_ms:6.2f} ms  p99 {p99_ms:6.2f} ms  "
+          "peak {peak_mb:6.1f} MB  accuracy {accuracy:6.1%}  false transitions {false_transitions}".format(
+              p50_ms=res['p50'] * 1000, p99_ms=res['p99'] * 1000, peak_mb=res['peak_memory'] / 1048576.0, **res))
+    print("          " + "  ".join("%s %.3f ms" % (stage, res['stages'][stage] * 1000) for stage in STAGES))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument("--resolutions", default="640x480,1280x720,1920x1080", help="comma separated WxH of the clips")
+    ap.add_argument("--widths", default="320,0", help="comma separated processing widths (0 for the full resolution)")
+    ap.add_argument("--frames", type=int, default=300, help="frames per clip")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenarios")
+    args = ap.parse_args(argv)
+
+    results = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        for processing_width in args.widths.split(','):
+            for scenario in args.scenarios.split(','):
+                res = run_scenario(scenario, width, height, args.frames,
+                                   detector_kwargs={'width': int(processing_width) or None})
+                print_result(res)
+                results.append(res)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("max RSS of the benchmark: %.1f MB" % (rss / 1024.0))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Kicker occupancy detection by background subtraction.
+
+The detector keeps a running average of the (downscaled, blurred, grayscale)
+frames of the table and measures, for every new frame, the ratio of pixels
+that differ from it by more than a threshold. Players moving around the table
+keep that ratio up; an empty table keeps it close to zero.
+
+    camera = cv2.VideoCapture('clip.mp4')
+    for frame_index, ratio, occupied in detect(camera, Detector(width=320)):
+        ...
+"""
+import collections
+import os
+import time
+
+import cv2
+
+
+class Detector(object):
+
+    def __init__(self, threshold=10, accumulation=0.1, width=320, roi=None, blur=11, profile=False):
+        """
+        :param threshold: minimum gray level difference for a pixel to count as changed
+        :param accumulation: weight of a new frame in the background model
+        :param width: width frames are downscaled to before processing (None to keep it)
+        :param roi: (x, y, w, h) region of the table in the original frame (None for all of it)
+        :param blur: size of the gaussian kernel, at the processing resolution
+        :param profile: record the duration of every stage in ``timings``
+        """
+        self.threshold = threshold
+        self.accumulation = accumulation
+        self.width = width
+        self.roi = roi
+        self.blur = blur | 1  # kernel sizes must be odd
+        self.mean_frame = None
+        self.frame_thresh = None
+        self.timings = collections.defaultdict(list) if profile else None
+
+    def _run(self, stage, func, *args):
+        if self.timings is None:
+            return func(*args)
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def _resize(self, frame):
+        if self.roi:
+            x, y, w, h = self.roi
+            frame = frame[y:y + h, x:x + w]
+        if self.width and frame.shape[1] > self.width:
+            height = max(1, int(round(frame.shape[0] * self.width / float(frame.shape[1]))))
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _grayscale(self, frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def _blur(self, frame):
+        return cv2.GaussianBlur(frame, (self.blur, self.blur), 0)
+
+    def _absdiff(self, frame):
+        return cv2.absdiff(cv2.convertScaleAbs(self.mean_frame), frame)
+
+    def _threshold(self, frame_delta):
+        self.frame_thresh = cv2.threshold(frame_delta, self.threshold, 255, cv2.THRESH_BINARY)[1]
+        return cv2.countNonZero(self.frame_thresh) / float(self.frame_thresh.size)
+
+    def _accumulate(self, frame):
+        cv2.accumulateWeighted(frame, self.mean_frame, self.accumulation)
+
+    def preprocess(self, frame):
+        frame = self._run('resize', self._resize, frame)
+        frame = self._run('grayscale', self._grayscale, frame)
+        return self._run('blur', self._blur, frame)
+
+    def process(self, frame):
+        """Return the ratio of changed pixels in ``frame``, None for the first frame
+        (which initializes the background model)."""
+        frame = self.preprocess(frame)
+        if self.mean_frame is None:
+            self.mean_frame = frame.astype('float32')
+            return None
+        frame_delta = self._run('absdiff', self._absdiff, frame)
+        ratio = self._run('threshold', self._threshold, frame_delta)
+        self._run('accumulateWeighted', self._accumulate, frame)
+        return ratio
+
+    def dump(self, directory, frame_index):
+        """Write the last thresholded frame and the background model, for debugging."""
+        if self.frame_thresh is None:
+            return
+        cv2.imwrite(os.path.join(directory, 'frame_%d.png' % frame_index), self.frame_thresh)
+        cv2.imwrite(os.path.join(directory, 'mean_%d.png' % frame_index), cv2.convertScaleAbs(self.mean_frame))
+
+
+class OccupancyState(object):
+    """Debounced occupied/free state.
+
+    The table becomes occupied after ``on_frames`` consecutive frames with a
+    ratio above ``on_ratio`` and free again after ``off_frames`` consecutive
+    frames below ``off_ratio``; anything in between keeps the current state.
+    """
+
+    def __init__(self, on_ratio=0.05, off_ratio=0.02, on_frames=3, off_frames=30, occupied=False):
+        self.on_ratio = on_ratio
+        self.off_ratio = off_ratio
+        self.on_frames = on_frames
+        self.off_frames = off_frames
+        self.occupied = occupied
+        self._count = 0
+
+    def update(self, ratio):
+        """Feed a new ratio; return True if the state changed."""
+        if self.occupied:
+            candidate = ratio < self.off_ratio
+            needed = self.off_frames
+        else:
+            candidate = ratio > self.on_ratio
+            needed = self.on_frames
+        self._count = self._count + 1 if candidate else 0
+        if self._count >= needed:
+            self.occupied = not self.occupied
+            self._count = 0
+            return True
+        return False
+
+
+def read_frames(capture, skip=0):
+    """Yield (frame_index, frame) from an OpenCV capture, only decoding one frame
+    every ``skip + 1``."""
+    frame_index = 0
+    while True:
+        grabbed, frame = capture.read()
+        if not grabbed:
+            return
+        frame_index += 1
+        yield frame_index, frame
+        for i in range(skip):
+            if not capture.grab():
+                return
+            frame_index += 1
+
+
+def detect(capture, detector=None, state=None, skip=0, debug_dir=None, debug_every=100):
+    """Yield (frame_index, motion_ratio, occupied) for the frames of ``capture``.
+
+    ``capture`` is an OpenCV capture or any iterable of (frame_index, frame).
+    Debug images are written to ``debug_dir``, if given, every ``debug_every``
+    processed frames.
+    """
+    detector = detector or Detector()
+    state = state or OccupancyState()
+    frames = read_frames(capture, skip=skip) if hasattr(capture, 'read') else capture
+    processed = 0
+    for frame_index, frame in frames:
+        ratio = detector.process(frame)
+        if ratio is None:
+            continue
+        state.update(ratio)
+        processed += 1
+        if debug_dir and debug_every and processed % debug_every == 0:
+            detector.dump(debug_dir, frame_index)
+        yield frame_index, ratio, state.occupied
+
+
+def transitions(results):
+    """Only keep the results of ``detect`` where the occupancy changed."""
+    occupied = False
+    for frame_index, ratio, new_occupied in results:
+        if new_occupied != occupied:
+            occupied = new_occupied
+            yield frame_index, ratio, occupied
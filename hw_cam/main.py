@@ -1,58 +1,146 @@
 import argparse
 import time
 import cv2
-import numpy
-
-# construct the argument parser and parse the arguments
-ap = argparse.ArgumentParser()
-ap.add_argument("-v", "--video", help="path to the video file")
-ap.add_argument("-t", "--threshold", type=int, default=10, help="minimum threshold")
-ap.add_argument("-d", "--delay", type=float, default=0, help="delay between frames processing (ignored if video file is specified)")
-ap.add_argument("-a", "--accumalation", type=float, default=0.1, help="accumalation factor; e.g 0.5 to combine the mean image with the new image with the same weight")
-args = vars(ap.parse_args())
-
-if args.get("video", None) is None:
-    # 0 is probably the webcam
-    camera = cv2.VideoCapture(0)
-    time.sleep(0.25)
-else:
-    camera = cv2.VideoCapture(args["video"])
-
-# initialize the first frame in the video stream
-mean_frame = None
-frame_count = 0
-thresh = args['threshold']
-
-while True:
-    # grab the current frame and initialize the occupied/unoccupied
-    # text
-    (grabbed, frame) = camera.read()
-    text = "Unoccupied"
-    frame_count += 1
-
-    # if the frame could not be grabbed, then we have reached the end
-    # of the video
-    if not grabbed:
-        break
-
-    # resize the frame, convert it to grayscale, and blur it
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    frame = cv2.GaussianBlur(frame, (21, 21), 0)
-
-    if mean_frame is None:
-        print("[INFO] starting background model...")
-        mean_frame = frame.copy().astype("float")
-        continue
-
-    frame_delta = cv2.absdiff(cv2.convertScaleAbs(mean_frame), frame)
-    frame_thresh = cv2.threshold(frame_delta, thresh, 255, cv2.THRESH_BINARY)[1]
-    percentage = numpy.sum(frame_thresh) / 255.0 / frame_thresh.size
-    cv2.imwrite('frame_%d.png' % frame_count, frame_thresh)
-    cv2.imwrite('mean_%d.png' % frame_count, mean_frame)
-
-    print("Frame {:d}: diff {:.2%}".format(frame_count, percentage))
-
-    if args.get('delay') and not args.get('video'):
-        time.sleep(args.get('delay'))
-
-    cv2.accumulateWeighted(frame, mean_frame, 0.1)
+
+try:
+    from .agent import Agent
+    from .detector import Detector, OccupancyState, detect
+    from .pipeline import ThreadedCapture, analyze_video
+except ImportError:
+    # run as a script: python main.py
+    from agent import Agent
+    from detector import Detector, OccupancyState, detect
+    from pipeline import ThreadedCapture, analyze_video
+
+
+def parse_roi(value):
+    roi = tuple(int(v) for v in value.split(','))
+    if len(roi) != 4:
+        raise argparse.ArgumentTypeError("expected x,y,w,h")
+    return roi
+
+
+def get_parser():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video", help="path to the video file")
+    ap.add_argument("-t", "--threshold", type=int, default=10, help="minimum threshold")
+    ap.add_argument("-d", "--delay", type=float, default=0, help="delay between frames processing (ignored if video file is specified)")
+    ap.add_argument("-a", "--accumalation", type=float, default=0.1, help="accumalation factor; e.g 0.5 to combine the mean image with the new image with the same weight")
+    ap.add_argument("-w", "--width", type=int, default=320, help="width frames are downscaled to before processing (0 to keep the full resolution)")
+    ap.add_argument("-r", "--roi", type=parse_roi, help="region of the table in the frame, as x,y,w,h")
+    ap.add_argument("-b", "--blur", type=int, default=11, help="size of the gaussian blur, at the processing resolution")
+    ap.add_argument("-s", "--skip", type=int, default=0, help="number of frames skipped between two processed frames")
+    ap.add_argument("--on-ratio", type=float, default=0.05, help="diff ratio above which the table is considered in use")
+    ap.add_argument("--off-ratio", type=float, default=0.02, help="diff ratio below which the table is considered free")
+    ap.add_argument("--on-frames", type=int, default=3, help="consecutive frames above --on-ratio to become occupied")
+    ap.add_argument("--off-frames", type=int, default=30, help="consecutive frames below --off-ratio to become free")
+    ap.add_argument("--debug-dir", help="directory where debug images are written (disabled by default)")
+    ap.add_argument("--debug-every", type=int, default=100, help="write debug images every N processed frames")
+    ap.add_argument("-q", "--quiet", action="store_true", help="only print occupancy changes")
+    ap.add_argument("--threaded", action="store_true", help="capture frames in a separate thread, dropping the oldest ones when processing is late")
+    ap.add_argument("--queue-size", type=int, default=2, help="frames buffered between the capture thread and the processing")
+    ap.add_argument("-p", "--processes", type=int, default=1, help="analyze the video file in chunks with N processes (0 for one per CPU)")
+    ap.add_argument("--chunk-size", type=int, help="frames per chunk when analyzing with several processes")
+    ap.add_argument("--warmup", type=int, default=50, help="frames processed before each chunk to build its background model")
+    ap.add_argument("--server", help="URL of the kicker server occupancy changes are sent to, e.g. http://odoo:8069")
+    ap.add_argument("--token", help="token of the kicker on the server")
+    ap.add_argument("--journal", default="hw_cam_journal.jsonl", help="file where the changes wait to be sent")
+    ap.add_argument("--batch-size", type=int, default=50, help="maximum number of changes sent per request")
+    ap.add_argument("--min-interval", type=float, default=1.0, help="minimum delay between two requests, in seconds")
+    ap.add_argument("--heartbeat", type=float, default=300.0, help="delay after which the status is sent again when nothing changed, in seconds (0 to disable)")
+    ap.add_argument("--max-backoff", type=float, default=300.0, help="maximum delay between two attempts while the server is unreachable, in seconds")
+    return ap
+
+
+def detector_kwargs(args):
+    return dict(threshold=args.threshold, accumulation=args.accumalation,
+                width=args.width or None, roi=args.roi, blur=args.blur)
+
+
+def state_kwargs(args):
+    return dict(on_ratio=args.on_ratio, off_ratio=args.off_ratio,
+                on_frames=args.on_frames, off_frames=args.off_frames)
+
+
+def make_detector(args):
+    return Detector(**detector_kwargs(args)), OccupancyState(**state_kwargs(args))
+
+
+def open_capture(args):
+    if args.video is None:
+        # 0 is probably the webcam
+        camera = cv2.VideoCapture(0)
+        time.sleep(0.25)
+    else:
+        camera = cv2.VideoCapture(args.video)
+    return camera
+
+
+def make_agent(args):
+    if not args.server:
+        return None
+    if not args.token:
+        raise SystemExit("--token is required with --server")
+    return Agent(args.server, args.token, args.journal, batch_size=args.batch_size,
+                 min_interval=args.min_interval, heartbeat=args.heartbeat, max_backoff=args.max_backoff)
+
+
+def report(results, args, agent=None):
+    occupied = False
+    if agent:
+        # the server learns the state at startup, and the heartbeat has one to repeat
+        agent.record(occupied)
+    for frame_index, ratio, new_occupied in results:
+        if not args.quiet:
+            print("Frame {:d}: diff {:.2%}".format(frame_index, ratio))
+        if new_occupied != occupied:
+            occupied = new_occupied
+            print("Frame {:d}: {}".format(frame_index, "Occupied" if occupied else "Unoccupied"))
+            if agent:
+                agent.record(occupied, motion=round(ratio, 4))
+        if args.delay and not args.video:
+            time.sleep(args.delay)
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    agent = make_agent(args)
+    if agent:
+        agent.start()
+    try:
+        run(args, agent)
+    finally:
+        if agent:
+            # what is left is sent at the next start
+            agent.stop(timeout=5)
+            print("[INFO] {:d} requests sent, {:d} changes left in the journal".format(
+                agent.requests, len(agent.journal)))
+
+
+def run(args, agent=None):
+    if args.video and args.processes != 1:
+        results, mean_frame = analyze_video(args.video, processes=args.processes or None,
+                                            chunk_size=args.chunk_size, warmup=args.warmup, skip=args.skip,
+                                            detector_kwargs=detector_kwargs(args), state_kwargs=state_kwargs(args))
+        report(results, args, agent)
+        return
+
+    camera = open_capture(args)
+    detector, state = make_detector(args)
+    frames = camera
+    if args.threaded:
+        frames = ThreadedCapture(camera, queue_size=args.queue_size, skip=args.skip)
+    print("[INFO] starting background model...")
+    try:
+        report(detect(frames, detector, state, skip=args.skip,
+                      debug_dir=args.debug_dir, debug_every=args.debug_every), args, agent)
+    finally:
+        if args.threaded:
+            frames.stop()
+            print("[INFO] {:d} frames dropped".format(frames.dropped))
+        camera.release()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Concurrent runners for the occupancy detector.
+
+* ThreadedCapture reads a live camera in its own thread, so that slow frames
+  are dropped instead of delaying the capture;
+* analyze_video splits a recorded video into chunks analyzed by a process
+  pool, then stitches the results back together.
+"""
+import collections
+import multiprocessing
+import threading
+
+import cv2
+
+try:
+    from .detector import Detector, OccupancyState, detect, read_frames
+except ImportError:
+    from detector import Detector, OccupancyState, detect, read_frames
+
+
+class ThreadedCapture(object):
+    """Iterable of (frame_index, frame) fed by a capture thread through a bounded
+    queue; when processing falls behind, the oldest frames are dropped."""
+
+    def __init__(self, capture, queue_size=2, skip=0):
+        self.capture = capture
+        self.skip = skip
+        self.dropped = 0
+        self._frames = collections.deque(maxlen=queue_size)
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        for frame_index, frame in read_frames(self.capture, skip=self.skip):
+            with self._condition:
+                if not self._running:
+                    break
+                if len(self._frames) == self._frames.maxlen:
+                    self.dropped += 1
+                self._frames.append((frame_index, frame))
+                self._condition.notify()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                while not self._frames and self._running:
+                    self._condition.wait()
+                if not self._frames:
+                    return
+                item = self._frames.popleft()
+            yield item
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._frames.clear()
+            self._condition.notify()
+        self._thread.join()
+
+
+def _analyze_chunk(args):
+    path, start, stop, warmup, skip, detector_kwargs = args
+    capture = cv2.VideoCapture(path)
+    step = skip + 1
+    # the first frame decoded only initializes the background model: start at
+    # least one decoded frame early, so that the chunk gets a ratio for all of
+    # its own frames; and on a multiple of the step, so that the chunk decodes
+    # the same frames as a serial run (1, 1 + step, ...)
+    first = max(0, start - max(warmup, step)) // step * step
+    capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+    detector = Detector(**detector_kwargs)
+    ratios = []
+    frames = 0
+    # frame indexes are 1-based, like read_frames
+    for offset, frame in read_frames(capture, skip=skip):
+        frame_index = first + offset
+        if stop is not None and frame_index > stop:
+            break
+        ratio = detector.process(frame)
+        if frame_index > start:
+            frames += 1
+            if ratio is not None:
+                ratios.append((frame_index, ratio))
+    capture.release()
+    return ratios, detector.mean_frame, frames
+
+
+def analyze_video(path, processes=None, chunk_size=None, warmup=50, skip=0,
+                  detector_kwargs=None, state_kwargs=None):
+    """Analyze a recorded video in parallel.
+
+    Every chunk starts ``warmup`` frames early so that its background model
+    has converged by the time its own frames are processed. The debounced
+    occupancy is then replayed over the concatenated ratios, in order, since
+    it depends on the whole history.
+
+    Return ([(frame_index, motion_ratio, occupied)], background model), the
+    background model being the mean of the ones of the chunks, weighted by
+    their number of frames.
+
+    The chunks are planned from the frame count of the container, which is
+    only an estimate for some formats: the last chunk reads up to the actual
+    end, and videos without a frame count are analyzed serially.
+    """
+    capture = cv2.VideoCapture(path)
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count <= 0:
+        detector = Detector(**(detector_kwargs or {}))
+        try:
+            results = list(detect(capture, detector, OccupancyState(**(state_kwargs or {})), skip=skip))
+        finally:
+            capture.release()
+        return results, detector.mean_frame
+    capture.release()
+    processes = processes or multiprocessing.cpu_count()
+    chunk_size = chunk_size or max(1, -(-frame_count // processes))
+    chunks = [(path, start, start + chunk_size if start + chunk_size < frame_count else None,
+               warmup, skip, detector_kwargs or {})
+              for start in range(0, frame_count, chunk_size)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunk_results = pool.map(_analyze_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    state = OccupancyState(**(state_kwargs or {}))
+    results = []
+    mean_sum, mean_weight = None, 0
+    for ratios, chunk_mean, frames in chunk_results:
+        for frame_index, ratio in ratios:
+            state.update(ratio)
+            results.append((frame_index, ratio, state.occupied))
+        if chunk_mean is not None and frames:
+            weighted = chunk_mean * frames
+            mean_sum = weighted if mean_sum is None else mean_sum + weighted
+            mean_weight += frames
+    return results, (mean_sum / mean_weight if mean_weight else None)
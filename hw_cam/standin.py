@@ -0,0 +1,115 @@
+"""Stand-in for the kicker server, to try the edge agent without Odoo.
+
+    python -m hw_cam.standin --port 8069 --token test --flaky 0.3
+
+It answers /kicker/telemetry like the server does, keeps the samples it got
+in order and counts the requests and connections. Setting ``up`` to False,
+or ``--flaky``, makes it answer 503 to play an outage:
+
+    server = StandInServer(token='test')
+    server.start()
+    agent = Agent(server.url, 'test', 'journal.jsonl')
+    ...
+    server.stop()
+"""
+import argparse
+import http.server
+import json
+import random
+import socketserver
+import threading
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, like the server behind its proxy
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(StandInHandler, self).setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _answer(self, status, result=None):
+        body = json.dumps({'jsonrpc': '2.0', 'id': None, 'result': result}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))['params']
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if self.path != '/kicker/telemetry':
+                return self._answer(404)
+            if not server.up or random.random() < server.flaky:
+                return self._answer(503)
+            if server.token and params['token'] != server.token:
+                return self._answer(200, False)
+            server.samples.extend(params['samples'])
+        if server.verbose:
+            for sample in params['samples']:
+                print(json.dumps(sample, sort_keys=True))
+        return self._answer(200, True)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(StandInHandler, self).log_message(format, *args)
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, token=None, flaky=0.0, verbose=False):
+        """
+        :param port: port to listen on (0 for any free one, see ``url``)
+        :param token: token the samples must come with (any token when empty)
+        :param flaky: probability of answering 503 to a request
+        """
+        http.server.HTTPServer.__init__(self, (host, port), StandInHandler)
+        self.token = token
+        self.flaky = flaky
+        self.verbose = verbose
+        self.up = True
+        self.samples = []
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='standin')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default='127.0.0.1', help="address to listen on")
+    ap.add_argument("--port", type=int, default=8069, help="port to listen on")
+    ap.add_argument("--token", help="token the samples must come with (any token by default)")
+    ap.add_argument("--flaky", type=float, default=0.0, help="probability of answering 503 to a request")
+    args = ap.parse_args(argv)
+    server = StandInServer(args.host, args.port, token=args.token, flaky=args.flaky, verbose=True)
+    print("[INFO] listening on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Synthetic kicker dataset at production scale, for the benchmarks.
+
+Not loaded by the module, run it from an odoo shell on a disposable database:
+
+    odoo shell -d <db> <<< "from odoo.addons.kicker.benchmarks import dataset; dataset.generate(env, games=1000000)"
+
+Players, games, sessions and pings are inserted in SQL batches, bypassing the
+ORM; the stored computed and related fields they would have set (partner
+display name and commercial partner, game name and winning team, session
+result and date) are computed here, and the derived tables (stats, ratings, kicker
+statuses, ranking snapshots) are rebuilt once at the end.
+"""
+import datetime
+import logging
+import random
+import time
+
+_logger = logging.getLogger(__name__)
+
+PLAYER_PREFIX = 'Benchmark Player'
+
+
+def _insert_partners(cr, count, seed):
+    rng = random.Random(seed)
+    names = ['%s %d' % (PLAYER_PREFIX, i) for i in range(count)]
+    taglines = [rng.choice(['Goalkeeper', 'Striker', 'Spinner', 'Newbie', None]) for i in range(count)]
+    cr.execute("""
+        INSERT INTO res_partner (name, display_name, tagline, kicker_player, active, type, is_company,
+                                 customer, supplier, employee, partner_share,
+                                 create_uid, write_uid, create_date, write_date)
+        SELECT n.name, n.name, n.tagline, TRUE, TRUE, 'contact', FALSE,
+               TRUE, FALSE, FALSE, TRUE,
+               1, 1, now() at time zone 'UTC', now() at time zone 'UTC'
+          FROM unnest(%s::varchar[], %s::varchar[]) AS n(name, tagline)
+     RETURNING id
+    """, [names, taglines])
+    ids = [r[0] for r in cr.fetchall()]
+    # stored compute: a person is its own commercial partner
+    cr.execute("UPDATE res_partner SET commercial_partner_id = id WHERE id IN %s", [tuple(ids)])
+    return ids
+
+
+def _insert_games(cr, player_ids, kicker_ids, count, days, batch_size, seed):
+    """Insert ``count`` games spread over the last ``days`` days, with their
+    sessions. Most games are 2 vs 2; 1 in 10 is 1 vs 1."""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    # players have favourite kickers and usual teammates: pick them in a
+    # neighbourhood rather than uniformly, so that the pair stats look real
+    neighbourhood = max(8, len(player_ids) // 50)
+    inserted = 0
+    while inserted < count:
+        size = min(batch_size, count - inserted)
+        dates, kickers, scores_1, scores_2, teams = [], [], [], [], []
+        for i in range(size):
+            center = rng.randrange(len(player_ids))
+            pool = [player_ids[(center + j) % len(player_ids)] for j in range(neighbourhood)]
+            players = rng.sample(pool, 2 if rng.random() < 0.1 else 4)
+            loser_score = rng.randrange(0, 10)
+            team_1_won = rng.random() < 0.5
+            dates.append(today - datetime.timedelta(days=rng.randrange(days)))
+            kickers.append(kicker_ids[center % len(kicker_ids)])
+            scores_1.append(11 if team_1_won else loser_score)
+            scores_2.append(loser_score if team_1_won else 11)
+            teams.append(players)
+        cr.execute("""
+            INSERT INTO kicker_game (name, date, kicker_id, score_1, score_2, winning_team,
+                                     create_uid, write_uid, create_date, write_date)
+            SELECT g.date::varchar || '@' || k.name, g.date, g.kicker_id, g.score_1, g.score_2,
+                   CASE WHEN g.score_1 > g.score_2 THEN 'team_1' ELSE 'team_2' END,
+                   1, 1, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM unnest(%s::date[], %s::int[], %s::int[], %s::int[])
+                   WITH ORDINALITY AS g(date, kicker_id, score_1, score_2, n)
+              JOIN kicker_kicker k ON (k.id = g.kicker_id)
+          ORDER BY g.n
+         RETURNING id
+        """, [dates, kickers, scores_1, scores_2])
+        game_ids = [r[0] for r in cr.fetchall()]
+
+        session_games, session_teams, session_players, session_won, session_dates = [], [], [], [], []
+        for game_id, players, date, score_1, score_2 in zip(game_ids, teams, dates, scores_1, scores_2):
+            half = len(players) // 2
+            for index, player_id in enumerate(players):
+                team = 'team_1' if index < half else 'team_2'
+                session_games.append(game_id)
+                session_teams.append(team)
+                session_players.append(player_id)
+                session_won.append((team == 'team_1') == (score_1 > score_2))
+                session_dates.append(date)
+        cr.execute("""
+            INSERT INTO kicker_session (game_id, team, player_id, won, game_date,
+                                        create_uid, write_uid, create_date, write_date)
+            SELECT s.game_id, s.team, s.player_id, s.won, s.game_date,
+                   1, 1, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::varchar[], %s::int[], %s::boolean[], %s::date[])
+                   AS s(game_id, team, player_id, won, game_date)
+        """, [session_games, session_teams, session_players, session_won, session_dates])
+        inserted += size
+        _logger.info("Inserted %d/%d games", inserted, count)
+
+
+def _insert_pings(cr, kickers, count, days, batch_size, seed):
+    """Insert ``count`` status changes per kicker over the last ``days`` days,
+    alternating between busy and free."""
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    for kicker_id, token in kickers:
+        moments = sorted(now - datetime.timedelta(seconds=rng.randrange(days * 86400)) for i in range(count))
+        for start in range(0, count, batch_size):
+            batch = moments[start:start + batch_size]
+            cr.execute("""
+                INSERT INTO kicker_ping (kicker_id, kicker_token, create_date, available, ip_address,
+                                         create_uid, write_uid, write_date)
+                SELECT %s, %s, p.date, p.n %% 2 = 0, '127.0.0.1', 1, 1, p.date
+                  FROM unnest(%s::timestamp[]) WITH ORDINALITY AS p(date, n)
+            """, [kicker_id, token, batch])
+
+
+def generate(env, players=1000, kickers=5, games=100000, days=730, pings=10000, batch_size=10000, seed=42):
+    """Add ``players`` players, ``kickers`` kickers, ``games`` games with their
+    sessions and ``pings`` pings per kicker to the database, then rebuild the
+    derived tables and commit. Return the ids of the new players."""
+    cr = env.cr
+    start = time.time()
+    player_ids = _insert_partners(cr, players, seed)
+    kicker_records = env['kicker.kicker'].create([
+        {'name': 'Benchmark Kicker %d' % i, 'location': 'Benchmark'} for i in range(kickers)])
+    _insert_games(cr, player_ids, kicker_records.ids, games, days, batch_size, seed)
+    _insert_pings(cr, [(k.id, k.token) for k in kicker_records], pings, days, batch_size, seed)
+    env.invalidate_all()
+    _logger.info("Inserted the dataset in %.1fs, rebuilding the derived tables", time.time() - start)
+    env['kicker.game']._rebuild_stats()
+    env['kicker.kicker']._rebuild_status()
+    env['kicker.ranking.snapshot']._cron_snapshot()
+    cr.commit()
+    _logger.info("Generated %d players, %d games and %d pings in %.1fs",
+                 players, games, pings * kickers, time.time() - start)
+    return player_ids
@@ -0,0 +1,56 @@
+"""Latency of the matchmaking versus the size of the pool of players.
+
+Not loaded by the module, run it from an odoo shell on a database filled by
+``dataset.generate``:
+
+    odoo shell -d <db> <<< "from odoo.addons.kicker.benchmarks import matchmaking; matchmaking.run(env)"
+
+Pools are taken among the benchmark players who played the most; ``cold``
+includes loading the ratings of the pool, ``warm`` is served from the cache
+of the ratings and only ranks the matches.
+"""
+import threading
+import time
+
+from .dataset import PLAYER_PREFIX
+from .routes import percentile
+
+SIZES = [4, 10, 25, 50, 100, 200, 300]
+
+
+def _get_pool(env, size):
+    env.cr.execute("""
+        SELECT p.id FROM res_partner p
+         WHERE p.name LIKE %s AND p.kicker_player AND p.active
+      ORDER BY p.rating_games DESC, p.id
+         LIMIT %s
+    """, [PLAYER_PREFIX + '%', size])
+    return [r[0] for r in env.cr.fetchall()]
+
+
+def run(env, sizes=SIZES, iterations=20):
+    """Time ``_get_matchmaking`` on pools of ``sizes`` players and print one line per size."""
+    Pair = env['kicker.rating.pair']
+    thread = threading.current_thread()
+    results = {}
+    print("%-8s %9s %9s %9s %9s" % ('players', 'cold ms', 'p50 ms', 'p90 ms', 'queries'))
+    for size in sizes:
+        pool = _get_pool(env, size)
+        if len(pool) < size:
+            break
+        Pair.clear_caches()
+        thread.query_count = 0
+        start = time.perf_counter()
+        Pair._get_matchmaking(pool)
+        cold = time.perf_counter() - start
+        queries = thread.query_count
+        latencies = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            Pair._get_matchmaking(pool)
+            latencies.append(time.perf_counter() - start)
+        results[size] = {'cold': cold, 'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                         'queries': queries}
+        print("%-8d %9.2f %9.2f %9.2f %9d" % (size, cold * 1000, results[size]['p50'] * 1000,
+                                              results[size]['p90'] * 1000, queries))
+    return results
@@ -0,0 +1,137 @@
+"""Latency and SQL query count of the JSON routes of the app.
+
+Not loaded by the module, run it from an odoo shell on a database filled by
+``dataset.generate``:
+
+    odoo shell -d <db> <<< "from odoo.addons.kicker.benchmarks import routes; routes.run(env)"
+
+The requests go through the whole WSGI stack of the server (session, routing,
+authentication, serialization) in the shell process itself, so that the
+queries of every request can be counted; they are counted per thread by the
+cursors, like in the request logs of the server.
+"""
+import datetime
+import json
+import threading
+import time
+
+import werkzeug.test
+import werkzeug.wrappers
+
+import odoo
+
+from .dataset import PLAYER_PREFIX
+
+LOGIN = 'kicker.benchmark'
+PASSWORD = 'kicker.benchmark'
+
+# (name, method, path, params); 'json' routes are called with JSON-RPC
+ROUTES = [
+    ('bootstrap', 'GET', '/app/json/bootstrap', {}),
+    ('dashboard', 'json', '/app/json/dashboard', {}),
+    ('player', 'json', '/app/json/player', {}),
+    ('community', 'json', '/app/json/community', {}),
+    ('players', 'json', '/app/json/players', {}),
+    ('directory', 'GET', '/app/json/directory', {}),
+    ('directory search', 'GET', '/app/json/directory', {'search': 'layer 12'}),
+    ('games', 'GET', '/app/json/games', {}),
+    ('games page 50', 'GET', '/app/json/games', {'after_date': '%s' % (datetime.date.today() - datetime.timedelta(days=50)),
+                                                 'after_id': 2 ** 31 - 1}),
+    ('kickers', 'json', '/app/json/kickers', {}),
+    ('kickers/utilization', 'json', '/app/json/kickers/utilization', {}),
+    ('rankings week', 'GET', '/app/json/rankings', {'period': 'week'}),
+    ('rankings month', 'GET', '/app/json/rankings', {'period': 'month'}),
+    ('rankings all/rating', 'GET', '/app/json/rankings', {'period': 'all', 'sort': 'rating'}),
+    ('rankings all kickers', 'GET', '/app/json/rankings', {'period': 'month', 'kicker_id': 'all'}),
+    ('rankings location', 'GET', '/app/json/rankings', {'period': 'month', 'location': 'Benchmark'}),
+    ('rankings past year', 'GET', '/app/json/rankings', {'period': 'month', 'date': '%s' % (
+        datetime.date.today() - datetime.timedelta(days=365))}),
+    ('free/status', 'GET', '/free/status', {}),
+]
+
+
+def _get_user(env):
+    """The benchmark user, playing as the most active benchmark player."""
+    user = env['res.users'].search([('login', '=', LOGIN)])
+    if not user:
+        env.cr.execute("""
+            SELECT s.player_id FROM kicker_session s JOIN res_partner p ON (p.id = s.player_id)
+             WHERE p.name LIKE %s GROUP BY s.player_id ORDER BY count(*) DESC LIMIT 1
+        """, [PLAYER_PREFIX + '%'])
+        row = env.cr.fetchone()
+        user = env['res.users'].create({
+            'login': LOGIN,
+            'password': PASSWORD,
+            'partner_id': row[0] if row else env['res.partner'].create({'name': LOGIN, 'kicker_player': True}).id,
+            'groups_id': [(6, 0, [env.ref('base.group_user').id])],
+        })
+        env.cr.commit()
+    return user
+
+
+class Client(object):
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.client = werkzeug.test.Client(odoo.http.root, werkzeug.wrappers.BaseResponse)
+
+    def json(self, path, params):
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'id': None, 'params': params})
+        response = self.client.post(path, data=body, content_type='application/json')
+        result = json.loads(response.data.decode('utf-8'))
+        if result.get('error'):
+            raise Exception("%s failed: %s" % (path, result['error']))
+        return response
+
+    def get(self, path, params):
+        response = self.client.get(path, query_string=params)
+        if response.status_code not in (200, 304):
+            raise Exception("%s failed: %s" % (path, response.status))
+        return response
+
+    def login(self, login, password):
+        self.json('/web/session/authenticate', {'db': self.dbname, 'login': login, 'password': password})
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def measure(client, method, path, params, iterations=50, warmup=5):
+    """Return the latencies and query counts of ``iterations`` calls of a route."""
+    thread = threading.current_thread()
+    latencies, queries = [], []
+    for i in range(warmup + iterations):
+        thread.query_count = 0
+        thread.query_time = 0
+        start = time.perf_counter()
+        if method == 'json':
+            client.json(path, params)
+        else:
+            client.get(path, params)
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+            queries.append(thread.query_count)
+    return latencies, queries
+
+
+def run(env, iterations=50, warmup=5, routes=None):
+    """Benchmark ``routes`` (all of ROUTES by default) and print one line per route."""
+    _get_user(env)
+    client = Client(env.cr.dbname)
+    client.login(LOGIN, PASSWORD)
+    results = {}
+    print("%-24s %9s %9s %9s %9s" % ('route', 'p50 ms', 'p90 ms', 'p99 ms', 'queries'))
+    for name, method, path, params in routes or ROUTES:
+        latencies, queries = measure(client, method, path, params, iterations=iterations, warmup=warmup)
+        results[name] = {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'queries': max(queries),
+        }
+        print("%-24s %9.2f %9.2f %9.2f %9d" % (
+            name, results[name]['p50'] * 1000, results[name]['p90'] * 1000, results[name]['p99'] * 1000,
+            results[name]['queries']))
+    return results
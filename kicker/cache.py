@@ -0,0 +1,59 @@
+import collections
+import threading
+
+
+class LRUCache(object):
+    """Thread-safe, per-process least recently used cache.
+
+    Bounded in number of entries and/or in total size, the size of a value
+    being given by ``sizeof`` (e.g. ``len`` for bytes).
+    """
+
+    def __init__(self, max_entries=None, max_size=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 0)
+        self.size = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if self.max_size and size > self.max_size:
+            return
+        with self._lock:
+            if key in self._data:
+                self.size -= self.sizeof(self._data.pop(key))
+            self._data[key] = value
+            self.size += size
+            while self._data and ((self.max_entries and len(self._data) > self.max_entries)
+                                  or (self.max_size and self.size > self.max_size)):
+                self.size -= self.sizeof(self._data.popitem(last=False)[1])
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self.size -= self.sizeof(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
@@ -1,56 +1,183 @@
 import ast
 import base64
+import hashlib
 import jinja2
+import json
 import logging
 import random
-import datetime
+import functools
 from functools import reduce
 import werkzeug
 
-from odoo import SUPERUSER_ID
-from odoo import api, http
+from odoo import api, fields, http, _
 from odoo.exceptions import UserError
 from odoo.http import request
 from odoo.modules import get_module_resource
-from odoo.addons.web.controllers.main import binary_content, Home
+from odoo.tools import config, date_utils
+from odoo.tools.mimetypes import guess_mimetype
+from odoo.addons.bus.controllers.main import BusController
+from odoo.addons.web.controllers.main import Home
+
+from .. import profiling
+from ..cache import LRUCache
+from ..models.kicker_telemetry import parse_sample_date
+from ..status import kicker_status
 
 _logger = logging.getLogger(__name__)
 
-SERVER_START = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d-%H%M')
+# avatars sizes used by the app: small ones in lists, medium ones on profiles
+AVATAR_FIELDS = {
+    'small': 'image_small',
+    'medium': 'image_medium',
+}
+# decoded avatars by (partner id, field, checksum), the checksum making the entries
+# of replaced images unreachable
+avatar_cache = LRUCache(max_size=int(config.get('kicker_avatar_cache_size', 16 * 1024 * 1024)),
+                        sizeof=lambda value: len(value[0]))
+
+# rendered service workers by (database, checksum of the asset bundles)
+serviceworker_cache = LRUCache(max_entries=8)
+SW_BUNDLES = ['web.assets_common', 'web.assets_frontend']
+
+
+@functools.lru_cache(maxsize=None)
+def _get_placeholder():
+    img_path = get_module_resource('web', 'static/src/img', 'placeholder.png')
+    with open(img_path, 'rb') as f:
+        return f.read(), 'image/png'
+
+
+@profiling.helper
+def _get_avatar(partner_id, field, checksum):
+    """Return the decoded avatar of the partner and its mimetype."""
+    if not checksum:
+        return _get_placeholder()
+    key = (partner_id, field, checksum)
+    avatar = avatar_cache.get(key)
+    if avatar is None:
+        content = request.env['res.partner'].sudo().browse(partner_id)[field]
+        if not content:
+            return _get_placeholder()
+        image = base64.b64decode(content)
+        avatar = (image, guess_mimetype(image, default='image/png'))
+        avatar_cache.set(key, avatar)
+    return avatar
 
 
 class KickerController(Home):
 
     NUM_BG = 10
 
+    def _not_modified(self, etag):
+        """Return a 304 response if the client already has ``etag``, None otherwise."""
+        if not request.httprequest.if_none_match.contains(etag):
+            return None
+        response = werkzeug.wrappers.Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _json_response(self, data, etag=None):
+        """JSON response with a strong ETag (by default, the hash of the body);
+        answers 304 when the client already has it."""
+        body = json.dumps(data, default=date_utils.json_default)
+        etag = etag or hashlib.md5(body.encode('utf-8')).hexdigest()
+        response = self._not_modified(etag)
+        if response is None:
+            response = request.make_response(body, [('Content-Type', 'application/json')])
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @profiling.helper
+    def _get_kicker_status(self, kicker_id=None):
+        """Return the (status, body, etag) of the kicker from the status snapshot,
+        only hitting the database when it is outdated."""
+        return (kicker_status.get(request.db, kicker_id)
+                or request.env['kicker.kicker'].sudo()._load_status(kicker_id))
+
     @http.route(['/free', '/free/<model("kicker.kicker"):kicker>'], type='http', auth="public")
+    @profiling.route
     def is_the_kicker_free(self, kicker=None, **kw):
-        if not kicker:
-            kicker = request.env['kicker.kicker'].sudo().search([], limit=1)
-        if not kicker:
+        snapshot = self._get_kicker_status(kicker.id if kicker else None)
+        if not snapshot:
             return request.not_found()
+        status = snapshot[0]
         rand_bg = random.randrange(0, self.NUM_BG - 1, step=1)
         return request.render('kicker.page_is_free', {
-            'is_free': kicker.is_available,
-            'bg': ('yes_%s' if kicker.is_available else 'no_%s') % rand_bg,
+            'kicker_id': status['kicker_id'],
+            'is_free': status['available'],
+            'bg': ('yes_%s' if status['available'] else 'no_%s') % rand_bg,
         })
 
+    @http.route(['/free/status', '/free/status/<int:kicker_id>'], type='http', auth='none')
+    @profiling.route
+    def kicker_status(self, kicker_id=None, **kw):
+        """Status of a kicker for office displays: {kicker_id, name, available, since}."""
+        snapshot = self._get_kicker_status(kicker_id)
+        if not snapshot:
+            return request.not_found()
+        status, body, etag = snapshot
+        if request.httprequest.if_none_match.contains(etag):
+            response = werkzeug.wrappers.Response(status=304)
+        else:
+            response = request.make_response(body, [('Content-Type', 'application/json')])
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response
+
     @http.route(['/kicker/ping'], auth='none', csrf=False)
+    @profiling.route
     def ping(self, token=False, status="", **kw):
         """
             TEST URL:
                 /kicker/ping?token=123-456789-321&status={"available": True,"temperature":"15.4"}
+
+            Devices buffering their samples post them to /kicker/telemetry instead.
         """
         with api.Environment.manage():
             if token:
                 try:
-                    ip_address = request.httprequest.environ['REMOTE_ADDR']
-                    payload = ast.literal_eval(status)
-                    available = status.get('available', False)
-                    return request.env['kicker.ping'].sudo().ping(token, available, ip_address)
+                    try:
+                        payload = json.loads(status)
+                    except ValueError:
+                        # older devices send python literals
+                        payload = ast.literal_eval(status)
+                    return self._ingest_telemetry(token, [payload])
                 except Exception as err:
-                    _logger.error("Kicker Ping failed when evaluting status")
+                    _logger.error("Kicker Ping failed when evaluting status: %s", err)
+            return False
+
+    @http.route(['/kicker/telemetry'], type='json', auth='none', methods=['POST'], csrf=False)
+    @profiling.route
+    def telemetry(self, token, samples, **kw):
+        """Samples buffered by a kicker, in one request: ``samples`` is a list
+        of {date, metric: value...} (see kicker.telemetry._ingest), the
+        ``available`` value of the latest one is the status of the kicker."""
+        return self._ingest_telemetry(token, samples)
+
+    def _ingest_telemetry(self, token, samples):
+        kicker = request.env['kicker.kicker'].sudo()._get_kicker_from_token(token)
+        if not kicker:
+            _logger.warning("Unknown kicker sent telemetry")
             return False
+        samples = [sample for sample in samples if isinstance(sample, dict)]
+        request.env['kicker.telemetry'].sudo()._ingest(kicker.id, samples)
+        statuses = []
+        for sample in samples:
+            if 'available' not in sample:
+                continue
+            try:
+                date = parse_sample_date(sample.get('date'))
+            except (TypeError, ValueError, OverflowError):
+                continue
+            statuses.append((date, bool(sample['available'])))
+        if statuses:
+            # samples come in the order they were taken: every change of
+            # status is recorded at its date, the last one is the current status
+            ip_address = request.httprequest.environ['REMOTE_ADDR']
+            return request.env['kicker.ping'].sudo()._record_statuses(token, statuses, ip_address)
+        return True
 
     @http.route(['/app/', "/app/<path:route>"], auth="user")
     def app(self, **kw):
@@ -62,34 +189,69 @@ class KickerController(Home):
         return werkzeug.utils.redirect('/kicker/static/' + route)
 
     # JSON routes
+    def _get_scope(self, kicker_id=None, location=None):
+        """Ids of the kickers the stats are scoped to, None for all of them:
+        ``kicker_id`` ('all' for every kicker), else ``location``, else the
+        main kicker of the user (see res.partner._get_kicker_scope)."""
+        return request.env.user.partner_id.sudo()._get_kicker_scope(kicker_id=kicker_id, location=location)
+
+    @http.route('/app/json/bootstrap', type='http', auth='user', methods=['GET'])
+    @profiling.route
+    def bootstrap(self, kicker_id=None, location=None, **kw):
+        """Everything the app shows when it starts, in one request: dashboard,
+        profile, community, kickers and the rankings of the month, on the
+        main kicker of the user by default."""
+        Partner = request.env['res.partner'].sudo()
+        scope = self._get_scope(kicker_id, location)
+        data = dict(Partner._get_app_data(request.env.user.partner_id.id, fields.Date.today(), scope))
+        data['kickers'] = request.env['res.partner']._get_app_kickers()
+        data['kicker_ids'] = scope and list(scope)
+        data['rankings'] = Partner._get_rankings(period='month', sort='won', kicker_ids=scope)
+        return self._json_response(data)
+
     @http.route('/app/json/dashboard', type='json', auth='user', csrf=False)
-    def dashboard(self, **kw):
+    @profiling.route
+    def dashboard(self, kicker_id=None, location=None, **kw):
         partner = request.env.user.partner_id
-        return partner._dashboard_stats()
-
-    @http.route('/app/json/rankings', type='json', auth='user', csrf=False)
-    def rankings(self, period='month', **kw):
-        partner = request.env.user.partner_id.sudo()
-        return partner._get_rankings(period=period)
+        return partner._dashboard_stats(kicker_ids=self._get_scope(kicker_id, location))
 
+    @http.route('/app/json/rankings', type='http', auth='user', methods=['GET'])
+    @profiling.route
+    def rankings(self, period='month', sort='won', offset=0, limit=0, kicker_id=None, location=None, date=None, **kw):
+        # a limit of 0 is the whole board
+        offset, limit = max(0, int(offset)), max(0, min(int(limit), 500))
+        scope = self._get_scope(kicker_id, location)
+        date = min(fields.Date.to_date(date), fields.Date.today()) if date else fields.Date.today()
+        Partner = request.env['res.partner'].sudo()
+        return self._json_response({
+            'period': period,
+            'sort': sort,
+            'offset': offset,
+            'limit': limit,
+            'kicker_ids': scope and list(scope),
+            'date': fields.Date.to_string(date),
+            'rankings': Partner._get_rankings(period=period, sort=sort, offset=offset, limit=limit,
+                                              kicker_ids=scope, date=date),
+        })
 
     @http.route('/app/json/community', type='json', auth='user', csrf=False)
-    def community(self, **kw):
+    @profiling.route
+    def community(self, kicker_id=None, location=None, **kw):
         partner = request.env.user.partner_id
-        return partner._community_stats()
+        return partner._community_stats(kicker_ids=self._get_scope(kicker_id, location))
 
     @http.route(['/app/json/player', '/app/json/player/<int:player_id>'], type='json', auth='user')
-    def player_info(self, player_id=None, **kw):
+    @profiling.route
+    def player_info(self, player_id=None, kicker_id=None, location=None, **kw):
         if not player_id:
             player_id = request.env.user.partner_id.id
         partner = request.env['res.partner'].browse(player_id)
         if not partner:
             raise werkzeug.exceptions.NotFound()
-        fields = ['id', 'name', 'email', 'main_kicker_id', 'tagline',
-                  'wins', 'losses', 'win_ratio', 'weekly_wins', 'weekly_losses', 'weekly_win_ratio']
-        return partner.sudo().read(fields)[0]
+        return partner.sudo()._player_info(kicker_ids=self._get_scope(kicker_id, location))
 
     @http.route('/app/json/update_profile', type='json', auth='user', methods=['POST'], csrf=False)
+    @profiling.route
     def update_profile(self, name, tagline, main_kicker, avatar=None, **kw):
         partner = request.env.user.partner_id
         vals = {
@@ -103,70 +265,149 @@ class KickerController(Home):
         return {'success': True, 'player':partner.read(['id', 'name', 'email', 'main_kicker_id', 'tagline'])[0]}
 
     @http.route(['/app/json/players'], type='json', auth='user')
+    @profiling.route
     def list_players(self, **kw):
         return request.env['res.partner'].search_read([('kicker_player', '=', True)], fields=['id', 'name'])
 
+    @http.route(['/app/json/directory'], type='http', auth='user', methods=['GET'])
+    @profiling.route
+    def directory(self, search=None, after_name=None, after_id=None, since=None, limit=50, exclude_ids=None, **kw):
+        """Page of the player directory, see res.partner._get_player_directory;
+        ``exclude_ids`` is a comma separated list of players to leave out.
+        The response carries the directory ``version``, to be given as ``since``
+        to only get the changes at the next sync."""
+        Partner = request.env['res.partner'].sudo()
+        version = Partner._get_player_directory_version()
+        limit = max(1, min(int(limit), 500))
+        # the keyset is (name, id): an id alone does not locate a page
+        after = (after_name, int(after_id)) if after_name and after_id else None
+        exclude_ids = sorted({int(pid) for pid in exclude_ids.split(',') if pid}) if exclude_ids else []
+        # the directory only changes with its version: answer 304 without querying it
+        etag = hashlib.md5(json.dumps([version, search, after, since, limit, exclude_ids]).encode('utf-8')).hexdigest()
+        response = self._not_modified(etag)
+        if response is not None:
+            return response
+        data = Partner._get_player_directory(search=search, after=after, limit=limit, since=since,
+                                             exclude_ids=exclude_ids)
+        data['version'] = version
+        return self._json_response(data, etag)
+
+    @http.route(['/app/json/games'], type='http', auth='user', methods=['GET'])
+    @profiling.route
+    def games(self, player_id=None, kicker_id=None, location=None, date_from=None, date_to=None,
+              after_date=None, after_id=None, limit=20, **kw):
+        """Page of the games, most recent first, see kicker.game._get_feed.
+        Games of all the kickers unless ``kicker_id`` or ``location`` is given."""
+        scope = self._get_scope(kicker_id, location) if kicker_id or location else None
+        # the keyset is (date, id): an id alone does not locate a page
+        after = (fields.Date.to_date(after_date), int(after_id)) if after_date and after_id else None
+        data = request.env['kicker.game'].sudo()._get_feed(
+            player_id=int(player_id) if player_id else None, kicker_ids=scope,
+            date_from=fields.Date.to_date(date_from), date_to=fields.Date.to_date(date_to),
+            after=after, limit=max(1, min(int(limit), 200)))
+        return self._json_response(data)
+
     @http.route(['/app/json/kickers'], type='json', auth='user')
+    @profiling.route
     def list_kickers(self, **kw):
-        kickers = request.env['kicker.kicker'].sudo().search_read([], fields=['id', 'name'])
-        default = request.env.user.partner_id.main_kicker_id.id
-        return {'kickers': kickers, 'default': default}
+        return request.env['res.partner']._get_app_kickers()
+
+    @http.route(['/app/json/kickers/utilization'], type='json', auth='user')
+    @profiling.route
+    def kickers_utilization(self, kicker_ids=None, date_from=None, date_to=None, **kw):
+        return request.env['kicker.occupancy'].sudo()._get_utilization(
+            kicker_ids=kicker_ids, date_from=date_from, date_to=date_to, tz=request.env.user.tz)
+
+    @http.route(['/app/json/kickers/telemetry'], type='json', auth='user')
+    @profiling.route
+    def kickers_telemetry(self, kicker_id, metric, date_from=None, date_to=None, step=None, **kw):
+        """Series of a metric of a kicker, e.g. its temperature or its busy
+        ratio, see kicker.telemetry.rollup._get_series."""
+        return request.env['kicker.telemetry.rollup'].sudo()._get_series(
+            int(kicker_id), metric, date_from=date_from, date_to=date_to, step=step)
+
+    @http.route(['/app/json/matchmaking'], type='json', auth='user')
+    @profiling.route
+    def matchmaking(self, player_ids, limit=5, **kw):
+        """Most balanced 2 vs 2 matches among the given players (at most 300)."""
+        if len(player_ids) > 300:
+            raise UserError(_("Matchmaking takes at most 300 players."))
+        return request.env['kicker.rating.pair'].sudo()._get_matchmaking(player_ids, limit=max(1, min(int(limit), 50)))
 
     @http.route(['/kicker/score/submit'], type='json', auth='user', methods=['POST'], csrf=False)
+    @profiling.route
     def submit_score(self, **post):
-        Partner = request.env['res.partner']
-        player11 = post.get('player11') and Partner.browse(int(post.get('player11')))
-        player21 = post.get('player21') and Partner.browse(int(post.get('player21')))
-        if not player11 and player21:
-            raise UserError(_('There must be at least one player per team.'))
-        player12 = post.get('player12') and Partner.browse(int(post.get('player12')))
-        player22 = post.get('player22') and Partner.browse(int(post.get('player22')))
-        kicker = request.env['kicker.kicker'].browse(int(post.get('kicker_id')))
-        game = request.env['kicker.game'].sudo().create({
-            'kicker_id': kicker.id,
-            'score_1': post.get('score1'),
-            'score_2': post.get('score2'),
-            'session_ids':[(0, False, {'player_id': player11.id, 'team': 'team_1'}),
-                           (0, False, {'player_id': player12.id, 'team': 'team_1'}),
-                           (0, False, {'player_id': player21.id, 'team': 'team_2'}),
-                           (0, False, {'player_id': player22.id, 'team': 'team_2'}),],
-        })
-        return {'success': True, 'game_id': game.id}
+        result = request.env['kicker.game'].sudo()._submit_games([post])[0]
+        if result['status'] == 'error':
+            raise UserError(result['error'])
+        return {'success': True, 'game_id': result['game_id']}
+
+    @http.route(['/kicker/score/submit_batch'], type='json', auth='user', methods=['POST'], csrf=False)
+    @profiling.route
+    def submit_scores(self, games, **kw):
+        """Submit several games at once, e.g. the ones queued by the app while offline.
+        Games carry a client generated ``key``: replaying a batch does not duplicate them."""
+        return {'results': request.env['kicker.game'].sudo()._submit_games(games)}
+
+    @http.route(['/app/json/profiling'], type='json', auth='user')
+    def profiling_records(self, **kw):
+        """Last profiled requests of this server process, see kicker/profiling.py."""
+        if not request.env.user.has_group('base.group_system'):
+            raise werkzeug.exceptions.Forbidden()
+        return {
+            'enabled': profiling.is_enabled(),
+            'budget': profiling.get_budget(),
+            'records': profiling.get_records(),
+        }
 
     # Non-json routes
     @http.route(['/app/avatar', '/app/avatar/<int:player_id>'], type='http', auth="public")
-    def avatar(self, player_id=None, **kw):
+    @profiling.route
+    def avatar(self, player_id=None, size='medium', **kw):
         if not player_id:
             player_id = request.env.user.partner_id.id
-        status, headers, content = binary_content(model='res.partner', id=player_id, field='image_medium', default_mimetype='image/png', env=request.env(user=SUPERUSER_ID))
-
-        if not content:
-            img_path = get_module_resource('web', 'static/src/img', 'placeholder.png')
-            with open(img_path, 'rb') as f:
-                image = f.read()
-            content = base64.b64encode(image)
-        if status == 304:
-            return werkzeug.wrappers.Response(status=304)
-        image_base64 = base64.b64decode(content)
-        headers.append(('Content-Length', len(image_base64)))
-        response = request.make_response(image_base64, headers)
-        response.status = str(status)
+        field = AVATAR_FIELDS.get(size, 'image_medium')
+        request.env.cr.execute("""
+            SELECT checksum FROM ir_attachment
+             WHERE res_model = 'res.partner' AND res_field = %s AND res_id = %s
+        """, [field, player_id])
+        row = request.env.cr.fetchone()
+        checksum = row and row[0]
+        etag = '%s-%s' % (field, checksum) if checksum else 'placeholder'
+        if request.httprequest.if_none_match.contains(etag):
+            response = werkzeug.wrappers.Response(status=304)
+        else:
+            image, mimetype = _get_avatar(player_id, field, checksum)
+            response = request.make_response(image, [('Content-Type', mimetype), ('Content-Length', len(image))])
+        response.set_etag(etag)
+        # /app/avatar depends on the session and the URLs are not versioned:
+        # revalidate every time, the ETag makes it a 304 unless the image changed
+        response.headers['Cache-Control'] = 'private, no-cache'
         return response
 
     @http.route('/app/sw.js', type='http', auth='public')
+    @profiling.route
     def serviceworker(self, **kw):
-        bundles = ['web.assets_common', 'web.assets_frontend']
-        attachments = request.env['ir.attachment']
-        for bundle in bundles:
-            attachments += attachments.search([
-                ('url', '=like', '/web/content/%-%/{0}%'.format(bundle))
-            ])
-        urls = attachments.mapped('url')
-        js = request.env['ir.ui.view'].render_template('kicker.service_worker', values={'urls': urls, 'version': SERVER_START})
-        headers = {
-            'Content-Type': 'text/javascript',
-        }
-        response = http.request.make_response(js, headers=headers)
+        # asset urls are /web/content/<id>-<checksum>/<bundle>...
+        request.env.cr.execute("""
+            SELECT url FROM ir_attachment
+             WHERE url LIKE %s OR url LIKE %s
+          ORDER BY url
+        """, ['/web/content/%%-%%/%s%%' % bundle for bundle in SW_BUNDLES])
+        urls = [row[0] for row in request.env.cr.fetchall()]
+        checksums = [url.split('/')[3].split('-', 1)[1] for url in urls]
+        version = hashlib.sha1(' '.join(checksums).encode('utf-8')).hexdigest()[:16]
+        if request.httprequest.if_none_match.contains(version):
+            response = werkzeug.wrappers.Response(status=304)
+        else:
+            key = (request.db, version)
+            js = serviceworker_cache.get(key)
+            if js is None:
+                js = request.env['ir.ui.view'].render_template('kicker.service_worker', values={'urls': urls, 'version': version})
+                serviceworker_cache.set(key, js)
+            response = request.make_response(js, [('Content-Type', 'text/javascript')])
+        response.set_etag(version)
+        response.headers['Cache-Control'] = 'no-cache'
         return response
 
     # ------------------------------------------------------
@@ -183,4 +424,14 @@ class KickerController(Home):
             else:
                 redirect = '/app'
             return http.redirect_with_hash(redirect)
-        return response
\ No newline at end of file
+        return response
+
+
+class KickerBusController(BusController):
+
+    def _poll(self, dbname, channels, last, options):
+        # the /free page listens to the status changes of its kicker
+        if options.get('kicker_id'):
+            channels = list(channels)
+            channels.append((request.db, 'kicker.ping', int(options['kicker_id'])))
+        return super(KickerBusController, self)._poll(dbname, channels, last, options)
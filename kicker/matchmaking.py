@@ -0,0 +1,61 @@
+"""Most balanced 2 vs 2 matches among a pool of players, from their ratings.
+
+A team's strength is the mean rating of its players, pulled towards the
+rating of the pair as they play more games together (see rating.py). The
+most balanced matches are the two teams without common player whose
+strengths are the closest: the teams are sorted by strength once, then each
+one is only compared to the next ones until the gap exceeds the one of the
+worst match kept, so that pools of a few hundred players take milliseconds.
+"""
+import heapq
+import itertools
+
+from .rating import DEFAULT_RATING, expected_score, pair_key
+
+# games a pair has to play together for its own rating to weigh as much as
+# the ones of its players
+PAIR_PRIOR_GAMES = 10.0
+
+
+def team_strength(team, players, pairs, initial=DEFAULT_RATING):
+    """Strength of ``team`` (two player ids) given ``players`` ({player_id:
+    rating}) and ``pairs`` ({pair_key: (rating, games)})."""
+    mean = sum(players.get(player_id, initial) for player_id in team) / len(team)
+    pair = pairs.get(pair_key(team))
+    if not pair:
+        return mean
+    rating, games = pair
+    weight = games / (games + PAIR_PRIOR_GAMES)
+    return (1 - weight) * mean + weight * rating
+
+
+def best_matches(player_ids, players, pairs, limit=5, initial=DEFAULT_RATING):
+    """Return the ``limit`` most balanced matches among ``player_ids``, most
+    balanced first, as dicts with both teams (the stronger first), their
+    strengths and the probability for the first one to win."""
+    if limit < 1:
+        return []
+    teams = sorted((team_strength(team, players, pairs, initial), team)
+                   for team in itertools.combinations(sorted(set(player_ids)), 2))
+    # the worst match kept is on top: (-gap, stronger team, weaker team)
+    kept = []
+    for index, (strength, team) in enumerate(teams):
+        for other_index in range(index + 1, len(teams)):
+            other_strength, other = teams[other_index]
+            gap = other_strength - strength
+            if len(kept) == limit and gap >= -kept[0][0]:
+                break
+            if other[0] in team or other[1] in team:
+                continue
+            if len(kept) < limit:
+                heapq.heappush(kept, (-gap, other, team))
+            else:
+                heapq.heapreplace(kept, (-gap, other, team))
+    strengths = {team: strength for strength, team in teams}
+    return [{
+        'team_1': team_1,
+        'team_2': team_2,
+        'strength_1': strengths[team_1],
+        'strength_2': strengths[team_2],
+        'expected': expected_score(strengths[team_1], strengths[team_2]),
+    } for gap, team_1, team_2 in sorted(kept, reverse=True)]
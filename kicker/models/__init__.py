@@ -1,4 +1,8 @@
+from . import kicker_cache
 from . import kicker_kicker
 from . import kicker_game
 from . import kicker_stat
-from . import res_partner
\ No newline at end of file
+from . import kicker_rating
+from . import res_partner
+from . import kicker_ranking
+from . import kicker_telemetry
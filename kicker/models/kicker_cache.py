@@ -0,0 +1,44 @@
+from odoo import api, fields, models
+
+
+class KickerCacheVersion(models.Model):
+    """Versions of the data the ormcached kicker methods depend on.
+
+    Clearing the registry cache drops every ormcache of every model, in every
+    worker. The kicker methods take the versions of the data they depend on
+    as an extra cache key instead: bumping a version in the transaction that
+    changes the data makes the other workers miss once it is committed, and
+    only these methods miss. Versions come from a sequence, so that the
+    version of a rolled back transaction is never used again.
+    """
+    _name = 'kicker.cache.version'
+    _description = 'Kicker Cache Version'
+    _log_access = False
+
+    name = fields.Char(required=True, readonly=True)
+    version = fields.Integer(readonly=True)
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'There is one version per name.'),
+    ]
+
+    @api.model_cr
+    def init(self):
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS kicker_cache_version_seq")
+
+    @api.model
+    def _get(self, *names):
+        """Return the current versions of ``names``, as a tuple."""
+        self.env.cr.execute("SELECT name, version FROM kicker_cache_version WHERE name IN %s", [names])
+        versions = dict(self.env.cr.fetchall())
+        return tuple(versions.get(name, 0) for name in names)
+
+    @api.model
+    def _bump(self, *names):
+        """Give ``names`` new versions, e.g. 'kicker.stats' when games change
+        or 'kicker.players' when player profiles change."""
+        self.env.cr.execute("""
+            INSERT INTO kicker_cache_version (name, version)
+            SELECT name, nextval('kicker_cache_version_seq') FROM unnest(%s::varchar[]) AS n(name)
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version
+        """, [list(names)])
@@ -1,37 +1,322 @@
-import odoo
-from odoo import api, fields, models, _
-from odoo.exceptions import ValidationError
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+from .. import profiling
 
 import datetime
-from dateutil.relativedelta import relativedelta
 import random
 
+PLAYER_FIELDS = ['player11', 'player12', 'player21', 'player22']
+FEED_PAGE_SIZE = 20
+# fields of kicker.game the ratings depend on
+RATED_FIELDS = {'date', 'score_1', 'score_2', 'session_ids'}
+
+
 class KickerGame(models.Model):
     _name = 'kicker.game'
     _description = 'Kicker Game'
-    _order = 'create_date DESC'
+    _order = 'date DESC, id DESC'
 
-    name = fields.Char(compute='_compute_name')
+    name = fields.Char(compute='_compute_name', store=True)
     date = fields.Date(default=fields.Date.context_today, required=True)
     kicker_id = fields.Many2one('kicker.kicker', string='Kicker', ondelete='restrict', index=True)
     winning_team = fields.Selection([('team_1', 'Team 1'), ('team_2', 'Team 2')], compute='_compute_winning_team', store=True)
     score_1 = fields.Integer(string="Team 1 Score", required=True)
     score_2 = fields.Integer(string="Team 2 Score", required=True)
     session_ids = fields.One2many('kicker.session', 'game_id', string='Sessions')
+    idempotency_key = fields.Char(readonly=True, copy=False,
+        help="Key generated by the client submitting the game, so that replaying a submission does not duplicate it.")
+
+    _sql_constraints = [
+        ('idempotency_key_unique', 'unique(idempotency_key)', 'This game has already been submitted.'),
+    ]
     
+    @api.model_cr_context
+    def _auto_init(self):
+        # name used to be computed on the fly: fill the new column in SQL
+        # rather than letting the ORM recompute every game on upgrade
+        if not tools.column_exists(self.env.cr, self._table, 'name'):
+            tools.create_column(self.env.cr, self._table, 'name', 'varchar')
+            self.env.cr.execute("""
+                UPDATE kicker_game g
+                   SET name = g.date::varchar || '@' || COALESCE(
+                            (SELECT k.name FROM kicker_kicker k WHERE k.id = g.kicker_id), '')
+            """)
+        return super(KickerGame, self)._auto_init()
+
+    @api.model_cr
+    def init(self):
+        # games of a kicker or of a location over a date range
+        tools.create_index(self._cr, 'kicker_game_kicker_id_date_index', self._table, ['kicker_id', 'date'])
+        # the default order, and the keyset of the game feed
+        tools.create_index(self._cr, 'kicker_game_date_id_index', self._table, ['date', 'id'])
+
     @api.depends('score_1', 'score_2')
     def _compute_winning_team(self):
         for game in self:
             game.winning_team = 'team_1' if game.score_1 > game.score_2 else 'team_2'
     
-    @api.depends('score_1', 'score_2', 'session_ids')
+    @api.depends('date', 'kicker_id.name')
     def _compute_name(self):
         for game in self:
-            game.name = '@'.join([
-                self.env['ir.qweb.field.date'].value_to_html(game.date, {}),
-                game.kicker_id.name
-            ])
+            game.name = '@'.join([fields.Date.to_string(game.date) or '', game.kicker_id.name or ''])
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        # sessions created through session_ids are refreshed once, with their game
+        games = super(KickerGame, self.with_context(kicker_no_stat_refresh=True)).create(vals_list)
+        games = games.with_env(self.env)
+        self.env['kicker.rating.pair']._update(games.ids)
+        games._refresh_stats()
+        return games
+
+    @api.multi
+    def write(self, vals):
+        keys = self._get_stats_keys()
+        res = super(KickerGame, self.with_context(kicker_no_stat_refresh=True)).write(vals)
+        self._refresh_stats(keys)
+        if RATED_FIELDS.intersection(vals):
+            # ratings depend on the order of the games, rewriting history means replaying it
+            self.env['kicker.rating.pair']._invalidate()
+        return res
+
+    @api.multi
+    def unlink(self):
+        keys = self._get_stats_keys()
+        res = super(KickerGame, self).unlink()
+        self.browse()._refresh_stats(keys)
+        self.env['kicker.rating.pair']._invalidate()
+        return res
+
+    def _get_stats_keys(self):
+        """Return the (player_id, date) pairs the stats of these games are bucketed by."""
+        if not self.ids:
+            return set()
+        self.recompute()
+        self.env.cr.execute("""
+            SELECT s.player_id, g.date
+              FROM kicker_session s
+              JOIN kicker_game g ON (g.id = s.game_id)
+             WHERE g.id IN %s AND s.player_id IS NOT NULL
+        """, [tuple(self.ids)])
+        return set(self.env.cr.fetchall())
+
+    @profiling.helper
+    def _refresh_stats(self, keys=()):
+        """Update the stats derived from these games. ``keys`` are the stats keys
+        of the games before they were modified, see ``_get_stats_keys``."""
+        self.env['kicker.stat']._refresh(self.ids)
+        keys = set(keys) | self._get_stats_keys()
+        self.env['kicker.stat.day']._refresh(keys)
+        if keys:
+            # snapshots of the days these games were played on are outdated
+            self.env['kicker.ranking.snapshot']._invalidate(min(date for player_id, date in keys))
+        self.env['kicker.stat.pair']._refresh(keys)
+        # cached rankings and app data are outdated
+        self.env['kicker.cache.version']._bump('kicker.stats')
+
+    @api.model
+    @profiling.helper
+    def _submit_games(self, games):
+        """Create the games submitted by the app, possibly queued while it was offline.
+
+        ``games`` is a list of dicts with ``key`` (idempotency key generated by
+        the client), ``kicker_id``, ``score1``, ``score2``, ``player11`` and
+        ``player21`` and optionally ``player12``, ``player22`` and ``date``.
+        Return one result per game, in the same order: a dict with the ``key``,
+        a ``status`` ('created', 'duplicate' or 'error') and the ``game_id`` or
+        the ``error``.
+        """
+        # parse everything first, a malformed game only fails on its own
+        parsed = []
+        for game in games:
+            try:
+                parsed.append(self._parse_submitted_game(game))
+            except KeyError as e:
+                parsed.append(UserError(_('Missing value: %s') % e.args[0]))
+            except (UserError, ValueError, TypeError) as e:
+                parsed.append(e)
+        valid = [game for game in parsed if isinstance(game, dict)]
+        keys = [game['key'] for game in valid if game['key']]
+        existing = {}
+        if keys:
+            existing = {g['idempotency_key']: g['id'] for g in self.search_read(
+                [('idempotency_key', 'in', keys)], ['idempotency_key'])}
+        player_ids = {pid for game in valid for pid in game['player_ids'].values() if pid}
+        kicker_ids = {game['kicker_id'] for game in valid if game['kicker_id']}
+        players = set(self.env['res.partner'].search([('id', 'in', list(player_ids)), ('kicker_player', '=', True)]).ids)
+        kickers = set(self.env['kicker.kicker'].search([('id', 'in', list(kicker_ids))]).ids)
+
+        results, to_create, duplicates, pending = [], [], [], {}
+        for game, submitted in zip(parsed, games):
+            if not isinstance(game, dict):
+                key = submitted.get('key') if isinstance(submitted, dict) else False
+                results.append({'key': key or False, 'status': 'error', 'error': str(game)})
+                continue
+            key = game['key']
+            result = {'key': key}
+            results.append(result)
+            if key in existing:
+                result.update(status='duplicate', game_id=existing[key])
+                continue
+            if key in pending:
+                # same key twice in the batch
+                result['status'] = 'duplicate'
+                duplicates.append((result, pending[key]))
+                continue
+            try:
+                vals = self._prepare_submitted_game(game, players, kickers)
+            except UserError as e:
+                result.update(status='error', error=str(e))
+                continue
+            result['status'] = 'created'
+            if key:
+                pending[key] = result
+            to_create.append((result, vals))
+
+        if to_create:
+            # stored computes and stats are updated once for the whole batch, by create
+            created = self.with_context(recompute=False).create([vals for result, vals in to_create])
+            for (result, vals), game in zip(to_create, created):
+                result['game_id'] = game.id
+        for result, original in duplicates:
+            result['game_id'] = original['game_id']
+        return results
+
+    @api.model
+    def _parse_submitted_game(self, game):
+        """Convert the values of a submitted game; raise KeyError, ValueError
+        or TypeError when they are missing or malformed."""
+        if not isinstance(game, dict):
+            raise TypeError(_('A game must be an object.'))
+        key = game.get('key') or False
+        if key and not isinstance(key, str):
+            raise TypeError(_('The key must be a string.'))
+        return {
+            'key': key,
+            'player_ids': {f: int(game[f]) if game.get(f) else False for f in PLAYER_FIELDS},
+            'kicker_id': int(game['kicker_id']) if game.get('kicker_id') else False,
+            'score_1': int(game['score1']),
+            'score_2': int(game['score2']),
+            'date': fields.Date.to_date(game['date']) if game.get('date') else False,
+        }
+
+    @api.model
+    def _prepare_submitted_game(self, game, players, kickers):
+        """Check a game returned by ``_parse_submitted_game`` against the
+        existing ``players`` and ``kickers``; return the values to create it."""
+        player_ids = game['player_ids']
+        if not (player_ids['player11'] and player_ids['player21']):
+            raise UserError(_('There must be at least one player per team.'))
+        selected = [pid for pid in player_ids.values() if pid]
+        if len(set(selected)) != len(selected):
+            raise UserError(_('A player cannot play twice in the same game.'))
+        unknown = set(selected) - players
+        if unknown:
+            raise UserError(_('Unknown players: %s') % ', '.join(map(str, sorted(unknown))))
+        kicker_id = game['kicker_id']
+        if kicker_id and kicker_id not in kickers:
+            raise UserError(_('Unknown kicker: %s') % kicker_id)
+        vals = {
+            'kicker_id': kicker_id,
+            'score_1': game['score_1'],
+            'score_2': game['score_2'],
+            'idempotency_key': game['key'],
+            'session_ids': [(0, False, {'player_id': player_ids[f], 'team': 'team_%s' % f[6]})
+                            for f in PLAYER_FIELDS if player_ids[f]],
+        }
+        if game['date']:
+            vals['date'] = game['date']
+        return vals
+
+    @api.model
+    def _rebuild_stats(self):
+        """Recompute all the stats derived from games, e.g. for existing databases:
+
+            odoo shell -d <db> <<< "env['kicker.game']._rebuild_stats(); env.cr.commit()"
+        """
+        self.env['kicker.stat']._rebuild()
+        self.env['kicker.stat.day']._rebuild()
+        self.env['kicker.stat.pair']._rebuild()
+        self.env['kicker.rating.pair']._replay()
+        self.env['kicker.ranking.snapshot']._invalidate(datetime.date.min)
+        self.env['kicker.cache.version']._bump('kicker.stats')
+        return True
+
+    @api.model
+    @profiling.helper
+    def _get_feed(self, player_id=None, kicker_ids=None, date_from=None, date_to=None, after=None,
+                  limit=FEED_PAGE_SIZE):
+        """One page of the games, most recent first.
+
+        :param player_id: only the games of this player
+        :param kicker_ids: only the games of these kickers (all of them when None)
+        :param date_from, date_to: only the games of this date range, bounds included
+        :param after: (date, id) of the last game of the previous page, see ``next``
+        :return: dict with the ``games`` (date, kicker, scores, winning team and
+                 players of both teams) and ``next``, the ``after_date`` and
+                 ``after_id`` of the next page or None
+
+        Two queries per page, whatever the filters: the games, then their players.
+        """
+        limit = max(1, min(int(limit), 200))
+        if after and not all(after):
+            after = None
+        if player_id:
+            # the sessions of the player are the index of its history
+            source = """kicker_session s JOIN kicker_game g ON (g.id = s.game_id)"""
+            where, params = ["s.player_id = %s"], [player_id]
+            date, id_ = "s.game_date", "s.game_id"
+        else:
+            source, where, params = "kicker_game g", [], []
+            date, id_ = "g.date", "g.id"
+        if kicker_ids is not None:
+            where.append("g.kicker_id = ANY(%s)")
+            params.append(list(kicker_ids))
+        if date_from:
+            where.append("%s >= %%s" % date)
+            params.append(date_from)
+        if date_to:
+            where.append("%s <= %%s" % date)
+            params.append(date_to)
+        if after:
+            where.append("(%s, %s) < (%%s, %%s)" % (date, id_))
+            params += list(after)
+        cr = self.env.cr
+        cr.execute("""
+            SELECT g.id, g.date, g.kicker_id, k.name, g.score_1, g.score_2, g.winning_team
+              FROM {source}
+         LEFT JOIN kicker_kicker k ON (k.id = g.kicker_id)
+             WHERE {where}
+          ORDER BY {date} DESC, {id} DESC
+             LIMIT %s
+        """.format(source=source, where=' AND '.join(where) or 'TRUE', date=date, id=id_), params + [limit + 1])
+        rows = cr.fetchall()
+        games = rows[:limit]
+        teams = {}
+        if games:
+            cr.execute("""
+                SELECT s.game_id, s.team, p.id, p.name
+                  FROM kicker_session s
+                  JOIN res_partner p ON (p.id = s.player_id)
+                 WHERE s.game_id = ANY(%s)
+              ORDER BY s.id
+            """, [[row[0] for row in games]])
+            for game_id, team, pid, name in cr.fetchall():
+                teams.setdefault((game_id, team), []).append({'id': pid, 'name': name})
+        return {
+            'games': [{
+                'id': game_id,
+                'date': game_date,
+                'kicker': {'id': kicker_id, 'name': kicker_name} if kicker_id else None,
+                'score_1': score_1,
+                'score_2': score_2,
+                'winning_team': winning_team,
+                'team_1': teams.get((game_id, 'team_1'), []),
+                'team_2': teams.get((game_id, 'team_2'), []),
+            } for game_id, game_date, kicker_id, kicker_name, score_1, score_2, winning_team in games],
+            'next': {'after_date': rows[limit - 1][1], 'after_id': rows[limit - 1][0]} if len(rows) > limit else None,
+        }
+
 #    @api.constrains('session_ids')
 #    def _validate_session(self):
 #        for game in self:
@@ -40,11 +325,12 @@ class KickerGame(models.Model):
 
     @api.model
     def _generate_demo_data(self, amount=100):
+        # demo data only, see kicker/benchmarks/dataset.py for large datasets
         seconds_in_year = 365*24*60*60
         vals = list()
         kickers = self.env['kicker.kicker'].search([])
+        players = self.env['res.partner'].search([('kicker_player', '=', True)])
         for i in range(amount):
-            players = self.env['res.partner'].search([('kicker_player', '=', True)])
             player_ids = random.sample(players.ids, 4)
             date = datetime.datetime.now() - datetime.timedelta(seconds=random.randrange(0,seconds_in_year))
             vals.append({
@@ -72,7 +358,44 @@ class KickerSession(models.Model):
         domain="[('kicker_player', '=', True)]")
     game_date = fields.Date(related='game_id.date', store=True)
 
+    @api.model_cr
+    def init(self):
+        # the history of a player, see kicker.game._get_feed
+        tools.create_index(self._cr, 'kicker_session_player_id_game_date_game_id_index', self._table,
+                           ['player_id', 'game_date', 'game_id'])
+
     @api.depends('game_id', 'game_id.winning_team')
     def _compute_won(self):
         for session in self:
             session.won = session.team == session.game_id.winning_team
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        sessions = super(KickerSession, self).create(vals_list)
+        if not self._context.get('kicker_no_stat_refresh'):
+            sessions.mapped('game_id')._refresh_stats()
+            self.env['kicker.rating.pair']._invalidate()
+        return sessions
+
+    @api.multi
+    def write(self, vals):
+        if self._context.get('kicker_no_stat_refresh'):
+            return super(KickerSession, self).write(vals)
+        games = self.mapped('game_id')
+        keys = games._get_stats_keys()
+        res = super(KickerSession, self).write(vals)
+        (games | self.mapped('game_id'))._refresh_stats(keys)
+        if {'game_id', 'team', 'player_id'}.intersection(vals):
+            self.env['kicker.rating.pair']._invalidate()
+        return res
+
+    @api.multi
+    def unlink(self):
+        if self._context.get('kicker_no_stat_refresh'):
+            return super(KickerSession, self).unlink()
+        games = self.mapped('game_id')
+        keys = games._get_stats_keys()
+        res = super(KickerSession, self).unlink()
+        games.exists()._refresh_stats(keys)
+        self.env['kicker.rating.pair']._invalidate()
+        return res
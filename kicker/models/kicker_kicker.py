@@ -1,8 +1,15 @@
 
+import datetime
+import functools
 import logging
+import threading
 import uuid
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
+from odoo.exceptions import MissingError
+
+from .. import profiling
+from ..status import kicker_status
 
 _logger = logging.getLogger(__name__)
 
@@ -17,31 +24,113 @@ class Kicker(models.Model):
 
     name = fields.Char('Name', required=True, help="Nickname of the kicker. Used in the ping.")
     location = fields.Char('Location')
-    token = fields.Char('Token', required=True, default=_default_token)
+    token = fields.Char('Token', required=True, default=_default_token, index=True)
     ping_ids = fields.One2many("kicker.ping", "kicker_id", "Pings")
-    is_available = fields.Boolean('Is Available', compute='_compute_is_available')
-    last_status_change = fields.Datetime("Available since", _compute='_compute_last_status_change')
+    last_seen = fields.Datetime("Last Seen", readonly=True, help="Date of the last ping, whether the status changed or not.")
+    # current status, maintained by kicker.ping
+    is_available = fields.Boolean('Is Available', readonly=True)
+    last_status_change = fields.Datetime("Available since", readonly=True)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        kickers = super(Kicker, self).create(vals_list)
+        kicker_status.clear(self._cr.dbname)
+        return kickers
+
+    @api.multi
+    def write(self, vals):
+        res = super(Kicker, self).write(vals)
+        if 'name' in vals:
+            kicker_status.clear(self._cr.dbname)
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(Kicker, self).unlink()
+        kicker_status.clear(self._cr.dbname)
+        return res
+
+    @api.model
+    @tools.ormcache('token')
+    def _get_kicker_id_from_token(self, token):
+        # pinged every few seconds by every kicker: keep the token lookup in memory
+        return self.search([('token', '=', token)], limit=1).id
 
-    @api.depends('ping_ids.available')
-    def _compute_is_available(self):
-        for kicker in self:
-            if kicker.ping_ids:
-                kicker.is_available = kicker.ping_ids[0].available
-            else:
-                kicker.is_available = False
+    @api.model
+    def _get_kicker_from_token(self, token):
+        """Return the kicker of ``token``. The cached lookup is checked
+        against the kicker itself, so that changing or deleting tokens does
+        not have to clear the caches of every worker."""
+        kicker = self.browse(self._get_kicker_id_from_token(token))
+        try:
+            if kicker and kicker.token == token:
+                return kicker
+        except MissingError:
+            pass
+        return self.search([('token', '=', token)], limit=1)
 
-    @api.depends('ping_ids.available')
-    def _compute_last_status_change(self):
-        for kicker in self:
-            last_ping_change = self.env['kicker.ping'].search([('kicker_id', '=', kicker.id), ('available', '!=', kicker.is_available)])
-            kicker.last_status_change = last_ping_change.create_date
+    def _get_status(self):
+        self.ensure_one()
+        return {
+            'kicker_id': self.id,
+            'name': self.name,
+            'available': self.is_available,
+            'since': self.last_status_change,
+        }
+
+    @api.model
+    @profiling.helper
+    def _load_status(self, kicker_id=None):
+        """Read the status of the kicker (the first one by default) into the
+        status snapshot and return its (status, body, etag), None if there is
+        no such kicker. Plain SQL: this is polled by every office display."""
+        query = "SELECT id, name, is_available, last_status_change FROM kicker_kicker"
+        if kicker_id:
+            self.env.cr.execute(query + " WHERE id = %s", [kicker_id])
+        else:
+            self.env.cr.execute(query + " ORDER BY id LIMIT 1")
+        row = self.env.cr.fetchone()
+        if not row:
+            return None
+        status = dict(zip(['kicker_id', 'name', 'available', 'since'], row))
+        status['available'] = bool(status['available'])
+        return kicker_status.set(self.env.cr.dbname, row[0], status, default=not kicker_id)
+
+    @api.model
+    def _rebuild_status(self):
+        """Recompute the stored status of the kickers from their pings."""
+        self.env.cr.execute("""
+            WITH last_ping AS (
+                SELECT DISTINCT ON (kicker_id) kicker_id, available, create_date
+                  FROM kicker_ping
+                 WHERE kicker_id IS NOT NULL
+              ORDER BY kicker_id, create_date DESC, id DESC
+            )
+            UPDATE kicker_kicker k
+               SET is_available = l.available,
+                   last_seen = GREATEST(k.last_seen, l.create_date),
+                   last_status_change = (
+                        SELECT min(p.create_date)
+                          FROM kicker_ping p
+                         WHERE p.kicker_id = l.kicker_id
+                           AND p.create_date > COALESCE((
+                                SELECT max(o.create_date)
+                                  FROM kicker_ping o
+                                 WHERE o.kicker_id = l.kicker_id AND o.available != l.available
+                               ), '-infinity'))
+              FROM last_ping l
+             WHERE l.kicker_id = k.id
+        """)
+        self.invalidate_cache(['is_available', 'last_seen', 'last_status_change'])
+        kicker_status.clear(self.env.cr.dbname)
+        return True
 
 
 class Ping(models.Model):
 
     _name = 'kicker.ping'
     _description = 'Kicker Ping'
-    _order = 'create_date DESC'
+    _order = 'create_date DESC, id DESC'
 
     kicker_id = fields.Many2one('kicker.kicker', string="Kicker")
     kicker_token = fields.Char('Kicker Token')
@@ -49,24 +138,225 @@ class Ping(models.Model):
     available = fields.Boolean('Is free')
     ip_address = fields.Char("IP address of the ping")
 
+    @api.model_cr
+    def init(self):
+        tools.create_index(self._cr, 'kicker_ping_kicker_id_create_date_index', self._table, ['kicker_id', 'create_date DESC'])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # the ORM stamps create_date itself: keep the dates of the pings sent
+        # late by the kickers, see _record_statuses
+        dates = [vals.get('create_date') for vals in vals_list]
+        pings = super(Ping, self).create(vals_list)
+        dated = [(ping.id, date) for ping, date in zip(pings, dates) if date]
+        if dated:
+            self.env.cr.execute("""
+                UPDATE kicker_ping p SET create_date = d.date
+                  FROM unnest(%s::int[], %s::timestamp[]) AS d(id, date)
+                 WHERE p.id = d.id
+            """, [[d[0] for d in dated], [d[1] for d in dated]])
+            pings.invalidate_cache(['create_date'])
+        for ping in pings.filtered('kicker_id').sorted(lambda ping: (ping.create_date, ping.id)):
+            kicker = ping.kicker_id
+            if kicker.last_status_change and ping.create_date < kicker.last_status_change:
+                continue
+            vals = {'last_seen': max(ping.create_date, kicker.last_seen or ping.create_date)}
+            if not kicker.last_status_change or kicker.is_available != ping.available:
+                vals.update(is_available=ping.available, last_status_change=ping.create_date)
+            kicker.sudo().write(vals)
+            if 'is_available' in vals:
+                # publish the new status once it is visible to the other workers
+                self._cr.after('commit', functools.partial(
+                    kicker_status.set, self._cr.dbname, kicker.id, kicker._get_status()))
+        return pings
+
     @api.model
+    @profiling.helper
     def ping(self, kicker_token, available, ip_address=False):
-        kicker = self.env['kicker.kicker'].search([('token', '=', kicker_token)])
+        return self._record_statuses(kicker_token, [(fields.Datetime.now(), available)], ip_address)
+
+    @api.model
+    def _record_statuses(self, kicker_token, statuses, ip_address=False):
+        """Record the (date, available) statuses of a kicker, oldest first,
+        e.g. the ones it kept while the server could not be reached: one ping
+        per change of status, dated when the change happened. Statuses older
+        than the current one are ignored, dates in the future are now."""
+        kicker = self.env['kicker.kicker']._get_kicker_from_token(kicker_token)
         if not kicker:
             _logger.warning("Unknow kicker just pinged")
             return False
+        now = fields.Datetime.now()
+        current = kicker.is_available if kicker.last_status_change else None
+        vals_list, last_date = [], None
+        for date, available in statuses:
+            date = min(date or now, now)
+            if kicker.last_status_change and date < kicker.last_status_change:
+                continue
+            last_date = date
+            if bool(available) == current:
+                continue
+            current = bool(available)
+            vals_list.append({
+                'kicker_id': kicker.id,
+                'kicker_token': kicker_token,
+                'available': current,
+                'ip_address': ip_address,
+                'create_date': date,
+            })
+        pings = self.create(vals_list) if vals_list else self.browse()
+        # statuses repeated after the last change still tell the kicker is alive
+        if last_date and (not kicker.last_seen or last_date > kicker.last_seen):
+            kicker.write({'last_seen': last_date})
+        if not pings:
+            return True
 
-        ping = self.create({
-            'kicker_id': kicker.id,
-            'kicker_token': kicker_token,
-            'available': available,
-            'ip_address': ip_address,
-        })
+        ping = pings[-1]
 
         self.env['bus.bus'].sendone((self._cr.dbname, 'kicker.ping', kicker.id), {
+            'kicker_id': kicker.id,
             'kicker_name': kicker.name,
             'create_date': ping.create_date,
             'available': ping.available,
         })
-        _logger.info("Ping from kicker %s; available: %s" % (kicker.name, available))
-        return True
\ No newline at end of file
+        _logger.info("%s ping(s) from kicker %s; available: %s", len(vals_list), kicker.name, ping.available)
+        return True
+
+
+class Occupancy(models.Model):
+
+    _name = 'kicker.occupancy'
+    _description = 'Kicker Occupancy'
+    _order = 'date_start DESC'
+    _log_access = False
+
+    kicker_id = fields.Many2one('kicker.kicker', string="Kicker", required=True, ondelete='cascade')
+    available = fields.Boolean('Is free')
+    date_start = fields.Datetime('Start', required=True)
+    date_stop = fields.Datetime('End', required=True)
+
+    @api.model_cr
+    def init(self):
+        tools.create_index(self._cr, 'kicker_occupancy_kicker_id_date_start_index', self._table, ['kicker_id', 'date_start'])
+
+    @api.model
+    def _cron_compact_pings(self):
+        """Turn the pings older than the retention window into occupancy intervals.
+
+        The last ping before the window is kept as the start of the current
+        interval, so that the next run can go on from it.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        retention = int(get_param('kicker.ping_retention_days', 30))
+        batch_size = int(get_param('kicker.ping_compaction_batch', 10000))
+        cutoff = fields.Datetime.now() - datetime.timedelta(days=retention)
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        for kicker in self.env['kicker.kicker'].search([]):
+            while self._compact_pings(kicker, cutoff, batch_size):
+                if auto_commit:
+                    self.env.cr.commit()
+
+    def _compact_pings(self, kicker, cutoff, limit):
+        """Compact one batch of pings of ``kicker``; return whether there might be more."""
+        cr = self.env.cr
+        cr.execute("""
+            SELECT id, available, create_date
+              FROM kicker_ping
+             WHERE kicker_id = %s AND create_date < %s
+          ORDER BY create_date, id
+             LIMIT %s
+        """, [kicker.id, cutoff, limit])
+        pings = cr.fetchall()
+        if len(pings) < 2:
+            return False
+        intervals = []
+        start = pings[0]
+        for ping in pings[1:]:
+            if ping[1] != start[1]:
+                intervals.append((start[1], start[2], ping[2]))
+                start = ping
+        if start is not pings[-1]:
+            intervals.append((start[1], start[2], pings[-1][2]))
+
+        last = self.search([('kicker_id', '=', kicker.id)], order='date_stop DESC', limit=1)
+        if intervals and last and last.available == intervals[0][0] and last.date_stop == intervals[0][1]:
+            last.date_stop = intervals.pop(0)[2]
+        self.create([{
+            'kicker_id': kicker.id,
+            'available': available,
+            'date_start': date_start,
+            'date_stop': date_stop,
+        } for available, date_start, date_stop in intervals])
+        cr.execute("DELETE FROM kicker_ping WHERE id IN %s", [tuple(p[0] for p in pings[:-1])])
+        _logger.info("Compacted %s pings of kicker %s", len(pings) - 1, kicker.name)
+        return len(pings) == limit
+
+    @api.model
+    @profiling.helper
+    def _get_utilization(self, kicker_ids=None, date_from=None, date_to=None, tz=None):
+        """Busy percentage of the kickers by hour of the day and by weekday (0 is Monday),
+        computed from the occupancy intervals and the pings not compacted yet
+        (each one lasting until the next one of its kicker, or until now)."""
+        tz = tz or self.env.context.get('tz') or self.env.user.tz or 'UTC'
+        # bounds left to None are ignored by GREATEST and LEAST below
+        where, ping_where = ["TRUE"], ["kicker_id IS NOT NULL"]
+        params = {'tz': tz, 'date_from': date_from or None, 'date_to': date_to or None}
+        if kicker_ids:
+            where.append("o.kicker_id IN %(kicker_ids)s")
+            ping_where.append("kicker_id IN %(kicker_ids)s")
+            params['kicker_ids'] = tuple(kicker_ids)
+        if date_from:
+            where.append("o.date_stop > %(date_from)s")
+        if date_to:
+            where.append("o.date_start < %(date_to)s")
+        self.env.cr.execute("""
+            WITH intervals AS (
+                    SELECT kicker_id, available, date_start, date_stop
+                      FROM kicker_occupancy
+                 UNION ALL
+                    -- the compaction keeps the last ping it read, where the
+                    -- intervals above stop
+                    SELECT kicker_id, available, create_date,
+                           COALESCE(lead(create_date) OVER (PARTITION BY kicker_id ORDER BY create_date, id),
+                                    now() AT TIME ZONE 'UTC')
+                      FROM kicker_ping
+                     WHERE {ping_where}
+            )
+            SELECT kicker_id,
+                   extract(isodow FROM local_hour)::int - 1 AS weekday,
+                   extract(hour FROM local_hour)::int AS hour,
+                   SUM(extract(epoch FROM slice_stop - slice_start)) FILTER (WHERE NOT available) AS busy,
+                   SUM(extract(epoch FROM slice_stop - slice_start)) AS total
+              FROM (
+                    SELECT o.kicker_id, o.available,
+                           (h AT TIME ZONE 'UTC') AT TIME ZONE %(tz)s AS local_hour,
+                           -- the slices are clipped to the dates asked for
+                           GREATEST(o.date_start, h, %(date_from)s::timestamp) AS slice_start,
+                           LEAST(o.date_stop, h + interval '1 hour', %(date_to)s::timestamp) AS slice_stop
+                      FROM intervals o,
+                           generate_series(GREATEST(date_trunc('hour', o.date_start),
+                                                    date_trunc('hour', %(date_from)s::timestamp)),
+                                           LEAST(o.date_stop, %(date_to)s::timestamp),
+                                           interval '1 hour') AS h
+                     WHERE {where}
+                   ) AS slices
+             WHERE slice_stop > slice_start
+          GROUP BY kicker_id, weekday, hour
+        """.format(where=" AND ".join(where), ping_where=" AND ".join(ping_where)), params)
+        res = {}
+        for kicker_id, weekday, hour, busy, total in self.env.cr.fetchall():
+            stats = res.setdefault(kicker_id, {
+                'weekday_hour': [[[0, 0] for h in range(24)] for d in range(7)],
+            })
+            stats['weekday_hour'][weekday][hour] = [busy or 0, total]
+        for stats in res.values():
+            matrix = stats.pop('weekday_hour')
+            by_hour = [[sum(matrix[d][h][i] for d in range(7)) for i in (0, 1)] for h in range(24)]
+            by_weekday = [[sum(matrix[d][h][i] for h in range(24)) for i in (0, 1)] for d in range(7)]
+            stats['by_hour'] = [_ratio(busy, total) for busy, total in by_hour]
+            stats['by_weekday'] = [_ratio(busy, total) for busy, total in by_weekday]
+            stats['by_weekday_hour'] = [[_ratio(busy, total) for busy, total in day] for day in matrix]
+        return res
+
+
+def _ratio(busy, total):
+    return round(100.0 * busy / total, 1) if total else 0.0
@@ -0,0 +1,172 @@
+import datetime
+import logging
+import threading
+
+from odoo import api, fields, models, tools
+
+from .res_partner import RANKING_PERIODS
+
+_logger = logging.getLogger(__name__)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+class KickerRankingSnapshot(models.Model):
+    """Leaderboards as they were at the end of a day, per period and per kicker
+    (all kickers when empty).
+
+    Snapshots are taken every night by ``_cron_snapshot``, up to the day
+    before; kicker.ranking.snapshot.range holds the first and last days all
+    of them are taken for. Boards of any day are computed from the
+    latest snapshot before it and the daily stats since (see ``_board_query``).
+    """
+    _name = 'kicker.ranking.snapshot'
+    _description = 'Kicker Ranking Snapshot'
+    _order = 'date desc, rank'
+    _log_access = False
+
+    date = fields.Date(readonly=True, required=True)
+    period = fields.Selection([('week', 'Week'), ('month', 'Month'), ('year', 'Year'), ('all', 'All Time')],
+                              readonly=True, required=True)
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, ondelete='cascade')
+    player_id = fields.Many2one('res.partner', string='Player', readonly=True, required=True, ondelete='cascade')
+    won = fields.Integer(readonly=True)
+    lost = fields.Integer(readonly=True)
+    rank = fields.Integer(readonly=True, help="Rank by won games, then by least played games")
+
+    @api.model_cr
+    def init(self):
+        tools.create_index(self.env.cr, 'kicker_ranking_snapshot_date_period_kicker_id_index', self._table,
+                           ['date', 'period', 'kicker_id'])
+
+    def _get_snapshot_range(self):
+        """Return the first and last days with snapshots, (None, None) if there are none."""
+        self.env.cr.execute("SELECT date_from, date_to FROM kicker_ranking_snapshot_range ORDER BY id LIMIT 1")
+        row = self.env.cr.fetchone()
+        if not (row and row[0] and row[1]):
+            return None, None
+        return row
+
+    def _set_snapshot_range(self, first, last):
+        cr = self.env.cr
+        cr.execute("UPDATE kicker_ranking_snapshot_range SET date_from = %s, date_to = %s",
+                   [first or None, last or None])
+        if not cr.rowcount:
+            cr.execute("INSERT INTO kicker_ranking_snapshot_range (date_from, date_to) VALUES (%s, %s)",
+                       [first or None, last or None])
+
+    @api.model
+    def _get_snapshot_date(self, date):
+        """Latest day with snapshots on or before ``date``, None if there is none."""
+        first, last = self._get_snapshot_range()
+        if not first or date < first:
+            return None
+        return min(date, last)
+
+    @api.model
+    def _board_query(self, period, kicker_ids, date, snapshot_date=None):
+        """Return the SQL query and parameters of the (player_id, won, lost) of
+        the board of ``period`` at the end of ``date``, for the games of
+        ``kicker_ids`` (all kickers when None).
+
+        Starting from the snapshot of ``snapshot_date`` (before ``date``), the
+        days after it are added and the days that left the period since are
+        subtracted; without snapshot, the whole period is summed up. Boards of
+        several kickers add up the snapshots of each of them.
+        """
+        delta = RANKING_PERIODS[period]
+        start = date - delta if delta else None
+        if kicker_ids is None:
+            kicker_clause, snapshot_clause, kicker_params = "TRUE", "kicker_id IS NULL", []
+        else:
+            kicker_clause = snapshot_clause = "kicker_id = ANY(%s)"
+            kicker_params = [list(kicker_ids)]
+        days = """SELECT player_id, {sign}wins, {sign}losses FROM kicker_stat_day
+                   WHERE date > %s AND date <= %s AND {kicker}"""
+        parts, params = [], []
+        if snapshot_date:
+            parts.append("""SELECT player_id, won, lost FROM kicker_ranking_snapshot
+                             WHERE date = %s AND period = %s AND {kicker}""".format(kicker=snapshot_clause))
+            params += [snapshot_date, period] + kicker_params
+            if snapshot_date < date:
+                parts.append(days.format(sign='', kicker=kicker_clause))
+                params += [snapshot_date, date] + kicker_params
+                if start:
+                    parts.append(days.format(sign='-', kicker=kicker_clause))
+                    params += [snapshot_date - delta, start] + kicker_params
+        else:
+            parts.append(days.format(sign='', kicker=kicker_clause))
+            params += [start or datetime.date.min, date] + kicker_params
+        query = """
+            SELECT player_id, SUM(won) AS won, SUM(lost) AS lost
+              FROM (%s) AS board(player_id, won, lost)
+          GROUP BY player_id
+            HAVING SUM(won) + SUM(lost) > 0
+        """ % " UNION ALL ".join(parts)
+        return query, params
+
+    @api.model
+    def _invalidate(self, date):
+        """Drop the snapshots from ``date`` on, e.g. when a game of that day
+        changed; the next run of the cron takes them again."""
+        first, last = self._get_snapshot_range()
+        if not last or date > last:
+            return
+        self.env.cr.execute("DELETE FROM kicker_ranking_snapshot WHERE date >= %s", [date])
+        if date <= first:
+            self._set_snapshot_range(False, False)
+        else:
+            self._set_snapshot_range(first, date - ONE_DAY)
+
+    def _snapshot(self, date, snapshot_date):
+        """Take the snapshots of ``date``, from the ones of ``snapshot_date``."""
+        cr = self.env.cr
+        kicker_ids = [None] + self.env['kicker.kicker'].search([]).ids
+        for period in RANKING_PERIODS:
+            for kicker_id in kicker_ids:
+                query, params = self._board_query(period, kicker_id and (kicker_id,), date, snapshot_date)
+                cr.execute("""
+                    INSERT INTO kicker_ranking_snapshot (date, period, kicker_id, player_id, won, lost, rank)
+                    SELECT %s, %s, %s, player_id, won, lost,
+                           row_number() OVER (ORDER BY won DESC, won + lost ASC, player_id)
+                      FROM ({query}) AS board
+                """.format(query=query), [date, period, kicker_id] + params)
+
+    @api.model
+    def _cron_snapshot(self):
+        """Take the snapshots of the days since the last run, up to yesterday,
+        and drop the ones older than ``kicker.ranking_snapshot_retention_days``."""
+        retention = int(self.env['ir.config_parameter'].sudo().get_param(
+            'kicker.ranking_snapshot_retention_days', 400))
+        today = fields.Date.today()
+        oldest = today - datetime.timedelta(days=retention)
+        first, last = self._get_snapshot_range()
+        if not last or last < oldest:
+            self.env.cr.execute("TRUNCATE kicker_ranking_snapshot")
+            first, last = oldest, None
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        date = last + ONE_DAY if last else oldest
+        while date < today:
+            self._snapshot(date, last)
+            last = date
+            self._set_snapshot_range(first, last)
+            if auto_commit:
+                self.env.cr.commit()
+            date += ONE_DAY
+        if first < oldest:
+            self.env.cr.execute("DELETE FROM kicker_ranking_snapshot WHERE date < %s", [oldest])
+            self._set_snapshot_range(oldest, last)
+        _logger.info("Kicker ranking snapshots taken up to %s", last)
+        return True
+
+
+class KickerRankingSnapshotRange(models.Model):
+    """Days the ranking snapshots are taken for, in a single row. Not a config
+    parameter: it changes with every game of a past day, and writing config
+    parameters clears the caches of every worker."""
+    _name = 'kicker.ranking.snapshot.range'
+    _description = 'Kicker Ranking Snapshot Range'
+    _log_access = False
+
+    date_from = fields.Date('First Day', readonly=True)
+    date_to = fields.Date('Last Day', readonly=True)
@@ -0,0 +1,219 @@
+import logging
+import time
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+
+from .. import matchmaking
+from .. import profiling
+from .. import rating
+
+_logger = logging.getLogger(__name__)
+
+
+class KickerRatingStale(models.Model):
+    """Marks of the ratings being stale, see kicker.rating.pair._invalidate.
+    Not a config parameter: writing one clears the caches of every worker."""
+    _name = 'kicker.rating.stale'
+    _description = 'Kicker Stale Ratings'
+    _log_access = False
+
+    date = fields.Datetime(readonly=True, help="When the ratings were marked stale")
+
+
+class KickerRatingPair(models.Model):
+    """Elo rating of two players playing in the same team.
+
+    Player ratings are stored on res.partner; both are maintained by
+    kicker.game: new games are rated on top of the current ratings (see
+    ``_update``), while changing past games marks the ratings stale until
+    the cron replays the history (see ``_invalidate``).
+    """
+    _name = 'kicker.rating.pair'
+    _description = 'Kicker Pair Rating'
+    _order = 'rating desc'
+    _log_access = False
+
+    player1_id = fields.Many2one('res.partner', string='Player 1', readonly=True, required=True, ondelete='cascade')
+    player2_id = fields.Many2one('res.partner', string='Player 2', readonly=True, required=True, ondelete='cascade', index=True)
+    rating = fields.Float(readonly=True, digits=(16, 1))
+    games = fields.Integer(readonly=True)
+
+    _sql_constraints = [
+        # player1_id < player2_id, see rating.pair_key
+        ('pair_unique', 'unique(player1_id, player2_id)', 'A pair of players can only have one rating.'),
+    ]
+
+    @api.model
+    def _get_k_factor(self):
+        return float(self.env['ir.config_parameter'].sudo().get_param('kicker.rating_k_factor', rating.DEFAULT_K_FACTOR))
+
+    def _fetch_games(self, where_clause='TRUE', params=None):
+        """Return the (team_1, team_2, team_1_won) of the matching games, in chronological order."""
+        self.env.cr.execute("""
+            SELECT array_agg(s.player_id) FILTER (WHERE s.team = 'team_1'),
+                   array_agg(s.player_id) FILTER (WHERE s.team = 'team_2'),
+                   g.score_1 > g.score_2
+              FROM kicker_game g
+              JOIN kicker_session s ON (s.game_id = g.id AND s.player_id IS NOT NULL)
+             WHERE %s
+          GROUP BY g.id
+          ORDER BY g.date, g.id
+        """ % where_clause, params)
+        return self.env.cr.fetchall()
+
+    def _store(self, players, pairs):
+        cr = self.env.cr
+        if players:
+            ids, values = zip(*players.items())
+            cr.execute("""
+                UPDATE res_partner p
+                   SET rating = r.rating, rating_games = r.games
+                  FROM unnest(%s::int[], %s::float8[], %s::int[]) AS r(id, rating, games)
+                 WHERE p.id = r.id
+            """, [list(ids), [v[0] for v in values], [v[1] for v in values]])
+            self.env['res.partner'].invalidate_cache(['rating', 'rating_games'], list(ids))
+        if pairs:
+            keys, values = zip(*pairs.items())
+            cr.execute("""
+                INSERT INTO kicker_rating_pair (player1_id, player2_id, rating, games)
+                SELECT * FROM unnest(%s::int[], %s::int[], %s::float8[], %s::int[])
+                ON CONFLICT (player1_id, player2_id) DO UPDATE
+                   SET rating = EXCLUDED.rating, games = EXCLUDED.games
+            """, [[k[0] for k in keys], [k[1] for k in keys], [v[0] for v in values], [v[1] for v in values]])
+            self.invalidate_cache()
+        # see _get_pool_ratings
+        self.env['kicker.cache.version']._bump('kicker.stats')
+
+    @api.model
+    def _invalidate(self):
+        """Mark the ratings stale, e.g. when a past game changed: ratings
+        depend on the order of the games, so the next run of the cron replays
+        the history (see ``_cron_replay``)."""
+        # a new row every time: concurrent edits do not wait for each other
+        self.env.cr.execute("INSERT INTO kicker_rating_stale (date) VALUES (now() AT TIME ZONE 'UTC')")
+
+    @api.model
+    def _cron_replay(self):
+        """Replay the history if the ratings are stale."""
+        self.env.cr.execute("SELECT 1 FROM kicker_rating_stale LIMIT 1")
+        if not self.env.cr.fetchone():
+            return False
+        return self._replay()
+
+    @api.model
+    @profiling.helper
+    def _update(self, game_ids):
+        """Rate the given new games on top of the current ratings: only the
+        ratings of their players and pairs are read and written. Games dated
+        before already rated ones would be rated out of order: they mark the
+        ratings stale instead."""
+        game_ids = tuple(game_ids)
+        if not game_ids:
+            return
+        cr = self.env.cr
+        cr.execute("""
+            SELECT (SELECT min(date) FROM kicker_game WHERE id IN %s)
+                 < (SELECT max(date) FROM kicker_game WHERE id NOT IN %s)
+        """, [game_ids, game_ids])
+        if cr.fetchone()[0]:
+            return self._invalidate()
+        games = self._fetch_games("g.id IN %s", [game_ids])
+        player_ids = list({p for team_1, team_2, won in games for p in (team_1 or []) + (team_2 or [])})
+        if not player_ids:
+            return
+        cr.execute("SELECT id, rating, rating_games FROM res_partner WHERE id IN %s AND rating IS NOT NULL",
+                   [tuple(player_ids)])
+        players = {pid: [value, count] for pid, value, count in cr.fetchall()}
+        cr.execute("SELECT player1_id, player2_id, rating, games FROM kicker_rating_pair "
+                   "WHERE player1_id IN %s AND player2_id IN %s", [tuple(player_ids)] * 2)
+        pairs = {(p1, p2): [value, count] for p1, p2, value, count in cr.fetchall()}
+        players, pairs = rating.replay(
+            ((team_1 or [], team_2 or [], won) for team_1, team_2, won in games),
+            k_factor=self._get_k_factor(), players=players, pairs=pairs)
+        # only write what these games touched
+        pair_keys = {rating.pair_key(team) for team_1, team_2, won in games for team in (team_1 or [], team_2 or [])}
+        self._store({pid: players[pid] for pid in player_ids if pid in players},
+                    {key: pairs[key] for key in pair_keys if key in pairs})
+
+    @api.model
+    def _replay(self, k_factor=None, store=True):
+        """Recompute all the ratings from the whole game history, in chronological order.
+
+        With ``store=False`` nothing is written and the ``(players, pairs)``
+        dicts are returned, e.g. to try out another K-factor from a shell:
+
+            env['kicker.rating.pair']._replay(k_factor=24, store=False)
+        """
+        k_factor = self._get_k_factor() if k_factor is None else k_factor
+        start = time.time()
+        # the marks this replay accounts for, the ones of the transactions
+        # still running are left for the next one
+        self.env.cr.execute("SELECT max(id) FROM kicker_rating_stale")
+        stale_id = self.env.cr.fetchone()[0]
+        games = self._fetch_games()
+        players, pairs = rating.replay(((team_1 or [], team_2 or [], won) for team_1, team_2, won in games),
+                                       k_factor=k_factor)
+        _logger.info("Replayed the ratings of %s games in %.2fs", len(games), time.time() - start)
+        if not store:
+            return players, pairs
+        cr = self.env.cr
+        cr.execute("UPDATE res_partner SET rating = NULL, rating_games = 0 WHERE rating IS NOT NULL")
+        cr.execute("TRUNCATE kicker_rating_pair")
+        self.env['res.partner'].invalidate_cache(['rating', 'rating_games'])
+        self._store(players, pairs)
+        if stale_id:
+            cr.execute("DELETE FROM kicker_rating_stale WHERE id <= %s", [stale_id])
+        return True
+
+    @api.model
+    def _replay_if_empty(self):
+        """Backfill the ratings once, on upgrade."""
+        cr = self.env.cr
+        cr.execute("SELECT 1 FROM res_partner WHERE rating IS NOT NULL LIMIT 1")
+        if cr.fetchone():
+            return False
+        cr.execute("SELECT 1 FROM kicker_session LIMIT 1")
+        if not cr.fetchone():
+            return False
+        return self._replay()
+
+    @api.model
+    @tools.ormcache('player_ids', 'versions')
+    def _get_pool_ratings(self, player_ids, versions):
+        """Return the ratings among ``player_ids`` (a sorted tuple) as
+        ``(players, pairs)``: {player_id: (name, rating)} of the active
+        players and {(player1_id, player2_id): (rating, games)}. Cached for
+        the ``versions`` of the stats and the players (see
+        kicker.cache.version); the result must not be modified."""
+        cr = self.env.cr
+        cr.execute("""
+            SELECT id, name, COALESCE(rating, %s) FROM res_partner
+             WHERE id IN %s AND kicker_player AND active
+        """, [rating.DEFAULT_RATING, player_ids])
+        players = {pid: (name, value) for pid, name, value in cr.fetchall()}
+        cr.execute("""
+            SELECT player1_id, player2_id, rating, games FROM kicker_rating_pair
+             WHERE player1_id IN %s AND player2_id IN %s
+        """, [player_ids, player_ids])
+        pairs = {(p1, p2): (value, games) for p1, p2, value, games in cr.fetchall()}
+        return players, pairs
+
+    @api.model
+    @profiling.helper
+    def _get_matchmaking(self, player_ids, limit=5):
+        """Return the ``limit`` most balanced 2 vs 2 matches among the given
+        players, see matchmaking.best_matches."""
+        player_ids = tuple(sorted(set(int(pid) for pid in player_ids)))
+        if not player_ids:
+            raise UserError(_("Matchmaking needs at least 4 players."))
+        players, pairs = self._get_pool_ratings(
+            player_ids, self.env['kicker.cache.version']._get('kicker.stats', 'kicker.players'))
+        if len(players) < 4:
+            raise UserError(_("Matchmaking needs at least 4 players."))
+        matches = matchmaking.best_matches(
+            list(players), {pid: value for pid, (name, value) in players.items()}, pairs, limit=limit)
+        return [dict(match, **{
+            team: [{'id': pid, 'name': players[pid][0], 'rating': round(players[pid][1])} for pid in match[team]]
+            for team in ('team_1', 'team_2')
+        }) for match in matches]
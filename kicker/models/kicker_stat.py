@@ -1,68 +1,292 @@
+import logging
+
 from odoo import api, models, fields
 from odoo import tools
 
+_logger = logging.getLogger(__name__)
+
 
 class KickerStat(models.Model):
-    _auto = False
+    """One row per player per game, with the teammate and both opponents.
+
+    Kept up to date by kicker.game and kicker.session (see ``_refresh``).
+    """
     _name = "kicker.stat"
     _description = "Kicker Statistic"
     _rec_name = 'date'
     _order = 'date desc'
+    _log_access = False
 
-    player_id = fields.Many2one('res.partner', string='Player', readonly=True)
-    session_id = fields.Many2one('kicker.session', string='Session', readonly=True)
-    game_id = fields.Many2one('kicker.game', string='Game', readonly=True)
-    date = fields.Datetime('Game Date', readonly=True)
+    player_id = fields.Many2one('res.partner', string='Player', readonly=True, ondelete='cascade')
+    session_id = fields.Many2one('kicker.session', string='Session', readonly=True, ondelete='cascade')
+    game_id = fields.Many2one('kicker.game', string='Game', readonly=True, ondelete='cascade', index=True)
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, ondelete='cascade')
+    date = fields.Date('Game Date', readonly=True)
     won = fields.Boolean('Won', readonly=True)
-    teammate_id = fields.Many2one('res.partner', string='Teammate', readonly=True)
-    opponent1_id = fields.Many2one('res.partner', string='Opponent 1', readonly=True)
-    opponent2_id = fields.Many2one('res.partner', string='Opponent 2', readonly=True)
-
-    def _query(self, with_clause='', fields={}, groupby='', from_clause=''):
-        with_ = ("WITH %s" % with_clause) if with_clause else ""
-
-        select_ = """
-            s.id as id,
-            s.id as session_id,
-            g.id as game_id,
-            p.id as player_id,
-            s.won as won,
-            g.date as date,
-            tm.id as teammate_id,
-            o1.id as opponent1_id,
-            o2.id as opponent2_id
-        """
-
-        for field in fields.values():
-            select_ += field
-
-        from_ = """
-                kicker_session s
-                    join kicker_game g on (g.id = s.game_id)
-                    join res_partner p on s.player_id = p.id
-                    join kicker_session sm on (sm.game_id=g.id and sm.team=s.team and sm.player_id!=s.player_id)
-                    join res_partner tm on (sm.player_id=tm.id)
-                    join kicker_session os1 on os1.game_id=g.id and os1.team!=s.team
-                    join res_partner o1 on o1.id=os1.player_id
-                    join kicker_session os2 on os2.game_id=g.id and os2.team!=s.team and os2.id>os1.id
-                    join res_partner o2 on o2.id=os2.player_id
-                %s
-        """ % from_clause
-
-        groupby_ = """
-            s.id,
-            p.id,
-            tm.id,
-            o1.id,
-            o2.id,
-            g.id,
-            s.won %s
-        """ % (groupby)
-
-        return '%s (SELECT %s FROM %s GROUP BY %s)' % (with_, select_, from_, groupby_)
+    teammate_id = fields.Many2one('res.partner', string='Teammate', readonly=True, ondelete='cascade')
+    opponent1_id = fields.Many2one('res.partner', string='Opponent 1', readonly=True, ondelete='cascade')
+    opponent2_id = fields.Many2one('res.partner', string='Opponent 2', readonly=True, ondelete='cascade')
+
+    _columns_sql = "session_id, game_id, kicker_id, player_id, won, date, teammate_id, opponent1_id, opponent2_id"
+
+    def _query(self, where_clause='TRUE'):
+        return """
+            SELECT
+                s.id as session_id,
+                g.id as game_id,
+                g.kicker_id as kicker_id,
+                s.player_id as player_id,
+                s.won as won,
+                g.date as date,
+                sm.player_id as teammate_id,
+                os1.player_id as opponent1_id,
+                os2.player_id as opponent2_id
+            FROM kicker_session s
+                JOIN kicker_game g ON (g.id = s.game_id)
+                JOIN kicker_session sm ON (sm.game_id = g.id AND sm.team = s.team AND sm.player_id != s.player_id)
+                JOIN kicker_session os1 ON (os1.game_id = g.id AND os1.team != s.team)
+                JOIN kicker_session os2 ON (os2.game_id = g.id AND os2.team != s.team AND os2.id > os1.id)
+            WHERE s.player_id IS NOT NULL
+              AND os1.player_id IS NOT NULL
+              AND os2.player_id IS NOT NULL
+              AND (%s)
+        """ % where_clause
+
+    @api.model_cr_context
+    def _auto_init(self):
+        # kicker_stat used to be a view, it must go before the table can be created
+        if tools.table_kind(self.env.cr, self._table) == 'v':
+            tools.drop_view_if_exists(self.env.cr, self._table)
+        return super(KickerStat, self)._auto_init()
+
+    @api.model_cr
+    def init(self):
+        cr = self.env.cr
+        tools.create_index(cr, 'kicker_stat_player_id_date_index', self._table, ['player_id', 'date'])
+        tools.create_index(cr, 'kicker_stat_teammate_id_date_index', self._table, ['teammate_id', 'date'])
+        tools.create_index(cr, 'kicker_stat_opponent1_id_date_index', self._table, ['opponent1_id', 'date'])
+        tools.create_index(cr, 'kicker_stat_opponent2_id_date_index', self._table, ['opponent2_id', 'date'])
+        tools.create_index(cr, 'kicker_stat_kicker_id_date_index', self._table, ['kicker_id', 'date'])
+
+    @api.model
+    def _refresh(self, game_ids):
+        """Recompute the stat rows of the given games, in the current transaction."""
+        game_ids = tuple(game_ids)
+        if not game_ids:
+            return
+        # session.won is a stored compute, make sure it is flushed before reading it in SQL
+        self.recompute()
+        cr = self.env.cr
+        cr.execute("DELETE FROM kicker_stat WHERE game_id IN %s", [game_ids])
+        cr.execute("INSERT INTO kicker_stat (%s) %s" % (self._columns_sql, self._query("g.id IN %s")), [game_ids])
+        self.invalidate_cache()
+
+    @api.model
+    def _rebuild(self):
+        self.recompute()
+        cr = self.env.cr
+        cr.execute("TRUNCATE kicker_stat")
+        cr.execute("INSERT INTO kicker_stat (%s) %s" % (self._columns_sql, self._query()))
+        _logger.info("Rebuilt kicker statistics: %s rows", cr.rowcount)
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _fill_kicker_id(self):
+        """Backfill the kicker of the rows stored before it was a column."""
+        self.env.cr.execute("""
+            UPDATE kicker_stat st SET kicker_id = g.kicker_id
+              FROM kicker_game g
+             WHERE g.id = st.game_id AND g.kicker_id IS NOT NULL AND st.kicker_id IS NULL
+        """)
+        self.invalidate_cache(['kicker_id'])
+        return True
+
+    @api.model
+    def _rebuild_if_empty(self):
+        """Backfill the table once, when upgrading from the SQL view."""
+        cr = self.env.cr
+        cr.execute("SELECT 1 FROM kicker_stat LIMIT 1")
+        if cr.fetchone():
+            return False
+        cr.execute("SELECT 1 FROM kicker_session LIMIT 1")
+        if not cr.fetchone():
+            return False
+        return self._rebuild()
+
+
+class KickerStatDay(models.Model):
+    """Wins and losses per player, per kicker and per day.
+
+    Kept up to date by kicker.game and kicker.session (see ``_refresh``), this
+    is what the stored counters of res.partner are computed from.
+    """
+    _name = "kicker.stat.day"
+    _description = "Kicker Daily Statistic"
+    _rec_name = 'date'
+    _order = 'date desc'
+    _log_access = False
+
+    player_id = fields.Many2one('res.partner', string='Player', readonly=True, required=True, ondelete='cascade')
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, ondelete='cascade')
+    date = fields.Date('Date', readonly=True, required=True)
+    wins = fields.Integer('Wins', readonly=True)
+    losses = fields.Integer('Losses', readonly=True)
+
+    _insert_query = """
+        INSERT INTO kicker_stat_day (player_id, kicker_id, date, wins, losses)
+        SELECT s.player_id, g.kicker_id, g.date,
+               count(*) FILTER (WHERE s.won),
+               count(*) FILTER (WHERE s.won IS NOT TRUE)
+          FROM kicker_session s
+          JOIN kicker_game g ON (g.id = s.game_id)
+         WHERE s.player_id IS NOT NULL
+           AND (%s)
+      GROUP BY s.player_id, g.kicker_id, g.date
+    """
+
+    @api.model_cr
+    def init(self):
+        tools.create_index(self.env.cr, 'kicker_stat_day_player_id_date_index', self._table, ['player_id', 'date'])
+        # ranking boards sum up date ranges, of all kickers or of some of them
+        tools.create_index(self.env.cr, 'kicker_stat_day_date_index', self._table, ['date'])
+        tools.create_index(self.env.cr, 'kicker_stat_day_kicker_id_date_index', self._table, ['kicker_id', 'date'])
+
+    @api.model
+    def _refresh(self, keys):
+        """Recompute the buckets of the given (player_id, date) pairs, then the
+        counters of these players."""
+        keys = [key for key in keys if key[0]]
+        if not keys:
+            return
+        player_ids, dates = zip(*keys)
+        params = [list(player_ids), list(dates)]
+        cr = self.env.cr
+        cr.execute("""DELETE FROM kicker_stat_day
+                       WHERE (player_id, date) IN (SELECT * FROM unnest(%s::int[], %s::date[]))""", params)
+        cr.execute(self._insert_query % "(s.player_id, g.date) IN (SELECT * FROM unnest(%s::int[], %s::date[]))", params)
+        self.invalidate_cache()
+        self.env['res.partner']._update_kicker_stats(set(player_ids))
+
+    @api.model
+    def _rebuild(self):
+        self.recompute()
+        cr = self.env.cr
+        cr.execute("TRUNCATE kicker_stat_day")
+        cr.execute(self._insert_query % "TRUE")
+        _logger.info("Rebuilt kicker daily statistics: %s rows", cr.rowcount)
+        self.invalidate_cache()
+        cr.execute("""SELECT player_id FROM kicker_stat_day
+                       UNION SELECT id FROM res_partner WHERE wins != 0 OR losses != 0""")
+        self.env['res.partner']._update_kicker_stats([r[0] for r in cr.fetchall()])
+        return True
+
+    @api.model
+    def _rebuild_if_empty(self):
+        cr = self.env.cr
+        cr.execute("SELECT 1 FROM kicker_stat_day LIMIT 1")
+        if cr.fetchone():
+            return False
+        cr.execute("SELECT 1 FROM kicker_session LIMIT 1")
+        if not cr.fetchone():
+            return False
+        return self._rebuild()
+
+
+class KickerStatPair(models.Model):
+    """Wins and losses of a player with or against another player.
+
+    One row per player, other player, relation, kicker and day, plus all time
+    rows (without kicker nor date) so that the best teammates and opponents of
+    a player are one ordered and limited index scan. Kept up to date from
+    kicker.stat by kicker.game and kicker.session (see ``_refresh``).
+    """
+    _name = "kicker.stat.pair"
+    _description = "Kicker Pair Statistic"
+    _rec_name = 'other_id'
+    _order = 'date desc'
+    _log_access = False
+
+    player_id = fields.Many2one('res.partner', string='Player', readonly=True, required=True, ondelete='cascade')
+    other_id = fields.Many2one('res.partner', string='Other Player', readonly=True, required=True, ondelete='cascade')
+    relation = fields.Selection([('teammate', 'Teammate'), ('opponent', 'Opponent')], readonly=True, required=True)
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, ondelete='cascade')
+    date = fields.Date('Date', readonly=True, help="Empty for the all time statistics")
+    wins = fields.Integer('Wins', readonly=True)
+    losses = fields.Integer('Losses', readonly=True)
+
+    _insert_day_query = """
+        INSERT INTO kicker_stat_pair (player_id, other_id, relation, kicker_id, date, wins, losses)
+        SELECT st.player_id, o.other_id, o.relation, g.kicker_id, st.date,
+               count(*) FILTER (WHERE st.won),
+               count(*) FILTER (WHERE st.won IS NOT TRUE)
+          FROM kicker_stat st
+          JOIN kicker_game g ON (g.id = st.game_id)
+    CROSS JOIN LATERAL (VALUES (st.teammate_id, 'teammate'),
+                               (st.opponent1_id, 'opponent'),
+                               (st.opponent2_id, 'opponent')) AS o(other_id, relation)
+         WHERE o.other_id IS NOT NULL
+           AND (%s)
+      GROUP BY st.player_id, o.other_id, o.relation, g.kicker_id, st.date
+    """
+
+    _insert_total_query = """
+        INSERT INTO kicker_stat_pair (player_id, other_id, relation, wins, losses)
+        SELECT player_id, other_id, relation, SUM(wins), SUM(losses)
+          FROM kicker_stat_pair
+         WHERE date IS NOT NULL
+           AND (%s)
+      GROUP BY player_id, other_id, relation
+    """
 
     @api.model_cr
     def init(self):
-        # self._table = sale_report
-        tools.drop_view_if_exists(self.env.cr, self._table)
-        self.env.cr.execute("""CREATE or REPLACE VIEW %s as (%s)""" % (self._table, self._query()))
\ No newline at end of file
+        cr = self.env.cr
+        tools.create_index(cr, 'kicker_stat_pair_player_id_relation_date_index', self._table,
+                           ['player_id', 'relation', 'date'])
+        # top-k of the all time rows, see res.partner._get_pair_stats
+        for column in ('wins', 'losses'):
+            index = 'kicker_stat_pair_total_%s_index' % column
+            if not tools.index_exists(cr, index):
+                cr.execute("""CREATE INDEX {index} ON kicker_stat_pair (player_id, relation, {column} DESC)
+                              WHERE date IS NULL""".format(index=index, column=column))
+
+    @api.model
+    def _refresh(self, keys):
+        """Recompute the buckets of the given (player_id, date) pairs, and the
+        all time rows of these players."""
+        keys = [key for key in keys if key[0]]
+        if not keys:
+            return
+        player_ids, dates = zip(*keys)
+        params = [list(player_ids), list(dates)]
+        cr = self.env.cr
+        cr.execute("""DELETE FROM kicker_stat_pair
+                       WHERE (player_id, date) IN (SELECT * FROM unnest(%s::int[], %s::date[]))""", params)
+        cr.execute(self._insert_day_query % "(st.player_id, st.date) IN (SELECT * FROM unnest(%s::int[], %s::date[]))", params)
+        player_ids = tuple(set(player_ids))
+        cr.execute("DELETE FROM kicker_stat_pair WHERE player_id IN %s AND date IS NULL", [player_ids])
+        cr.execute(self._insert_total_query % "player_id IN %s", [player_ids])
+        self.invalidate_cache()
+
+    @api.model
+    def _rebuild(self):
+        self.recompute()
+        cr = self.env.cr
+        cr.execute("TRUNCATE kicker_stat_pair")
+        cr.execute(self._insert_day_query % "TRUE")
+        cr.execute(self._insert_total_query % "TRUE")
+        _logger.info("Rebuilt kicker pair statistics")
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _rebuild_if_empty(self):
+        cr = self.env.cr
+        cr.execute("SELECT 1 FROM kicker_stat_pair LIMIT 1")
+        if cr.fetchone():
+            return False
+        cr.execute("SELECT 1 FROM kicker_stat LIMIT 1")
+        if not cr.fetchone():
+            return False
+        return self._rebuild()
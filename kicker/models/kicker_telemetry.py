@@ -0,0 +1,231 @@
+import datetime
+import logging
+import math
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+
+from .. import profiling
+
+_logger = logging.getLogger(__name__)
+
+# rollups maintained at ingestion, named after the date_trunc fields of PostgreSQL
+ROLLUP_RESOLUTIONS = ['minute', 'hour']
+# steps of the series, and the rollup they are computed from
+SERIES_STEPS = {
+    'minute': 'minute',
+    'hour': 'hour',
+    'day': 'hour',
+    'week': 'hour',
+    'month': 'hour',
+}
+# default retention, in days, per resolution (see the kicker.telemetry_retention_days_* parameters)
+RETENTION_DAYS = {
+    'raw': 7,
+    'minute': 30,
+    'hour': 730,
+}
+MAX_SAMPLES = 1000
+MAX_METRIC_LENGTH = 64
+# clocks of the devices drift, but not that much
+FUTURE_TOLERANCE = datetime.timedelta(minutes=5)
+
+
+def parse_sample_date(value):
+    """Sample timestamp, as a UTC datetime: seconds since the epoch or a string."""
+    if value in (None, False, ''):
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.datetime.utcfromtimestamp(value)
+    return fields.Datetime.to_datetime(value)
+
+
+def _parse_value(value):
+    """Sample value as a float (booleans are 0 or 1, so that their average is
+    a ratio), None if it is not a number."""
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+class KickerTelemetry(models.Model):
+    """Raw samples sent by the kickers: one row per kicker, date and metric.
+
+    Kept for a few days only; charts read the rollups of kicker.telemetry.rollup,
+    updated at ingestion (see ``_ingest``).
+    """
+    _name = 'kicker.telemetry'
+    _description = 'Kicker Telemetry Sample'
+    _order = 'date DESC'
+    _rec_name = 'metric'
+    _log_access = False
+
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, required=True, ondelete='cascade')
+    date = fields.Datetime(readonly=True, required=True)
+    metric = fields.Char(readonly=True, required=True)
+    value = fields.Float(readonly=True)
+
+    _sql_constraints = [
+        # a kicker sending the same samples again, e.g. when it did not get the
+        # answer of the first request, stores them once (see _ingest)
+        ('sample_unique', 'unique(kicker_id, metric, date)', 'A kicker can only have one value per metric and date.'),
+    ]
+
+    @api.model_cr
+    def init(self):
+        tools.create_index(self._cr, 'kicker_telemetry_date_index', self._table, ['date'])
+
+    @api.model
+    @profiling.helper
+    def _ingest(self, kicker_id, samples):
+        """Store the samples of a kicker and update their rollups; return the
+        number of values stored. Samples already stored are ignored, so that
+        sending the same ones again does not count them twice.
+
+        Samples are dicts of metric values, plus their ``date`` (seconds since
+        the epoch or a UTC datetime string, now by default), e.g.
+        ``{"date": 1556712000, "available": true, "temperature": "15.4"}``.
+        Values that are not numbers and samples dated in the future are dropped.
+        """
+        now = fields.Datetime.now()
+        dates, metrics, values = [], [], []
+        for sample in samples[:MAX_SAMPLES]:
+            try:
+                date = parse_sample_date(sample.get('date')) or now
+            except (TypeError, ValueError, OverflowError):
+                continue
+            if date > now + FUTURE_TOLERANCE:
+                continue
+            for metric, value in sample.items():
+                value = _parse_value(value)
+                if metric == 'date' or value is None or len(metric) > MAX_METRIC_LENGTH:
+                    continue
+                dates.append(date)
+                metrics.append(metric)
+                values.append(value)
+        if not dates:
+            return 0
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO kicker_telemetry (kicker_id, date, metric, value)
+            SELECT %s, s.date, s.metric, s.value
+              FROM unnest(%s::timestamp[], %s::varchar[], %s::float8[]) AS s(date, metric, value)
+                ON CONFLICT (kicker_id, metric, date) DO NOTHING
+         RETURNING date, metric, value
+        """, [kicker_id, dates, metrics, values])
+        inserted = cr.fetchall()
+        if not inserted:
+            return 0
+        # only roll up the new samples
+        params = [list(column) for column in zip(*inserted)]
+        for resolution in ROLLUP_RESOLUTIONS:
+            # min, max, count and sum merge with the existing bucket, whatever the order of arrival
+            cr.execute("""
+                INSERT INTO kicker_telemetry_rollup AS r
+                            (kicker_id, metric, resolution, date, sample_count, value_sum, value_min, value_max)
+                SELECT %s, s.metric, %s, date_trunc(%s, s.date), count(*), sum(s.value), min(s.value), max(s.value)
+                  FROM unnest(%s::timestamp[], %s::varchar[], %s::float8[]) AS s(date, metric, value)
+              GROUP BY s.metric, date_trunc(%s, s.date)
+                ON CONFLICT (kicker_id, metric, resolution, date) DO UPDATE
+                   SET sample_count = r.sample_count + EXCLUDED.sample_count,
+                       value_sum = r.value_sum + EXCLUDED.value_sum,
+                       value_min = LEAST(r.value_min, EXCLUDED.value_min),
+                       value_max = GREATEST(r.value_max, EXCLUDED.value_max)
+            """, [kicker_id, resolution, resolution] + params + [resolution])
+        self.invalidate_cache()
+        self.env['kicker.telemetry.rollup'].invalidate_cache()
+        return len(inserted)
+
+    @api.model
+    def _cron_prune(self):
+        """Drop the raw samples and the rollups older than their retention,
+        ``kicker.telemetry_retention_days_<raw|minute|hour>`` days."""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        now = fields.Datetime.now()
+        cr = self.env.cr
+        for resolution, default in RETENTION_DAYS.items():
+            days = int(get_param('kicker.telemetry_retention_days_%s' % resolution, default))
+            cutoff = now - datetime.timedelta(days=days)
+            if resolution == 'raw':
+                cr.execute("DELETE FROM kicker_telemetry WHERE date < %s", [cutoff])
+            else:
+                cr.execute("DELETE FROM kicker_telemetry_rollup WHERE resolution = %s AND date < %s",
+                           [resolution, cutoff])
+            _logger.info("Pruned %s %s telemetry rows older than %s", cr.rowcount, resolution, cutoff)
+        return True
+
+
+class KickerTelemetryRollup(models.Model):
+    """Count, sum, min and max of the samples of a metric of a kicker, per
+    minute or per hour."""
+    _name = 'kicker.telemetry.rollup'
+    _description = 'Kicker Telemetry Rollup'
+    _order = 'date DESC'
+    _rec_name = 'metric'
+    _log_access = False
+
+    kicker_id = fields.Many2one('kicker.kicker', string='Kicker', readonly=True, required=True, ondelete='cascade')
+    metric = fields.Char(readonly=True, required=True)
+    resolution = fields.Selection([('minute', 'Minute'), ('hour', 'Hour')], readonly=True, required=True)
+    date = fields.Datetime(readonly=True, required=True, help="Start of the bucket")
+    sample_count = fields.Integer('Samples', readonly=True)
+    value_sum = fields.Float('Sum', readonly=True)
+    value_min = fields.Float('Minimum', readonly=True)
+    value_max = fields.Float('Maximum', readonly=True)
+    value_avg = fields.Float('Average', compute='_compute_value_avg')
+
+    _sql_constraints = [
+        ('bucket_unique', 'unique(kicker_id, metric, resolution, date)', 'There is one rollup per bucket.'),
+    ]
+
+    @api.model_cr
+    def init(self):
+        tools.create_index(self._cr, 'kicker_telemetry_rollup_resolution_date_index', self._table,
+                           ['resolution', 'date'])
+
+    @api.depends('sample_count', 'value_sum')
+    def _compute_value_avg(self):
+        for rollup in self:
+            rollup.value_avg = rollup.value_sum / rollup.sample_count if rollup.sample_count else 0.0
+
+    @api.model
+    @profiling.helper
+    def _get_series(self, kicker_id, metric, date_from=None, date_to=None, step=None):
+        """Return the series of ``metric`` of a kicker between ``date_from``
+        (a week ago by default) and ``date_to`` (now by default), as a list of
+        {date, avg, min, max, count} per ``step`` (see SERIES_STEPS; by
+        default the smallest one giving at most a few hundred points).
+
+        Only rollups are read: the minute ones for a step of a minute, the
+        hourly ones otherwise.
+        """
+        date_to = fields.Datetime.to_datetime(date_to) or fields.Datetime.now()
+        date_from = fields.Datetime.to_datetime(date_from) or date_to - datetime.timedelta(days=7)
+        if not step:
+            span = date_to - date_from
+            step = ('minute' if span <= datetime.timedelta(hours=6) else
+                    'hour' if span <= datetime.timedelta(days=14) else
+                    'day' if span <= datetime.timedelta(days=366) else 'week')
+        if step not in SERIES_STEPS:
+            raise UserError(_("Unknown telemetry step: %s") % step)
+        resolution = SERIES_STEPS[step]
+        self.env.cr.execute("""
+            SELECT date_trunc(%s, date) AS step, SUM(value_sum) / SUM(sample_count),
+                   MIN(value_min), MAX(value_max), SUM(sample_count)
+              FROM kicker_telemetry_rollup
+             WHERE kicker_id = %s AND metric = %s AND resolution = %s
+               AND date >= date_trunc(%s, %s::timestamp) AND date < %s
+          GROUP BY step
+          ORDER BY step
+        """, [step, kicker_id, metric, resolution, step, date_from, date_to])
+        return [{
+            'date': date,
+            'avg': avg,
+            'min': value_min,
+            'max': value_max,
+            'count': count,
+        } for date, avg, value_min, value_max, count in self.env.cr.fetchall()]
@@ -1,157 +1,425 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from .. import profiling
 
 import datetime
+import logging
 from dateutil import relativedelta
 
+_logger = logging.getLogger(__name__)
+
+RANKING_PERIODS = {
+    'week': relativedelta.relativedelta(weeks=1),
+    'month': relativedelta.relativedelta(months=1),
+    'year': relativedelta.relativedelta(years=1),
+    'all': None,
+}
+
+RANKING_ORDERS = {
+    'won': 'won DESC, matches ASC',
+    'lost': 'lost DESC, matches ASC',
+    'matches': 'matches DESC',
+    'ratio': 'ratio DESC, matches DESC',
+    'name': 'name ASC',
+    'rating': 'rating DESC NULLS LAST, matches DESC',
+}
+
+KICKER_PLAYER_INFO_FIELDS = ['id', 'name', 'email', 'main_kicker_id', 'tagline', 'wins', 'losses', 'win_ratio',
+                             'weekly_wins', 'weekly_losses', 'weekly_win_ratio', 'rating']
+KICKER_PROFILE_FIELDS = {'name', 'email', 'tagline', 'main_kicker_id', 'kicker_player', 'active'}
+DIRECTORY_PAGE_SIZE = 50
+# changes committed out of order can be older than the version a client synced
+# at, they are sent again to be safe
+DIRECTORY_SYNC_MARGIN = datetime.timedelta(minutes=1)
+
 class ResPartner(models.Model):
     _inherit = 'res.partner'
 
     kicker_session_ids = fields.One2many('kicker.session', 'player_id', string='Kicker Sessions')
-    wins = fields.Integer(compute='_compute_stats', string='Total Wins')
-    losses = fields.Integer(compute='_compute_stats', string='Total Losses')
-    win_ratio = fields.Integer(compute='_compute_stats', string='Win Ratio')
-    weekly_wins = fields.Integer(compute='_compute_stats', string='Weekly Wins')
-    weekly_losses = fields.Integer(compute='_compute_stats', string='Weekly Losses')
-    weekly_win_ratio = fields.Integer(compute='_compute_stats', string='Weekly Win Ratio')
+    # stored counters, maintained from kicker.stat.day by _update_kicker_stats
+    wins = fields.Integer(string='Total Wins', readonly=True)
+    losses = fields.Integer(string='Total Losses', readonly=True)
+    win_ratio = fields.Integer(string='Win Ratio', readonly=True)
+    weekly_wins = fields.Integer(string='Weekly Wins', readonly=True)
+    weekly_losses = fields.Integer(string='Weekly Losses', readonly=True)
+    weekly_win_ratio = fields.Integer(string='Weekly Win Ratio', readonly=True)
+    # maintained by kicker.rating.pair, from all the games ever played
+    rating = fields.Float(string='Rating', readonly=True, digits=(16, 1))
+    rating_games = fields.Integer(string='Rated Games', readonly=True)
     kicker_player = fields.Boolean()
     main_kicker_id = fields.Many2one('kicker.kicker', 'Default Kicker')
     tagline = fields.Char()
 
-    @api.depends('kicker_session_ids')
-    def _compute_stats(self):
-        all_data = self.env['kicker.session'].read_group([('player_id', 'in', self.ids)], fields=['player_id', 'won'], groupby=['player_id', 'won'], lazy=False)
-        weekly_data = self.env['kicker.session'].read_group([('player_id', 'in', self.ids), ('game_date', '>', datetime.datetime.now() - datetime.timedelta(days=7))], fields=['player_id', 'won'], groupby=['player_id', 'won'], lazy=False)
-        for partner in self:
-            wins = list(filter(lambda d: d['player_id'][0] == partner.id and d['won'], all_data))
-            partner.wins = wins and sum(list(map(lambda w: w['__count'], wins)))
-            losses = list(filter(lambda d: d['player_id'][0] == partner.id and not d['won'], all_data))
-            partner.losses = losses and sum(list(map(lambda l: l['__count'], losses)))
-            if not (partner.wins + partner.losses):
-                partner.win_ratio = 0
-            else:
-                partner.win_ratio = 100*partner.wins/(partner.wins+partner.losses)
-            weekly_wins = list(filter(lambda d: d['player_id'][0] == partner.id and d['won'], weekly_data))
-            partner.weekly_wins = weekly_wins and sum(list(map(lambda w: w['__count'], weekly_wins)))
-            weekly_losses = list(filter(lambda d: d['player_id'][0] == partner.id and not d['won'], weekly_data))
-            partner.weekly_losses = weekly_losses and sum(list(map(lambda l: l['__count'], weekly_losses)))
-            if not (partner.weekly_wins + partner.weekly_losses):
-                partner.weekly_win_ratio = 0
-            else:
-                partner.weekly_win_ratio = 100*partner.weekly_wins/(partner.weekly_wins+partner.weekly_losses)
-
-    def _get_usual_players(self):
+    @api.model
+    def _update_kicker_stats(self, partner_ids):
+        """Recompute the stored win/loss counters of the given partners from their daily stats."""
+        partner_ids = tuple(partner_ids)
+        if not partner_ids:
+            return
+        week_ago = fields.Date.today() - datetime.timedelta(days=7)
+        self.env.cr.execute("""
+            WITH totals AS (
+                SELECT p.id,
+                       COALESCE(SUM(d.wins), 0) AS wins,
+                       COALESCE(SUM(d.losses), 0) AS losses,
+                       COALESCE(SUM(d.wins) FILTER (WHERE d.date > %(week_ago)s), 0) AS weekly_wins,
+                       COALESCE(SUM(d.losses) FILTER (WHERE d.date > %(week_ago)s), 0) AS weekly_losses
+                  FROM res_partner p
+             LEFT JOIN kicker_stat_day d ON (d.player_id = p.id)
+                 WHERE p.id IN %(ids)s
+              GROUP BY p.id
+            )
+            UPDATE res_partner p
+               SET wins = t.wins,
+                   losses = t.losses,
+                   win_ratio = CASE WHEN t.wins + t.losses > 0 THEN 100 * t.wins / (t.wins + t.losses) ELSE 0 END,
+                   weekly_wins = t.weekly_wins,
+                   weekly_losses = t.weekly_losses,
+                   weekly_win_ratio = CASE WHEN t.weekly_wins + t.weekly_losses > 0
+                                           THEN 100 * t.weekly_wins / (t.weekly_wins + t.weekly_losses) ELSE 0 END
+              FROM totals t
+             WHERE t.id = p.id
+        """, {'ids': partner_ids, 'week_ago': week_ago})
+        self.invalidate_cache(['wins', 'losses', 'win_ratio', 'weekly_wins', 'weekly_losses', 'weekly_win_ratio'], list(partner_ids))
+
+    @api.model
+    def _cron_roll_weekly_stats(self):
+        """Move the 7-day window forward: only partners with games in the window can change."""
+        self.env.cr.execute("SELECT id FROM res_partner WHERE weekly_wins != 0 OR weekly_losses != 0")
+        self._update_kicker_stats([r[0] for r in self.env.cr.fetchall()])
+
+    def _get_kicker_scope(self, kicker_id=None, location=None):
+        """Return the ids of the kickers the stats shown to this player are
+        scoped to, as a tuple, or None for all of them: ``kicker_id`` ('all'
+        for every kicker), else the kickers of ``location``, else the main
+        kicker of the player."""
+        self.ensure_one()
+        if kicker_id == 'all':
+            return None
+        if kicker_id:
+            return (int(kicker_id),)
+        if location:
+            return tuple(self.env['kicker.kicker'].sudo().search([('location', '=', location)], order='id').ids)
+        return (self.main_kicker_id.id,) if self.main_kicker_id else None
+
+    @profiling.helper
+    def _get_pair_stats(self, relation, sort, period=False, limit=6, kicker_ids=None):
+        """Return the ids of the players this player played the most with
+        (``relation`` 'teammate') or against ('opponent') during ``period``
+        (see RANKING_PERIODS, all time by default) on ``kicker_ids`` (all
+        kickers by default), ordered by ``sort``: the number of 'wins',
+        'losses' or 'matches' of this player."""
         self.ensure_one()
-        month_ago = datetime.datetime.now() - relativedelta.relativedelta(months=1)
-        friends = self.env['kicker.stat'].read_group(domain=[('player_id', '=', self.id), ('date', '>', month_ago)],
-                                                   fields=['teammate_id'], groupby=['teammate_id'])
-        ordered_friends = list(map(lambda f: f['teammate_id'][0], sorted(friends, key=lambda f: f['teammate_id_count'], reverse=True)))
-        return self.browse(ordered_friends)
+        delta = RANKING_PERIODS[period or 'all']
+        order = {'wins': 'wins', 'losses': 'losses', 'matches': 'wins + losses'}[sort]
+        if delta is None and kicker_ids is None:
+            # all time rows, an index scan on (player_id, relation, wins/losses)
+            query = """
+                SELECT other_id FROM kicker_stat_pair
+                 WHERE player_id = %(player_id)s AND relation = %(relation)s AND date IS NULL
+                   AND {order} > 0
+              ORDER BY {order} DESC, other_id
+                 LIMIT %(limit)s
+            """
+        else:
+            query = """
+                SELECT other_id FROM kicker_stat_pair
+                 WHERE player_id = %(player_id)s AND relation = %(relation)s AND date > %(date)s
+                   AND {kicker}
+              GROUP BY other_id
+                HAVING SUM({order}) > 0
+              ORDER BY SUM({order}) DESC, other_id
+                 LIMIT %(limit)s
+            """
+        kicker = "kicker_id = ANY(%(kicker_ids)s)" if kicker_ids is not None else "TRUE"
+        self.env.cr.execute(query.format(order=order, kicker=kicker), {
+            'player_id': self.id,
+            'relation': relation,
+            # the day rows of the scope, when all time
+            'date': fields.Date.today() - delta if delta else datetime.date.min,
+            'kicker_ids': list(kicker_ids or ()),
+            'limit': limit or None,
+        })
+        return [r[0] for r in self.env.cr.fetchall()]
 
-    def _get_teammeates(self, period=False, limit=6):
+    def _get_usual_players(self, kicker_ids=None):
         self.ensure_one()
-        domain = [('player_id', '=', self.id), ('won', '=', True)]
-        if period=='month':
-            month_ago = datetime.datetime.now() - relativedelta.relativedelta(months=1)
-            domain.append([('date', '>', month_ago)])
-        mates = self.env['kicker.stat'].read_group(domain=domain,
-                                                   fields=['teammate_id'], groupby=['teammate_id'])
-        ordered_mates = list(map(lambda f: f['teammate_id'][0], sorted(mates, key=lambda f: f['teammate_id_count'], reverse=True)))
-        if limit:
-            ordered_mates = ordered_mates[:limit]
-        return self.browse(ordered_mates)
-    
-    def _get_opponents(self, period=False, limit=6):
+        return self.browse(self._get_pair_stats('teammate', 'matches', period='month', limit=None,
+                                                kicker_ids=kicker_ids))
+
+    def _get_teammeates(self, period=False, limit=6, kicker_ids=None):
+        """Teammates this player won the most games with."""
         self.ensure_one()
-        domain = [('player_id', '=', self.id), ('won', '=', False)]
-        if period=='month':
-            month_ago = datetime.datetime.now() - relativedelta.relativedelta(months=1)
-            domain.append([('date', '>', month_ago)])
-        # check for all stats where the opponent is in either opponent1_id or opponent2_id field
-        opps1 = self.env['kicker.stat'].read_group(domain=domain,
-                                                   fields=['opponent1_id'], groupby=['opponent1_id'])
-        opps2 = self.env['kicker.stat'].read_group(domain=domain,
-                                                   fields=['opponent2_id'], groupby=['opponent2_id'])
-        # combine data (in case an opponent is present in both fields)
-        all_opps = list(map(lambda o: o['opponent1_id'][0], opps1))
-        all_opps += list(map(lambda o: o['opponent2_id'][0], opps2))
-        all_opps = set(all_opps)
-        vals = dict.fromkeys(all_opps, 0)
-        for opp in all_opps:
-            as_opp1 = list(filter(lambda o: o['opponent1_id'][0]==opp, opps1))
-            if as_opp1:
-                vals[opp] += as_opp1[0]['opponent1_id_count']
-            as_opp2 = list(filter(lambda o: o['opponent2_id'][0]==opp, opps2))
-            if as_opp2:
-                vals[opp] += as_opp2[0]['opponent2_id_count']
-        ordered_opps = sorted(vals.items(), key=lambda e: e[1], reverse=True)
-        ordered_opps = [o[0] for o in ordered_opps]
-        if limit:
-            ordered_opps = ordered_opps[:limit]
-        return self.browse(ordered_opps)
-
-    def _community_stats(self):
-        usual = self._get_usual_players()
-        rare = self.search([('kicker_player', '=', True), ('id', 'not in', usual.ids + self.ids)], order='name asc')
+        return self.browse(self._get_pair_stats('teammate', 'wins', period=period, limit=limit,
+                                                kicker_ids=kicker_ids))
+
+    def _get_opponents(self, period=False, limit=6, kicker_ids=None):
+        """Opponents this player lost the most games against."""
+        self.ensure_one()
+        return self.browse(self._get_pair_stats('opponent', 'losses', period=period, limit=limit,
+                                                kicker_ids=kicker_ids))
+
+    @profiling.helper
+    def _community_stats(self, kicker_ids=None):
+        usual = self._get_usual_players(kicker_ids=kicker_ids)
+        # only the first page, the app gets the next ones from the directory
+        rare = self._get_player_directory(exclude_ids=usual.ids + self.ids)
         return {
             'usual': usual.read(['id', 'name', 'tagline']),
-            'rare': rare.read(['id', 'name', 'tagline']),
+            'rare': rare['players'],
+            'rare_next': rare['next'],
+        }
+
+    @api.model_cr
+    def init(self):
+        super(ResPartner, self).init()
+        cr = self.env.cr
+        # keyset pagination of the player directory
+        tools.create_index(cr, 'res_partner_name_id_index', self._table, ['name', 'id'])
+        # substring search in the player directory
+        cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if not cr.fetchone():
+            try:
+                with cr.savepoint():
+                    cr.execute("CREATE EXTENSION pg_trgm")
+            except Exception:
+                _logger.warning("Could not create the pg_trgm extension, the player directory "
+                                "search will not be indexed")
+                return
+        for column in ('name', 'tagline'):
+            index = 'res_partner_kicker_player_%s_trgm_index' % column
+            if not tools.index_exists(cr, index):
+                cr.execute("CREATE INDEX {index} ON res_partner USING gin ({column} gin_trgm_ops) "
+                           "WHERE kicker_player".format(index=index, column=column))
+
+    @api.model
+    def _get_player_directory_version(self):
+        """Version of the player directory, cached until a player profile changes (see ``write``)."""
+        return self._get_player_directory_write_date(self.env['kicker.cache.version']._get('kicker.players'))
+
+    @api.model
+    @tools.ormcache('versions')
+    def _get_player_directory_write_date(self, versions):
+        self.env.cr.execute("SELECT max(write_date) FROM res_partner")
+        return fields.Datetime.to_string(self.env.cr.fetchone()[0])
+
+    @api.model
+    @profiling.helper
+    def _get_player_directory(self, search=None, after=None, limit=DIRECTORY_PAGE_SIZE, since=None, exclude_ids=()):
+        """One page of the active players, ordered by name.
+
+        :param search: only the players with this in their name or tagline
+        :param after: (name, id) of the last player of the previous page, see ``next``
+        :param since: only the players changed since this directory version;
+                      the players removed since are then listed in ``removed``
+        :return: dict with the ``players`` (id, name and tagline), ``next``,
+                 the ``after_name`` and ``after_id`` of the next page or None,
+                 and ``removed``
+        """
+        limit = max(1, min(int(limit), 500))
+        where, params = ["p.kicker_player", "p.active"], []
+        if since:
+            since = fields.Datetime.to_datetime(since) - DIRECTORY_SYNC_MARGIN
+            where.append("p.write_date > %s")
+            params.append(since)
+        if search:
+            pattern = '%%%s%%' % search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("(p.name ILIKE %s OR p.tagline ILIKE %s)")
+            params += [pattern, pattern]
+        if after and all(after):
+            where.append("(p.name, p.id) > (%s, %s)")
+            params += list(after)
+        if exclude_ids:
+            where.append("p.id NOT IN %s")
+            params.append(tuple(exclude_ids))
+        self.env.cr.execute("""
+            SELECT p.id, p.name, p.tagline
+              FROM res_partner p
+             WHERE {where}
+          ORDER BY p.name, p.id
+             LIMIT %s
+        """.format(where=' AND '.join(where)), params + [limit + 1])
+        rows = self.env.cr.fetchall()
+        result = {
+            'players': [{'id': pid, 'name': name, 'tagline': tagline} for pid, name, tagline in rows[:limit]],
+            'next': {'after_name': rows[limit - 1][1], 'after_id': rows[limit - 1][0]} if len(rows) > limit else None,
+            'removed': [],
         }
+        if since and not after:
+            self.env.cr.execute("""
+                SELECT id FROM res_partner
+                 WHERE write_date > %s AND (kicker_player IS NOT TRUE OR active IS NOT TRUE)
+            """, [since])
+            result['removed'] = [r[0] for r in self.env.cr.fetchall()]
+        return result
 
-    def _compute_ratio(self, period=False):
-        domain = [('player_id', '=', self.id)]
-        if period=='month':
-            month_ago = datetime.datetime.now() - relativedelta.relativedelta(months=1)
-            domain.append([('date', '>', month_ago)])
-        if period=='year':
-            year_ago = datetime.datetime.now() - relativedelta.relativedelta(years=1)
-            domain.append([('date', '>', year_ago)])
-        stats = self.env['kicker.stat'].read_group(domain=domain,
-                                                   fields=['date', 'won'], groupby=['date:month', 'won'], lazy=False)
-        print(stats)
-        stats = list(map(lambda w: (w['date:month'], w['date_count']), stats))
-        print(stats)
-        return stats
-
-    def _dashboard_stats(self):
+    @profiling.helper
+    def _get_ratio_series(self, months=6, kicker_ids=None):
+        """Monthly win ratio of the last ``months`` months (current one
+        included) on ``kicker_ids`` (all kickers by default), as a list of
+        (first day of the month, ratio); the ratio is None for months without
+        games."""
         self.ensure_one()
-        teammates = self._get_teammeates()
-        nightmares = self._get_opponents()
+        first_month = fields.Date.today().replace(day=1) - relativedelta.relativedelta(months=months - 1)
+        self.env.cr.execute("""
+            SELECT date_trunc('month', date)::date AS month, SUM(wins), SUM(losses)
+              FROM kicker_stat_day
+             WHERE player_id = %s AND date >= %s AND {kicker}
+          GROUP BY month
+        """.format(kicker="kicker_id = ANY(%s)" if kicker_ids is not None else "TRUE"),
+            [self.id, first_month] + ([list(kicker_ids)] if kicker_ids is not None else []))
+        ratios = {month: 100 * wins // (wins + losses)
+                  for month, wins, losses in self.env.cr.fetchall() if wins + losses}
+        series = [first_month + relativedelta.relativedelta(months=i) for i in range(months)]
+        return [(month, ratios.get(month)) for month in series]
+
+    def _get_scoped_counters(self, kicker_ids=None, weekly=False):
+        """Return the wins, losses and win ratio of this player on ``kicker_ids``,
+        of the last 7 days if ``weekly``; the stored counters when on all kickers."""
+        self.ensure_one()
+        if kicker_ids is None:
+            if weekly:
+                return self.weekly_wins, self.weekly_losses, self.weekly_win_ratio
+            return self.wins, self.losses, self.win_ratio
+        # same window as _update_kicker_stats
+        date_from = fields.Date.today() - datetime.timedelta(days=7) if weekly else datetime.date.min
+        self.env.cr.execute("""
+            SELECT COALESCE(SUM(wins), 0), COALESCE(SUM(losses), 0) FROM kicker_stat_day
+             WHERE player_id = %s AND kicker_id = ANY(%s) AND date > %s
+        """, [self.id, list(kicker_ids), date_from])
+        wins, losses = self.env.cr.fetchone()
+        return wins, losses, 100 * wins // (wins + losses) if wins + losses else 0
+
+    @profiling.helper
+    def _dashboard_stats(self, kicker_ids=None):
+        self.ensure_one()
+        teammates = self._get_teammeates(kicker_ids=kicker_ids)
+        nightmares = self._get_opponents(kicker_ids=kicker_ids)
+        series = self._get_ratio_series(kicker_ids=kicker_ids)
+        wins, losses, ratio = self._get_scoped_counters(kicker_ids)
         data = {
             'name': self.name,
-            'wins': self.wins,
-            'losses': self.losses,
+            'wins': wins,
+            'losses': losses,
             'teammates': teammates.read(['id', 'name', 'tagline']),
             'nightmares': nightmares.read(['id', 'name', 'tagline']),
-            'ratio': self.win_ratio,
-            'graph': [58, 69, 61, 85, 89]
+            'ratio': ratio,
+            'rating': self.rating,
+            'graph': [ratio for month, ratio in series],
+            'graph_labels': [month.strftime('%b') for month, ratio in series],
         }
         return data
 
+    @profiling.helper
+    def _player_info(self, kicker_ids=None):
+        """Profile of this player, with the counters of the games on
+        ``kicker_ids`` (all kickers when None)."""
+        self.ensure_one()
+        info = self.read(KICKER_PLAYER_INFO_FIELDS)[0]
+        if kicker_ids is not None:
+            info['wins'], info['losses'], info['win_ratio'] = self._get_scoped_counters(kicker_ids)
+            info['weekly_wins'], info['weekly_losses'], info['weekly_win_ratio'] = \
+                self._get_scoped_counters(kicker_ids, weekly=True)
+        info['kicker_ids'] = kicker_ids and list(kicker_ids)
+        return info
+
+    @api.model
+    @profiling.helper
+    def _get_app_kickers(self):
+        return {
+            'kickers': self.env['kicker.kicker'].sudo().search_read([], fields=['id', 'name']),
+            'default': self.env.user.partner_id.main_kicker_id.id,
+        }
+
+    @api.model
+    @profiling.helper
+    def _get_app_data(self, partner_id, today, kicker_ids=None):
+        """Dashboard, profile and community of a player on ``kicker_ids`` (a
+        tuple, all kickers when None), for the app to start with. Cached until
+        the next game or profile change (see ``write`` and
+        kicker.game._refresh_stats); ``today`` moves the periods forward."""
+        versions = self.env['kicker.cache.version']._get('kicker.stats', 'kicker.players')
+        return self._get_app_data_cached(partner_id, today, kicker_ids, versions)
+
+    @api.model
+    @tools.ormcache('partner_id', 'today', 'kicker_ids', 'versions')
+    def _get_app_data_cached(self, partner_id, today, kicker_ids, versions):
+        partner = self.browse(partner_id)
+        return {
+            'dashboard': partner._dashboard_stats(kicker_ids=kicker_ids),
+            'player': partner._player_info(kicker_ids),
+            'community': partner._community_stats(kicker_ids=kicker_ids),
+        }
+
     @api.model
-    def _get_rankings(self, period='month', metric='all'):
-        if period=='week':
-            date_limit = datetime.datetime.now() - relativedelta.relativedelta(weeks=1)
-        elif period=='month':
-            date_limit = datetime.datetime.now() - relativedelta.relativedelta(months=1)
-        elif period=='year':
-            date_limit = datetime.datetime.now() - relativedelta.relativedelta(years=1)
-        domain = [('date', '>', date_limit)]
-        stats = self.env['kicker.stat'].read_group(domain=domain,
-                                                   fields=['player_id', 'won'],
-                                                   groupby=['player_id', 'won'],
-                                                   lazy=False)
-        # proably possible to get it in the read_group, i'm being lazy
-        partner_ids = set(map(lambda s: s['player_id'][0], stats))
-        names = self.browse(partner_ids).read(['name'])
-        res = list()
-        for pid in partner_ids:
-            wins = list(filter(lambda s: {('player_id','=',pid),('won','=',True)}.issubset(s['__domain']),stats))[0]['__count']
-            losses = list(filter(lambda s: {('player_id','=',pid),('won','=',False)}.issubset(s['__domain']),stats))[0]['__count']
-            res.append({
-                'id': pid,
-                'name': list(filter(lambda s: s['id']==pid, names))[0]['name'],
-                'won': wins,
-                'lost': losses,
-                'matches': wins + losses,
-            })
+    @profiling.helper
+    def _get_rankings(self, period='month', sort='won', offset=0, limit=None, kicker_ids=None, date=None):
+        """Leaderboard of the given period ('week', 'month', 'year' or 'all'),
+        sorted by 'won', 'lost', 'matches', 'ratio', 'rating' or 'name'.
+
+        The board is the one at the end of ``date`` (today by default), for
+        the games of ``kicker_ids`` (all of them by default). Every player has
+        a ``rank`` and a ``rank_delta``: the number of places gained since the
+        day before, None if the player was not ranked then.
+
+        Ratings are not bound to the period: they always account for all the games."""
+        if period not in RANKING_PERIODS:
+            raise UserError(_("Unknown ranking period: %s") % period)
+        if sort not in RANKING_ORDERS:
+            raise UserError(_("Unknown ranking sort: %s") % sort)
+        today = fields.Date.today()
+        date = min(fields.Date.to_date(date) or today, today)
+        kicker_ids = tuple(sorted(kicker_ids)) if kicker_ids is not None else None
+        versions = self.env['kicker.cache.version']._get('kicker.stats', 'kicker.players')
+        rankings = self._get_rankings_data(period, sort, today, kicker_ids, date, versions)
+        previous = {row['id']: row['rank'] for row in self._get_rankings_data(
+            period, sort, today, kicker_ids, date - datetime.timedelta(days=1), versions)}
+        offset = max(0, offset or 0)
+        end = offset + limit if limit and limit > 0 else None
+        return [dict(row, rank_delta=previous[row['id']] - row['rank'] if row['id'] in previous else None)
+                for row in rankings[offset:end]]
+
+    @api.model
+    @tools.ormcache('period', 'sort', 'today', 'kicker_ids', 'date', 'versions')
+    def _get_rankings_data(self, period, sort, today, kicker_ids, date, versions):
+        # cached until the next game is stored (see kicker.game._refresh_stats);
+        # past boards come from the snapshots, only the days since are summed up
+        Snapshot = self.env['kicker.ranking.snapshot']
+        board, params = Snapshot._board_query(period, kicker_ids, date, Snapshot._get_snapshot_date(date))
+        self.env.cr.execute("""
+            SELECT player_id, name, won, lost, matches,
+                   CASE WHEN matches > 0 THEN 100 * won / matches ELSE 0 END AS ratio,
+                   rating
+              FROM (
+                    SELECT b.player_id, p.name, p.rating, b.won, b.lost, b.won + b.lost AS matches
+                      FROM ({board}) AS b
+                      JOIN res_partner p ON (p.id = b.player_id)
+                   ) AS stats
+          ORDER BY {order}, player_id
+        """.format(board=board, order=RANKING_ORDERS[sort]), params)
+        return [{
+            'id': player_id,
+            'rank': rank,
+            'name': name,
+            'won': won,
+            'lost': lost,
+            'matches': matches,
+            'ratio': ratio,
+            'rating': round(rating) if rating is not None else None,
+        } for rank, (player_id, name, won, lost, matches, ratio, rating) in enumerate(self.env.cr.fetchall(), 1)]
+
+    @api.multi
+    def write(self, vals):
+        players = any(self.mapped('kicker_player'))
+        res = super(ResPartner, self).write(vals)
+        if KICKER_PROFILE_FIELDS.intersection(vals) and (players or any(self.mapped('kicker_player'))):
+            # profiles are part of the cached rankings, app data and directory
+            self.env['kicker.cache.version']._bump('kicker.players')
         return res
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        partners = super(ResPartner, self).create(vals_list)
+        if any(partners.mapped('kicker_player')):
+            self.env['kicker.cache.version']._bump('kicker.players')
+        return partners
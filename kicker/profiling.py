@@ -0,0 +1,109 @@
+"""Opt-in profiling of the kicker routes.
+
+Enabled with ``kicker_profiling = True`` in the server configuration file.
+Every request of a route decorated with ``route`` then records its duration,
+SQL query count and time, the time spent in the helpers decorated with
+``helper`` and the size of its payload into a per-process ring buffer of
+``kicker_profiling_buffer`` entries (see /app/json/profiling). Requests over
+``kicker_profiling_budget_ms`` milliseconds or ``kicker_profiling_budget_queries``
+queries are also logged, as JSON.
+"""
+import collections
+import functools
+import json
+import logging
+import threading
+import time
+
+from odoo.tools import config, date_utils
+
+_logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+records = collections.deque(maxlen=int(config.get('kicker_profiling_buffer', 500)))
+
+
+def is_enabled():
+    return bool(config.get('kicker_profiling'))
+
+
+def get_budget():
+    return {
+        'ms': float(config.get('kicker_profiling_budget_ms', 200)),
+        'queries': int(config.get('kicker_profiling_budget_queries', 50)),
+    }
+
+
+def _sql_counters():
+    # the cursors count the queries of the current thread, once it has the counters
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        thread.query_count = 0
+        thread.query_time = 0
+    return thread.query_count, thread.query_time
+
+
+def _payload_size(result):
+    if hasattr(result, 'flatten'):
+        # render lazy QWeb responses now, to measure them
+        result.flatten()
+    if hasattr(result, 'get_data'):
+        return 0 if result.is_streamed else len(result.get_data())
+    return len(json.dumps(result, default=date_utils.json_default))
+
+
+def route(func):
+    """Profile the requests of a controller endpoint (below ``http.route``)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_enabled() or getattr(_local, 'record', None) is not None:
+            return func(*args, **kwargs)
+        query_count, query_time = _sql_counters()
+        record = _local.record = {
+            'route': func.__name__,
+            'start': time.time(),
+            'helpers': collections.defaultdict(float),
+        }
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            size = _payload_size(result)
+        finally:
+            _local.record = None
+        thread = threading.current_thread()
+        record.update(
+            duration=(time.perf_counter() - start) * 1000,
+            queries=thread.query_count - query_count,
+            query_time=(thread.query_time - query_time) * 1000,
+            payload=size,
+            helpers={name: value * 1000 for name, value in record['helpers'].items()},
+        )
+        with _lock:
+            records.append(record)
+        budget = get_budget()
+        if record['duration'] > budget['ms'] or record['queries'] > budget['queries']:
+            _logger.warning("kicker route over budget: %s", json.dumps(record, sort_keys=True))
+        return result
+    return wrapper
+
+
+def helper(func):
+    """Add the time spent in ``func`` to the profile of the current request, if
+    any. Times are inclusive: a helper calling another one counts it too."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = getattr(_local, 'record', None)
+        if record is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record['helpers'][func.__qualname__] += time.perf_counter() - start
+    return wrapper
+
+
+def get_records():
+    with _lock:
+        return list(records)
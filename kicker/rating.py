@@ -0,0 +1,73 @@
+"""Elo ratings of kicker players and of the pairs they form.
+
+A team's strength is the mean rating of its players; after a game every
+player of a team moves by ``k * (score - expected)``, where ``score`` is 1 for
+a win and 0 for a loss. Pairs (two players of the same team) have their own
+rating, updated the same way against the opposing pair, or against the
+opposing player when they played alone.
+
+The functions work on plain dicts so that the same code updates a handful of
+ratings when a game is stored and replays the whole history in one pass.
+"""
+
+DEFAULT_RATING = 1500.0
+DEFAULT_K_FACTOR = 32.0
+
+
+def expected_score(rating, other):
+    """Probability for ``rating`` to win against ``other``."""
+    return 1.0 / (1.0 + 10.0 ** ((other - rating) / 400.0))
+
+
+def pair_key(team):
+    """Key of the pair of ``team`` (a sorted tuple of player ids), None unless it has two players."""
+    return tuple(sorted(team)) if len(team) == 2 else None
+
+
+def rate_game(players, pairs, team_1, team_2, team_1_won, k_factor=DEFAULT_K_FACTOR, initial=DEFAULT_RATING):
+    """Update ``players`` ({player_id: [rating, games]}) and ``pairs``
+    ({(player_id, player_id): [rating, games]}) in place with the result of one game.
+
+    ``team_1`` and ``team_2`` are sequences of player ids; games where a team
+    has no player are ignored.
+    """
+    if not team_1 or not team_2:
+        return
+    score = 1.0 if team_1_won else 0.0
+    for player_id in list(team_1) + list(team_2):
+        players.setdefault(player_id, [initial, 0])
+    strength_1 = sum(players[p][0] for p in team_1) / len(team_1)
+    strength_2 = sum(players[p][0] for p in team_2) / len(team_2)
+    delta = k_factor * (score - expected_score(strength_1, strength_2))
+    for team, team_delta in ((team_1, delta), (team_2, -delta)):
+        for player_id in team:
+            players[player_id][0] += team_delta
+            players[player_id][1] += 1
+
+    pair_1, pair_2 = pair_key(team_1), pair_key(team_2)
+    if not (pair_1 or pair_2):
+        return
+    for pair in (pair_1, pair_2):
+        if pair:
+            pairs.setdefault(pair, [initial, 0])
+    # a player playing alone stands for the whole team
+    strength_1 = pairs[pair_1][0] if pair_1 else strength_1
+    strength_2 = pairs[pair_2][0] if pair_2 else strength_2
+    delta = k_factor * (score - expected_score(strength_1, strength_2))
+    for pair, pair_delta in ((pair_1, delta), (pair_2, -delta)):
+        if pair:
+            pairs[pair][0] += pair_delta
+            pairs[pair][1] += 1
+
+
+def replay(games, k_factor=DEFAULT_K_FACTOR, initial=DEFAULT_RATING, players=None, pairs=None):
+    """Rate an iterable of (team_1, team_2, team_1_won), in order.
+
+    Return the ``(players, pairs)`` dicts, see ``rate_game``; pass them in to
+    continue from existing ratings.
+    """
+    players = {} if players is None else players
+    pairs = {} if pairs is None else pairs
+    for team_1, team_2, team_1_won in games:
+        rate_game(players, pairs, team_1, team_2, team_1_won, k_factor, initial)
+    return players, pairs
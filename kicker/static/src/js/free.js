@@ -0,0 +1,58 @@
+odoo.define('kicker.free', function (require) {
+"use strict";
+
+var ajax = require('web.ajax');
+
+require('web.dom_ready');
+
+/**
+ * The /free page follows the status of its kicker through the bus (long
+ * polling on the kicker.ping channel of the kicker) instead of reloading.
+ * After an error, the status is resynchronized from /free/status.
+ */
+var $free = $('.o_kicker_free[data-kicker-id]');
+if (!$free.length) {
+    return;
+}
+var kickerId = $free.data('kicker-id');
+var last = 0;
+var RETRY_DELAY = 10000;
+
+function setStatus(available) {
+    $('.o_kicker_free_status').toggleClass('d-none', !available);
+    $('.o_kicker_busy_status').toggleClass('d-none', available);
+    $('.o_kicker_bg').each(function () {
+        this.className = this.className.replace(/o_kicker_bg_(yes|no)_/, 'o_kicker_bg_' + (available ? 'yes' : 'no') + '_');
+    });
+}
+
+function resync() {
+    return $.get('/free/status/' + kickerId).then(function (status) {
+        setStatus(status.available);
+    });
+}
+
+function poll() {
+    ajax.jsonRpc('/longpolling/poll', 'call', {
+        channels: [],
+        last: last,
+        options: {kicker_id: kickerId},
+    }, {shadow: true, timeout: 60000}).then(function (notifications) {
+        _.each(notifications, function (notification) {
+            last = Math.max(last, notification.id);
+            var channel = notification.channel;
+            if (channel[1] === 'kicker.ping' && channel[2] === kickerId) {
+                setStatus(notification.message.available);
+            }
+        });
+        poll();
+    }, function () {
+        setTimeout(function () {
+            resync().always(poll);
+        }, RETRY_DELAY);
+    });
+}
+
+poll();
+
+});
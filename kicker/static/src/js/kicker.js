@@ -12,6 +12,54 @@ var _t = core._t;
 
 require('web.dom_ready');
 
+// dashboard, profile, community, kickers and rankings of the month, loaded in
+// one request when the app starts; reset when the user changes any of them.
+// Kept for a few seconds only, so that the widgets of one page share it but
+// navigating refetches it: the ETag makes that a 304 when nothing changed
+var BOOTSTRAP_TTL = 10 * 1000;
+var bootstrap;
+var bootstrapTime = 0;
+function getBootstrap() {
+    if (!bootstrap || Date.now() - bootstrapTime > BOOTSTRAP_TTL) {
+        bootstrapTime = Date.now();
+        bootstrap = $.get('/app/json/bootstrap').then(function (data) {
+            return data;
+        }).fail(function () {
+            bootstrap = undefined;
+        });
+    }
+    return bootstrap;
+}
+function resetBootstrap() {
+    bootstrap = undefined;
+}
+
+// player directory, kept in the local storage: only the changes since the
+// last sync are fetched
+var DIRECTORY_KEY = 'kicker.directory';
+function syncDirectory() {
+    var cache = JSON.parse(local_storage.getItem(DIRECTORY_KEY) || 'null') || {version: false, players: {}};
+    var version;
+    function fetchPage(params) {
+        return $.get('/app/json/directory', params).then(function (data) {
+            version = version || data.version;
+            _.each(data.removed, function (id) {
+                delete cache.players[id];
+            });
+            _.each(data.players, function (player) {
+                cache.players[player.id] = player;
+            });
+            if (data.next) {
+                return fetchPage(_.extend({}, params, data.next));
+            }
+            cache.version = version;
+            local_storage.setItem(DIRECTORY_KEY, JSON.stringify(cache));
+            return _.sortBy(_.values(cache.players), 'name');
+        });
+    }
+    return fetchPage(cache.version ? {since: cache.version, limit: 500} : {limit: 500});
+}
+
 var Dashboard = Widget.extend({
     template: 'Dashboard',
     xmlDependencies: ['/app/static/src/xml/kicker_templates.xml'],
@@ -19,10 +67,10 @@ var Dashboard = Widget.extend({
         this.chartData = {
             type: 'line',
             data: {
-                labels: ['W1', 'W2', 'W3', 'W4', 'W5'],
+                labels: [],
                 datasets: [{
                     label: 'Win/Loss Ratio',
-                    data: [1,1,1,1,1],
+                    data: [],
                 }]
             },
             options: {
@@ -58,17 +106,17 @@ var Dashboard = Widget.extend({
     start: function () {
         var self = this;
         return $.when(
-            rpc.query({
-                route: '/app/json/dashboard',
-            }),
+            getBootstrap(),
             this._super.apply(this, arguments)
         )
-            .then(function(data) {
+            .then(function(bootstrap) {
+                var data = bootstrap.dashboard;
                 self.wins = data.wins;
                 self.losses = data.losses;
                 self.teammates = data.teammates;
                 self.nightmares = data.nightmares;
                 self.chartData.data.datasets[0].data = data.graph;
+                self.chartData.data.labels = data.graph_labels;
                 self.ratioData.data.datasets[0].data = [data.ratio, 100-data.ratio];
                 self.name = data.name;
                 self.renderElement();            
@@ -101,18 +149,13 @@ var Profile = Widget.extend({
     start: function() {
         var self = this;
         return $.when(
-            rpc.query({
-                route: '/app/json/player/'
-            }),
-            rpc.query({
-                route: '/app/json/kickers',
-            }),
+            getBootstrap(),
             this._super.apply(this, arguments)
         )
-        .then(function (player_data, kickers) {
-            self.player = player_data;
-            self.kickers = kickers.kickers;
-            self.default_kicker = kickers.default;
+        .then(function (bootstrap) {
+            self.player = bootstrap.player;
+            self.kickers = bootstrap.kickers.kickers;
+            self.default_kicker = bootstrap.kickers.default;
             self.renderElement();
         });
     },
@@ -160,6 +203,7 @@ var Profile = Widget.extend({
             if (result.errors) {
                 console.log(result.errors);
             } else if (result.success) {
+                resetBootstrap();
                 self.edit = false;
                 self.player = result.player;
                 self.renderElement();
@@ -202,6 +246,7 @@ var Rankings = Widget.extend({
     xmlDependencies: ['/app/static/src/xml/kicker_templates.xml'],
     events: {
         'click .o_ranking_period label': '_changePeriod',
+        'change .o_ranking_kicker': '_changeKicker',
         'sort.bs.table table': '_onSort',
     },
     init: function() {
@@ -210,6 +255,17 @@ var Rankings = Widget.extend({
         this.loaded = false;
         this.reverse_rank = false;
         this.data = false;
+        this.kickers = [];
+        this.kicker_id = 'all';
+    },
+    willStart: function () {
+        var self = this;
+        // the rankings of the bootstrap are the ones of the default scope
+        return $.when(getBootstrap(), this._super.apply(this, arguments)).then(function (data) {
+            self.kickers = data.kickers.kickers;
+            self.kicker_id = data.kicker_ids && data.kicker_ids.length === 1 ? data.kicker_ids[0] : 'all';
+            self.default_kicker_id = self.kicker_id;
+        });
     },
     start: function () {
         var self = this;
@@ -238,6 +294,10 @@ var Rankings = Widget.extend({
                     field: 'name',
                     title: 'Player',
                     formatter: this._nameFormatter,
+                }, {
+                    field: 'rank_delta',
+                    title: '',
+                    formatter: this._rankDeltaFormatter,
                 }, {
                     field: 'won',
                     title: 'Won',
@@ -250,6 +310,10 @@ var Rankings = Widget.extend({
                     field: 'matches',
                     title: 'Matches',
                     sortable: true,
+                }, {
+                    field: 'rating',
+                    title: 'Rating',
+                    sortable: true,
                 }],
                 data: this.data,
             });
@@ -260,13 +324,23 @@ var Rankings = Widget.extend({
         // shitty string literal instead of qweb but well ¯\_(ツ)_/¯
         return `<a href="/app/community/player/${row.id}" data-router="true">${value}</a>`;
     },
+    _rankDeltaFormatter: function(value, row, index) {
+        // places gained since yesterday
+        if (!value) {
+            return '';
+        }
+        return value > 0 ? `<span class="text-success">▲${value}</span>` : `<span class="text-danger">▼${-value}</span>`;
+    },
     _queryData: function() {
         var self=this;
-        return rpc.query({
-            route: '/app/json/rankings',
-            params: {"period": this.period},
-        }).then(function(data) {
-            self.data = data;
+        if (!this.loaded && this.period === 'month' && this.kicker_id === this.default_kicker_id) {
+            return getBootstrap().then(function (data) {
+                self.data = data.rankings;
+            });
+        }
+        // plain GET so that the browser revalidates with the ETag of the rankings
+        return $.get('/app/json/rankings', {period: this.period, kicker_id: this.kicker_id}).then(function(data) {
+            self.data = data.rankings;
         });
     },
     _onSort: function(e, field, order) {
@@ -286,26 +360,68 @@ var Rankings = Widget.extend({
         return this._queryData().then(function(data) {
             self._renderData(data);
         })
+    },
+    _changeKicker: function(ev) {
+        var value = $(ev.target).val();
+        this.kicker_id = value === 'all' ? value : parseInt(value);
+        var self = this;
+        return this._queryData().then(function(data) {
+            self._renderData(data);
+        })
     }
 });
 
 var Community = Widget.extend({
     template: 'Community',
     xmlDependencies: ['/app/static/src/xml/kicker_templates.xml'],
+    events: {
+        'input .o_kicker_search': '_onSearch',
+        'click .o_kicker_more': '_onMore',
+    },
     start: function () {
         var self = this;
         return $.when(
-            rpc.query({
-                route: '/app/json/community',
-            }),
+            getBootstrap(),
             this._super.apply(this, arguments)
         )
-            .then(function(data) {
+            .then(function(bootstrap) {
+                var data = bootstrap.community;
+                // like the first page of rare players, the next ones and the
+                // search results leave out the usual players and the user
+                self.excludeIds = _.pluck(data.usual, 'id').concat([bootstrap.player.id]);
                 self.usual = data.usual;
                 self.rare = data.rare;
+                self.next = data.rare_next;
                 self.renderElement();            
             });
     },
+    _queryDirectory: function (params) {
+        var self = this;
+        var query = _.extend({search: this.search || '', exclude_ids: this.excludeIds.join(',')}, params);
+        return $.get('/app/json/directory', query).then(function (data) {
+            self.rare = params.after_id ? self.rare.concat(data.players) : data.players;
+            self.next = data.next;
+            self._renderPlayers();
+        });
+    },
+    _renderPlayers: function () {
+        var $search = this.$('.o_kicker_search');
+        var hasFocus = $search.is(':focus');
+        this.renderElement();
+        if (hasFocus) {
+            this.$('.o_kicker_search').focus().val(this.search);
+        }
+    },
+    _onSearch: _.debounce(function (ev) {
+        this.search = $(ev.target).val();
+        this._queryDirectory({});
+    }, 300),
+    _onMore: function (ev) {
+        ev.preventDefault();
+        if (this.next) {
+            this._queryDirectory(this.next);
+        }
+    },
 });
 
 
@@ -329,9 +445,7 @@ var AddScore = Widget.extend({
     start: function () {
         var self = this;
         return $.when(
-            rpc.query({
-                route: '/app/json/players',
-            }),
+            syncDirectory(),
             rpc.query({
                 route: '/app/json/kickers',
             }),
@@ -361,6 +475,7 @@ var AddScore = Widget.extend({
             if (result.errors) {
                 console.log(result.errors);
             } else if (result.success) {
+                resetBootstrap();
                 Router.navigate('/app/dashboard');
             }
             return result;
@@ -0,0 +1,50 @@
+"""Per-process snapshot of the kicker statuses, served to the office displays.
+
+Pings update the snapshot of the worker that receives them; the other workers
+reload an entry from the database once it is older than ``ttl`` seconds, so
+that a poll of an unchanged status touches neither the ORM nor, most of the
+time, the database.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from odoo.tools import date_utils
+
+
+class StatusSnapshot(object):
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, dbname, kicker_id):
+        """Return the (status, body, etag) of the kicker (None for the default
+        kicker), or None if it is unknown or outdated."""
+        with self._lock:
+            entry = self._entries.get((dbname, kicker_id))
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def set(self, dbname, kicker_id, status, default=False):
+        """Store the status dict of a kicker, also as the default one if ``default``."""
+        body = json.dumps(status, default=date_utils.json_default, sort_keys=True)
+        value = (status, body, hashlib.md5(body.encode('utf-8')).hexdigest())
+        entry = (time.time(), value)
+        with self._lock:
+            self._entries[(dbname, kicker_id)] = entry
+            default_entry = self._entries.get((dbname, None))
+            if default or (default_entry and default_entry[1][0]['kicker_id'] == kicker_id):
+                self._entries[(dbname, None)] = entry
+        return value
+
+    def clear(self, dbname):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == dbname]:
+                del self._entries[key]
+
+
+kicker_status = StatusSnapshot()
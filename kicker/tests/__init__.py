@@ -0,0 +1,5 @@
+from . import test_matchmaking
+from . import test_submit_games
+from . import test_telemetry
+from . import test_directory
+from . import test_feed
@@ -0,0 +1,24 @@
+from odoo.tests import common
+
+
+class KickerCase(common.TransactionCase):
+    """A kicker and four players."""
+
+    def setUp(self):
+        super(KickerCase, self).setUp()
+        self.kicker = self.env['kicker.kicker'].create({'name': 'Test Kicker', 'location': 'Test Room'})
+        self.players = self.env['res.partner'].create([
+            {'name': 'Player %s' % name, 'kicker_player': True} for name in 'ABCD'
+        ])
+
+    def game_values(self, **values):
+        """Values of a submitted game between the four players, team 1 winning."""
+        return dict({
+            'kicker_id': self.kicker.id,
+            'score1': 11,
+            'score2': 5,
+            'player11': self.players[0].id,
+            'player12': self.players[1].id,
+            'player21': self.players[2].id,
+            'player22': self.players[3].id,
+        }, **values)
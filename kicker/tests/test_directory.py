@@ -0,0 +1,39 @@
+from odoo.tests import common
+
+
+class TestDirectory(common.TransactionCase):
+
+    def setUp(self):
+        super(TestDirectory, self).setUp()
+        self.players = self.env['res.partner'].create([
+            {'name': 'Keyset Player %s' % name, 'kicker_player': True} for name in 'EDCBA'
+        ])
+        self.Partner = self.env['res.partner']
+
+    def test_pages(self):
+        """Following ``next`` lists every player once, in name order."""
+        names, after = [], None
+        while True:
+            page = self.Partner._get_player_directory(search='Keyset Player', after=after, limit=2)
+            names += [player['name'] for player in page['players']]
+            if not page['next']:
+                break
+            after = (page['next']['after_name'], page['next']['after_id'])
+        self.assertEqual(names, ['Keyset Player %s' % name for name in 'ABCDE'])
+
+    def test_limits(self):
+        for limit, count in ((0, 1), (-5, 1), (1, 1), (3, 3), (1000, 5)):
+            page = self.Partner._get_player_directory(search='Keyset Player', limit=limit)
+            self.assertEqual(len(page['players']), count, "limit %s" % limit)
+
+    def test_half_cursor(self):
+        """A cursor with a missing part is ignored rather than giving an empty page."""
+        first = self.Partner._get_player_directory(search='Keyset Player', limit=2)
+        for after in ((None, self.players[-1].id), ('Keyset Player A', None)):
+            page = self.Partner._get_player_directory(search='Keyset Player', after=after, limit=2)
+            self.assertEqual(page['players'], first['players'])
+
+    def test_exclude(self):
+        page = self.Partner._get_player_directory(search='Keyset Player', exclude_ids=self.players[:2].ids)
+        self.assertEqual([player['name'] for player in page['players']],
+                         ['Keyset Player %s' % name for name in 'ABC'])
@@ -0,0 +1,51 @@
+import datetime
+
+from odoo import fields
+
+from .common import KickerCase
+
+
+class TestFeed(KickerCase):
+
+    def setUp(self):
+        super(TestFeed, self).setUp()
+        today = fields.Date.today()
+        # two games on the same day, to page within a day
+        days = [4, 3, 3, 2, 1]
+        results = self.env['kicker.game']._submit_games([
+            self.game_values(key='feed-%s' % i, date=fields.Date.to_string(today - datetime.timedelta(days=day)))
+            for i, day in enumerate(days)
+        ])
+        # most recent first, the latest created first within a day
+        self.game_ids = [results[i]['game_id'] for i in (4, 3, 2, 1, 0)]
+        self.Game = self.env['kicker.game']
+
+    def feed(self, **kwargs):
+        return self.Game._get_feed(kicker_ids=(self.kicker.id,), **kwargs)
+
+    def test_pages(self):
+        """Following ``next`` lists every game once, most recent first."""
+        game_ids, after = [], None
+        while True:
+            page = self.feed(after=after, limit=2)
+            game_ids += [game['id'] for game in page['games']]
+            if not page['next']:
+                break
+            after = (page['next']['after_date'], page['next']['after_id'])
+        self.assertEqual(game_ids, self.game_ids)
+
+    def test_player(self):
+        page = self.feed(player_id=self.players[0].id, limit=10)
+        self.assertEqual([game['id'] for game in page['games']], self.game_ids)
+        self.assertEqual([player['id'] for player in page['games'][0]['team_1']], self.players[:2].ids)
+
+    def test_limits(self):
+        for limit, count in ((0, 1), (-5, 1), (1, 1), (3, 3), (1000, 5)):
+            self.assertEqual(len(self.feed(limit=limit)['games']), count, "limit %s" % limit)
+
+    def test_half_cursor(self):
+        """A cursor with a missing part is ignored rather than giving an empty page."""
+        first = self.feed(limit=2)
+        for after in ((None, self.game_ids[1]), (fields.Date.today(), None)):
+            page = self.feed(after=after, limit=2)
+            self.assertEqual([game['id'] for game in page['games']], [game['id'] for game in first['games']])
@@ -0,0 +1,45 @@
+import itertools
+import random
+import unittest
+
+from odoo.addons.kicker import matchmaking
+from odoo.addons.kicker.rating import pair_key
+
+
+def brute_force_gaps(player_ids, players, pairs, limit):
+    """Gaps of the ``limit`` most balanced matches, comparing every two teams."""
+    teams = list(itertools.combinations(sorted(player_ids), 2))
+    gaps = sorted(abs(matchmaking.team_strength(team_1, players, pairs) - matchmaking.team_strength(team_2, players, pairs))
+                  for team_1, team_2 in itertools.combinations(teams, 2) if not set(team_1) & set(team_2))
+    return gaps[:limit]
+
+
+class TestMatchmaking(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        self.player_ids = list(range(1, 13))
+        self.players = {pid: rng.uniform(1200, 1800) for pid in self.player_ids}
+        self.pairs = {pair_key(team): (rng.uniform(1200, 1800), rng.randrange(1, 30))
+                      for team in itertools.combinations(self.player_ids, 2) if rng.random() < 0.3}
+
+    def test_limits(self):
+        for limit in (0, -1):
+            self.assertEqual(matchmaking.best_matches(self.player_ids, self.players, self.pairs, limit=limit), [])
+        for limit in (1, 5, 40):
+            matches = matchmaking.best_matches(self.player_ids, self.players, self.pairs, limit=limit)
+            gaps = [match['strength_1'] - match['strength_2'] for match in matches]
+            expected = brute_force_gaps(self.player_ids, self.players, self.pairs, limit)
+            self.assertEqual(len(gaps), limit)
+            for gap, expected_gap in zip(gaps, expected):
+                self.assertAlmostEqual(gap, expected_gap)
+
+    def test_matches(self):
+        for match in matchmaking.best_matches(self.player_ids, self.players, self.pairs, limit=10):
+            self.assertFalse(set(match['team_1']) & set(match['team_2']), "teams share no player")
+            self.assertGreaterEqual(match['strength_1'], match['strength_2'], "the stronger team comes first")
+            self.assertGreaterEqual(match['expected'], 0.5)
+
+    def test_small_pool(self):
+        # three players cannot form two teams
+        self.assertEqual(matchmaking.best_matches([1, 2, 3], self.players, self.pairs), [])
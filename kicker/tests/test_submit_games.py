@@ -0,0 +1,35 @@
+from .common import KickerCase
+
+
+class TestSubmitGames(KickerCase):
+
+    def test_malformed_games(self):
+        """Every malformed game gets its own error, the others are created."""
+        games = [
+            self.game_values(key='valid'),
+            dict(self.game_values(key='no-score'), score1=None),
+            {k: v for k, v in self.game_values(key='missing-score').items() if k != 'score2'},
+            self.game_values(key='bad-player', player11='abc'),
+            self.game_values(key='bad-date', date='yesterday'),
+            self.game_values(key='unknown-kicker', kicker_id=self.kicker.id + 1000),
+            'not a game',
+        ]
+        results = self.env['kicker.game']._submit_games(games)
+        self.assertEqual([r['status'] for r in results], ['created'] + ['error'] * 6)
+        self.assertEqual([r['key'] for r in results],
+                         ['valid', 'no-score', 'missing-score', 'bad-player', 'bad-date', 'unknown-kicker', False])
+        self.assertTrue(all(r['error'] for r in results[1:]))
+        self.assertEqual(self.env['kicker.game'].search([('idempotency_key', '!=', False)]).mapped('idempotency_key'),
+                         ['valid'])
+
+    def test_duplicates(self):
+        """Submitting a batch again, or a key twice, creates the games once."""
+        games = [self.game_values(key='a'), self.game_values(key='b', score1=3, score2=11), self.game_values(key='a')]
+        results = self.env['kicker.game']._submit_games(games)
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'duplicate'])
+        self.assertEqual(results[2]['game_id'], results[0]['game_id'])
+
+        replayed = self.env['kicker.game']._submit_games(games)
+        self.assertEqual([r['status'] for r in replayed], ['duplicate'] * 3)
+        self.assertEqual([r['game_id'] for r in replayed], [r['game_id'] for r in results])
+        self.assertEqual(self.env['kicker.game'].search_count([('idempotency_key', 'in', ['a', 'b'])]), 2)
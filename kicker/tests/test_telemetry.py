@@ -0,0 +1,45 @@
+import datetime
+
+from odoo import fields
+
+from .common import KickerCase
+
+
+class TestTelemetry(KickerCase):
+
+    def test_ingest_twice(self):
+        """A batch sent again, e.g. after a lost answer, is stored and rolled up once."""
+        start = fields.Datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(hours=1)
+        samples = [{'date': fields.Datetime.to_string(start + datetime.timedelta(seconds=10 * i)),
+                    'available': i % 2 == 0, 'temperature': 15 + i}
+                   for i in range(12)]
+        Telemetry = self.env['kicker.telemetry']
+        self.assertEqual(Telemetry._ingest(self.kicker.id, samples), 24)
+        self.assertEqual(Telemetry._ingest(self.kicker.id, samples), 0)
+        # and again, within a batch of new samples
+        later = dict(samples[-1], date=fields.Datetime.to_string(start + datetime.timedelta(minutes=5)))
+        self.assertEqual(Telemetry._ingest(self.kicker.id, samples + [later, later]), 2)
+
+        self.assertEqual(Telemetry.search_count([('kicker_id', '=', self.kicker.id)]), 26)
+        rollups = self.env['kicker.telemetry.rollup'].search([
+            ('kicker_id', '=', self.kicker.id), ('metric', '=', 'temperature'), ('resolution', '=', 'hour'),
+        ])
+        self.assertEqual(sum(rollups.mapped('sample_count')), 13)
+
+    def test_status_history(self):
+        """Every change of status of a batch is a ping dated when it happened."""
+        now = fields.Datetime.now().replace(microsecond=0)
+        dates = [now - datetime.timedelta(minutes=minutes) for minutes in (50, 40, 30, 20, 10)]
+        statuses = list(zip(dates, [True, True, False, True, True]))
+        self.env['kicker.ping']._record_statuses(self.kicker.token, statuses)
+
+        pings = self.env['kicker.ping'].search([('kicker_id', '=', self.kicker.id)], order='create_date, id')
+        self.assertEqual(pings.mapped('available'), [True, False, True])
+        self.assertEqual(pings.mapped('create_date'), [dates[0], dates[2], dates[3]])
+        self.assertTrue(self.kicker.is_available)
+        self.assertEqual(self.kicker.last_status_change, dates[3])
+        self.assertEqual(self.kicker.last_seen, dates[4])
+
+        # statuses older than the current one are ignored
+        self.env['kicker.ping']._record_statuses(self.kicker.token, [(dates[1], False)])
+        self.assertEqual(self.env['kicker.ping'].search_count([('kicker_id', '=', self.kicker.id)]), 3)